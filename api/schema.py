@@ -1,12 +1,52 @@
 import asyncio
-from typing import List, Optional
+import dataclasses
+from typing import Any, Dict, FrozenSet, List, Optional, Set
 
 import strawberry
 from campaigns.domain import entities
+from graphql import FieldNode, FragmentSpreadNode, InlineFragmentNode
+from strawberry.utils.str_converters import to_camel_case
 
 from .extensions import ApolloTracingExtension
 
 
+def _collect_selected_names(info, selection_set, names: Set[str]) -> None:
+    if selection_set is None:
+        return
+
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            names.add(selection.name.value)
+        elif isinstance(selection, InlineFragmentNode):
+            _collect_selected_names(info, selection.selection_set, names)
+        elif isinstance(selection, FragmentSpreadNode):
+            fragment = info.fragments[selection.name.value]
+
+            _collect_selected_names(info, fragment.selection_set, names)
+
+
+def get_selected_fields(
+    info, entity_class: Any, required_fields: Dict[str, str] = {}
+) -> FrozenSet[str]:
+    """Returns the fields of the entity that are needed to resolve the
+    selection of the current field, required_fields maps the GraphQL fields
+    that are resolved using another field of the entity, ie. brand needs
+    brand_id."""
+
+    names: Set[str] = set()
+
+    for field_node in info.field_nodes:
+        _collect_selected_names(info, field_node.selection_set, names)
+
+    fields = {required_fields[name] for name in names if name in required_fields}
+
+    for field in dataclasses.fields(entity_class):
+        if to_camel_case(field.name) in names:
+            fields.add(field.name)
+
+    return frozenset(fields)
+
+
 @strawberry.type
 class Brand:
     id: strawberry.ID
@@ -66,7 +106,12 @@ class Campaign:
         print("fetching events", event_ids)
         events = await asyncio.gather(*(loader.load(id) for id in event_ids))
 
-        return [Event.from_entity(e) for e in events]
+        # the cached id list can still have events deleted since then
+        return [Event.from_entity(e) for e in events if e is not None]
+
+
+# fields of the campaign entity needed by the resolvers of Campaign
+CAMPAIGN_REQUIRED_FIELDS = {"brand": "brand_id"}
 
 
 @strawberry.type
@@ -75,8 +120,11 @@ class Query:
     async def campaign(self, info, id: strawberry.ID) -> Optional[Campaign]:
         context = info.context
 
-        campaign_entity = (
-            await context.repositories.campaign_repository.get_campaign_by_id(id)
+        campaign_entity = await context.repositories.campaign_repository.get_by_id(
+            id,
+            fields=get_selected_fields(
+                info, entities.Campaign, CAMPAIGN_REQUIRED_FIELDS
+            ),
         )
 
         if campaign_entity:
@@ -89,7 +137,12 @@ class Query:
         context = info.context
 
         campaign_entities = (
-            await context.repositories.campaign_repository.get_campaigns(first=first)
+            await context.repositories.campaign_repository.get_campaigns(
+                first=first,
+                fields=get_selected_fields(
+                    info, entities.Campaign, CAMPAIGN_REQUIRED_FIELDS
+                ),
+            )
         )
 
         return [Campaign.from_entity(e) for e in campaign_entities]
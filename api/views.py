@@ -3,11 +3,13 @@ from dataclasses import dataclass
 from functools import cached_property
 from typing import List
 
-import aioredis
 from campaigns.domain.repositories.campaign import CampaignRepository
 from campaigns.domain.repositories.brand import BrandRepository
 from campaigns.domain.repositories.event import EventRepository
 from django.http.request import HttpRequest
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+from domain.repositories.backends import CacheBackend, cache_backend
 from domain.repositories.stats import DataFetchingStats
 from strawberry.dataloader import DataLoader
 from strawberry.django.views import AsyncGraphQLView as BaseAsyncGraphQLView
@@ -17,22 +19,22 @@ from strawberry.types.execution import ExecutionResult
 
 class Repositories:
     def __init__(
-        self, redis: aioredis.Redis, data_fetching_stats: DataFetchingStats
+        self, backend: CacheBackend, data_fetching_stats: DataFetchingStats
     ) -> None:
-        self.redis = redis
+        self.backend = backend
         self.data_fetching_stats = data_fetching_stats
 
     @cached_property
     def event_repository(self):
-        return EventRepository(self.redis, self.data_fetching_stats)
+        return EventRepository(self.backend, self.data_fetching_stats)
 
     @cached_property
     def campaign_repository(self):
-        return CampaignRepository(self.redis, self.data_fetching_stats)
+        return CampaignRepository(self.backend, self.data_fetching_stats)
 
     @cached_property
     def brand_repository(self):
-        return BrandRepository(self.redis, self.data_fetching_stats)
+        return BrandRepository(self.backend, self.data_fetching_stats)
 
 
 @dataclass
@@ -60,22 +62,31 @@ class Loaders:
 
 @dataclass
 class Context:
-    redis: aioredis.Redis
+    backend: CacheBackend
 
     repositories: Repositories
     loaders: Loaders
 
 
 class AsyncGraphQLView(BaseAsyncGraphQLView):
+    @method_decorator(csrf_exempt)
+    async def dispatch(self, request, *args, **kwargs):
+        # without the lifespan pool (ie. runserver) the backend has its own
+        # connection, which is closed at the end of the request
+        async with cache_backend() as backend:
+            self.backend = backend
+
+            return await super().dispatch(request, *args, **kwargs)
+
     async def get_context(self, request):
         self.data_fetching_stats = DataFetchingStats()
 
-        redis = await aioredis.create_redis_pool("redis://localhost")
+        backend = self.backend
 
-        repositories = Repositories(redis, self.data_fetching_stats)
+        repositories = Repositories(backend, self.data_fetching_stats)
         loaders = Loaders(repositories)
 
-        return Context(redis=redis, repositories=repositories, loaders=loaders)
+        return Context(backend=backend, repositories=repositories, loaders=loaders)
 
     async def process_result(
         self, request: HttpRequest, result: ExecutionResult
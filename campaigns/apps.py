@@ -3,3 +3,14 @@ from django.apps import AppConfig
 
 class CampaignsConfig(AppConfig):
     name = 'campaigns'
+
+    def ready(self):
+        from domain.repositories.invalidation import register_repository
+
+        from .domain.repositories.brand import BrandRepository
+        from .domain.repositories.campaign import CampaignRepository
+        from .domain.repositories.event import EventRepository
+
+        register_repository(BrandRepository)
+        register_repository(CampaignRepository)
+        register_repository(EventRepository)
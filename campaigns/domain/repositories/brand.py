@@ -9,3 +9,11 @@ from ..entities import Brand
 class BrandRepository(BaseCacheRepository):
     model_class = models.Brand
     entity_class = Brand
+
+    # brands are shared by most campaigns and rarely change
+    DEFAULT_EXPIRE_IN_SECONDS = 60 * 60 * 24
+    LOCAL_CACHE_MAX_SIZE = 1000
+    # brands that are still used never expire
+    SLIDING_EXPIRE_RATIO = 0.5
+    # the front page requests all read the same brands at the same time
+    COALESCE_READS = True
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from asyncio.tasks import gather
-from typing import List
+from typing import Iterable, List, Optional
 
 from asgiref.sync import sync_to_async
 from campaigns import models
@@ -15,12 +15,39 @@ class CampaignRepository(BaseCacheRepository):
     model_class = models.Campaign
     entity_class = Campaign
 
+    # bodies can be large
+    COMPRESSION_MIN_SIZE_IN_BYTES = 1024
+
+    REFRESH_AHEAD_BETA = 1.0
+    # slightly stale titles are fine on listing pages, latency spikes are not
+    STALE_WHILE_REVALIDATE_IN_SECONDS = 60
+
+    # listing pages usually don't need the body
+    HASH_STORAGE = True
+
+    CACHE_ID_LISTS = True
+
+    # campaign pages are crawled with made up ids
+    EXISTENCE_FILTER = True
+
     @increase_sql_queries
     @sync_to_async
-    def _get_campaigns_ids(self, first: int) -> List[Campaign]:
+    def _get_campaigns_ids_from_db(self, first: int) -> List[int]:
         return list(self.model_class.objects.all().values_list("id", flat=True)[:first])
 
-    async def get_campaigns(self, first: int) -> List[Campaign]:
+    async def _get_campaigns_ids(self, first: int) -> List[int]:
+        return await self._get_cached_ids(
+            "campaigns",
+            [first],
+            [models.Campaign],
+            lambda: self._get_campaigns_ids_from_db(first),
+        )
+
+    async def get_campaigns(
+        self, first: int, fields: Optional[Iterable[str]] = None
+    ) -> List[Campaign]:
         ids = await self._get_campaigns_ids(first)
+        campaigns = await gather(*(self.get_by_id(str(id), fields) for id in ids))
 
-        return await gather(*(self.get_by_id(id) for id in ids))
+        # the cached id list can still have campaigns deleted since then
+        return [campaign for campaign in campaigns if campaign is not None]
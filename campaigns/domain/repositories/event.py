@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import List
+from typing import List, Optional
 
 from asgiref.sync import sync_to_async
 from campaigns import models
@@ -12,6 +12,17 @@ from ..entities import Event
 
 
 class EventRepository(BaseCacheRepository):
+    model_class = models.Event
+    entity_class = Event
+
+    # bodies can be large
+    COMPRESSION_MIN_SIZE_IN_BYTES = 1024
+
+    CACHE_ID_LISTS = True
+
+    # events are edited often, so their expiry follows how often they change
+    ADAPTIVE_EXPIRE = True
+
     @increase_sql_queries
     @sync_to_async
     def get_events_for_campaign(self, campaign_id: str) -> List[Event]:
@@ -21,43 +32,22 @@ class EventRepository(BaseCacheRepository):
 
     @increase_sql_queries
     @sync_to_async
-    def get_event_ids(self, campaign_id: str, first: int) -> List[str]:
+    def _get_event_ids_from_db(self, campaign_id: str, first: int) -> List[str]:
         return list(
             models.Event.objects.filter(campaign__id=campaign_id).values_list(
                 "id", flat=True
             )[:first]
         )
 
-    @increase_sql_queries
-    @sync_to_async
-    def _get_events_from_db(self, ids: List[str]) -> List[models.Event]:
-        return list(models.Event.objects.filter(id__in=ids))
-
-    async def get_events_batch(self, event_ids: List[str]) -> List[Event]:
-        entities = await self._get_cached_entities_batch(event_ids, Event)
-
-        if all(entities):
-            return entities
-
-        entities_dict = {}
-
-        missing_events_ids = []
-
-        for event_id, entity in zip(event_ids, entities):
-            entities_dict[str(event_id)] = entity
-
-            if not entity:
-                missing_events_ids.append(event_id)
-
-        missing_events_db = await self._get_events_from_db(missing_events_ids)
-        missing_entities = []
-
-        for db_event in missing_events_db:
-            entity = convert_django_model(db_event)
-
-            missing_entities.append(entity)
-            entities_dict[str(db_event.id)] = entity
-
-        await self._cache_entities_batch(missing_entities)
+    async def get_event_ids(self, campaign_id: str, first: int) -> List[str]:
+        # deleting a campaign deletes its rows of the through table without
+        # sending m2m_changed, so we also depend on the campaigns table
+        return await self._get_cached_ids(
+            "campaign-events",
+            [campaign_id, first],
+            [models.Event, models.Campaign, models.Campaign.events.through],
+            lambda: self._get_event_ids_from_db(campaign_id, first),
+        )
 
-        return list(entities_dict.values())
+    async def get_events_batch(self, event_ids: List[str]) -> List[Optional[Event]]:
+        return await self.get_batch_by_ids(event_ids)
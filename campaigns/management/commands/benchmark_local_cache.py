@@ -0,0 +1,128 @@
+import bisect
+import itertools
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from campaigns.domain.converters import convert_event
+from campaigns.domain.entities import Event
+from campaigns.factories import EventFactory
+from domain.repositories.local import LocalCache
+from domain.repositories.tinylfu import TinyLfuCache, get_size_in_bytes
+
+
+def _generate_trace(keys, requests, skew, scan_ratio, seed):
+    """Returns ids drawn from a Zipfian distribution over keys ids, mixed with
+    a sequential scan of ids that are only read once (like a crawler walking
+    every campaign)."""
+
+    rng = random.Random(seed)
+    cumulative_weights = list(
+        itertools.accumulate(1 / rank**skew for rank in range(1, keys + 1))
+    )
+    total_weight = cumulative_weights[-1]
+    scan = itertools.count(keys)
+
+    trace = []
+
+    for _ in range(requests):
+        if rng.random() < scan_ratio:
+            trace.append(str(next(scan)))
+        else:
+            index = bisect.bisect(cumulative_weights, rng.random() * total_weight)
+            trace.append(str(min(index, keys - 1)))
+
+    return trace
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the LRU and the W-TinyLFU local caches on a Zipfian trace "
+        "of event reads mixed with a scan."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size-in-bytes", type=int, default=5_000_000)
+        parser.add_argument("--keys", type=int, default=100_000)
+        parser.add_argument("--requests", type=int, default=500_000)
+        parser.add_argument(
+            "--skew", type=float, default=1.0, help="exponent of the distribution"
+        )
+        parser.add_argument(
+            "--scan-ratio",
+            type=float,
+            default=0.2,
+            help="share of the requests that read ids only once",
+        )
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        size_in_bytes = options["size_in_bytes"]
+
+        events = [
+            convert_event(EventFactory.build(id=index), lambda model: None)
+            for index in range(100)
+        ]
+
+        def load(id):
+            event = events[int(id) % len(events)]
+
+            return Event(id=id, title=event.title, body=event.body)
+
+        average_size_in_bytes = sum(
+            get_size_in_bytes(event.id) + get_size_in_bytes(event) for event in events
+        ) / len(events)
+
+        trace = _generate_trace(
+            options["keys"],
+            options["requests"],
+            options["skew"],
+            options["scan_ratio"],
+            options["seed"],
+        )
+
+        caches = {
+            # the LRU is bounded by number of entities, so we give it as many
+            # as fit in the same memory
+            "lru": LocalCache(int(size_in_bytes // average_size_in_bytes), 3600),
+            "w-tinylfu": TinyLfuCache(size_in_bytes, 3600),
+        }
+
+        self.stdout.write(
+            f"{len(trace)} reads of {options['keys']} ids "
+            f"(skew {options['skew']}, {options['scan_ratio']:.0%} scan), "
+            f"{size_in_bytes} bytes, about {average_size_in_bytes:.0f} bytes "
+            "per event\n"
+        )
+        self.stdout.write(
+            f"{'policy':<12}{'hit ratio':>12}{'entries':>10}{'bytes':>12}"
+            f"{'rejections':>12}{'time (ms)':>12}"
+        )
+
+        for name, cache in caches.items():
+            hits = 0
+            started_at = time.perf_counter()
+
+            for id in trace:
+                if cache.get(id) is not None:
+                    hits += 1
+                else:
+                    cache.set(id, load(id))
+
+            elapsed = time.perf_counter() - started_at
+
+            if isinstance(cache, TinyLfuCache):
+                used_in_bytes = cache.size_in_bytes
+                rejections = cache.rejections
+            else:
+                used_in_bytes = sum(
+                    get_size_in_bytes(key) + get_size_in_bytes(value)
+                    for key, (_, value) in cache._data.items()
+                )
+                rejections = 0
+
+            self.stdout.write(
+                f"{name:<12}{hits / len(trace):>12.2%}{len(cache):>10}"
+                f"{used_in_bytes:>12}{rejections:>12}{elapsed * 1000:>12.0f}"
+            )
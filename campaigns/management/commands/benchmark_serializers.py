@@ -0,0 +1,82 @@
+import dataclasses
+import json
+import timeit
+from typing import Any, Callable, Dict, List, Tuple
+
+from dacite.core import from_dict
+from django.core.management.base import BaseCommand
+
+from campaigns.domain.converters import convert_event
+from campaigns.domain.entities import Event
+from campaigns.factories import EventFactory
+from domain.repositories.entry import create_entry
+from domain.repositories.serializers import (
+    JSONSerializer,
+    MsgPackSerializer,
+    Serializer,
+    decode_entry,
+)
+
+Encode = Callable[[], List[Any]]
+Decode = Callable[[List[Any]], List[Any]]
+
+
+class Command(BaseCommand):
+    help = "Compares the cache serializers on a batch of events."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        repeat = options["repeat"]
+
+        events = [
+            convert_event(EventFactory.build(id=index), lambda model: None)
+            for index in range(batch_size)
+        ]
+        entries = [create_entry(event, 300) for event in events]
+
+        def encode_entries(serializer: Serializer) -> Encode:
+            return lambda: [serializer.dumps(entry) for entry in entries]
+
+        formats: Dict[str, Tuple[Encode, Decode]] = {
+            # what we used before having serializers, as a baseline
+            "json (asdict + dacite)": (
+                lambda: [json.dumps(dataclasses.asdict(event)) for event in events],
+                lambda values: [
+                    from_dict(Event, json.loads(value)) for value in values
+                ],
+            ),
+        }
+
+        for name, serializer in (
+            ("json", JSONSerializer()),
+            ("msgpack", MsgPackSerializer()),
+        ):
+            formats[name] = (
+                encode_entries(serializer),
+                lambda values: [decode_entry(value, Event) for value in values],
+            )
+
+        self.stdout.write(
+            f"{batch_size} events, best of {repeat} runs, times are per batch\n"
+        )
+        self.stdout.write(
+            f"{'format':<24}{'encode (ms)':>14}{'decode (ms)':>14}{'avg bytes':>12}"
+        )
+
+        for name, (encode, decode) in formats.items():
+            values = encode()
+
+            encode_time = min(timeit.repeat(encode, number=1, repeat=repeat))
+            decode_time = min(
+                timeit.repeat(lambda: decode(values), number=1, repeat=repeat)
+            )
+            average_size = sum(len(value) for value in values) / len(values)
+
+            self.stdout.write(
+                f"{name:<24}{encode_time * 1000:>14.2f}"
+                f"{decode_time * 1000:>14.2f}{average_size:>12.0f}"
+            )
@@ -0,0 +1,52 @@
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+
+from domain.repositories.existence import (
+    build_existence_filter,
+    save_existence_filter,
+)
+from domain.repositories.invalidation import get_registered_repositories
+
+
+class Command(BaseCommand):
+    help = (
+        "Builds the existence filters of the given types from their tables and "
+        "saves them in redis and in EXISTENCE_FILTERS_DIR, so that the workers "
+        "don't need to build them."
+    )
+
+    def add_arguments(self, parser):
+        repositories = get_registered_repositories()
+
+        parser.add_argument(
+            "--models",
+            nargs="+",
+            choices=sorted(
+                name
+                for name, repository_class in repositories.items()
+                if repository_class.EXISTENCE_FILTER
+            ),
+            help="defaults to all the types with an existence filter",
+        )
+
+    def handle(self, *args, **options):
+        repositories = get_registered_repositories()
+        names = options["models"] or sorted(
+            name
+            for name, repository_class in repositories.items()
+            if repository_class.EXISTENCE_FILTER
+        )
+
+        async_to_sync(self.build)([repositories[name] for name in names])
+
+    async def build(self, repository_classes):
+        for repository_class in repository_classes:
+            bloom_filter, max_pk = await build_existence_filter(repository_class)
+
+            await save_existence_filter(repository_class, bloom_filter, max_pk)
+
+            self.stdout.write(
+                f"{repository_class.entity_class.__name__}: "
+                f"{bloom_filter.size_in_bits // 8} bytes, "
+                f"{bloom_filter.number_of_hashes} hashes, up to pk {max_pk}"
+            )
@@ -0,0 +1,29 @@
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+
+from domain.repositories.backends import cache_backend
+from domain.repositories.bus import get_invalidation_bus
+from domain.repositories.generations import bump_generation
+from domain.repositories.invalidation import get_registered_repositories
+
+
+class Command(BaseCommand):
+    help = "Invalidates all the cached entities of the given types."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "entities", nargs="+", choices=sorted(get_registered_repositories())
+        )
+
+    def handle(self, *args, **options):
+        async_to_sync(self.invalidate)(options["entities"])
+
+    async def invalidate(self, entities):
+        async with cache_backend() as backend:
+            for name in entities:
+                generation = await bump_generation(backend, name)
+
+                self.stdout.write(f"{name} is now at generation {generation}")
+
+        # the generation is not part of the keys of the local caches
+        await get_invalidation_bus().publish_now({}, flush=entities)
@@ -0,0 +1,135 @@
+import asyncio
+import time
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.management.base import BaseCommand, CommandError
+
+from domain.converter import convert_django_model
+from domain.repositories.backends import cache_backend
+from domain.repositories.invalidation import get_registered_repositories
+from domain.repositories.stats import DataFetchingStats
+
+
+def _read_chunks(queryset, chunk_size):
+    """Streams the rows of the queryset (using a server side cursor where the
+    database supports it) and yields them as lists of entities."""
+
+    chunk = []
+
+    for instance in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(convert_django_model(instance))
+
+        if len(chunk) == chunk_size:
+            yield chunk
+
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = "Loads all the entities of the given types into the cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--models",
+            nargs="+",
+            choices=sorted(get_registered_repositories()),
+            help="entities to warm up, defaults to all of them",
+        )
+        parser.add_argument("--chunk-size", type=int, default=500)
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=4,
+            help="number of chunks that can be written at the same time",
+        )
+        parser.add_argument(
+            "--rate-limit",
+            type=float,
+            default=0,
+            help="max number of entities written per second, 0 means no limit",
+        )
+
+    def handle(self, *args, **options):
+        repositories = get_registered_repositories()
+        names = options["models"] or sorted(repositories)
+
+        async_to_sync(self.warm)(
+            [repositories[name] for name in names],
+            options["chunk_size"],
+            options["concurrency"],
+            options["rate_limit"],
+        )
+
+    async def warm(self, repository_classes, chunk_size, concurrency, rate_limit):
+        failed = []
+
+        async with cache_backend() as backend:
+            for repository_class in repository_classes:
+                repository = repository_class(backend, DataFetchingStats())
+
+                await self.warm_repository(
+                    repository, chunk_size, concurrency, rate_limit
+                )
+
+                if repository.stats.number_of_cache_failures:
+                    failed.append(repository.entity_class.__name__)
+
+        if failed:
+            raise CommandError(f"Unable to cache all the {', '.join(failed)} entities")
+
+    async def warm_repository(self, repository, chunk_size, concurrency, rate_limit):
+        name = repository.entity_class.__name__
+        queryset = repository.model_class.objects.order_by("pk")
+
+        # sync_to_async is thread sensitive, so the cursor is always used
+        # from the same thread
+        chunks = await sync_to_async(_read_chunks)(queryset, chunk_size)
+        read_chunk = sync_to_async(next)
+
+        semaphore = asyncio.Semaphore(concurrency)
+        writes = set()
+
+        started_at = time.perf_counter()
+        count = 0
+
+        async def write(entities):
+            try:
+                await repository.write_to_cache(entities)
+            finally:
+                semaphore.release()
+
+        while True:
+            entities = await read_chunk(chunks, None)
+
+            if entities is None:
+                break
+
+            await semaphore.acquire()
+
+            count += len(entities)
+
+            write_task = asyncio.ensure_future(write(entities))
+            writes.add(write_task)
+            write_task.add_done_callback(writes.discard)
+
+            if rate_limit > 0:
+                # waits until we are back under the limit
+                delay = count / rate_limit - (time.perf_counter() - started_at)
+
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+        if writes:
+            await asyncio.gather(*writes)
+
+        elapsed = time.perf_counter() - started_at
+
+        self.stdout.write(
+            f"{name}: cached {count} entities in {elapsed:.2f}s "
+            f"({count / elapsed if elapsed else 0:.0f} entities/s, "
+            f"{repository.stats.number_of_redis_sets} batches, "
+            f"{repository.stats.number_of_cache_failures} failed)"
+        )
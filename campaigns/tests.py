@@ -1,3 +1,897 @@
-from django.test import TestCase
+import asyncio
+import os
+import tempfile
+from contextlib import asynccontextmanager
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import aioredis
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+
+from campaigns.domain import entities
+from campaigns.domain.repositories.brand import BrandRepository
+from campaigns.domain.repositories.campaign import CampaignRepository
+from campaigns.management.commands import warm_cache
+from campaigns.models import Brand, Campaign
+from domain import redis_cluster, redis_pool
+from domain.entities import EntityDecodeError, convert_data_to_entity
+from domain.redis_cluster import HASH_SLOTS
+from domain.repositories import existence, generations, invalidation
+from domain.repositories import backends, bloom
+from domain.repositories import breaker as breaker_module
+from domain.repositories.backends import (
+    CacheUnavailable,
+    DjangoCacheBackend,
+    InMemoryBackend,
+    RedisBackend,
+    _guarded,
+    cache_backend,
+    get_cache_backend,
+)
+from domain.repositories.bloom import BloomFilter, get_parameters
+from domain.repositories.breaker import CircuitBreaker, get_circuit_breaker
+from domain.repositories.chunks import run_in_chunks
+from domain.repositories.coalescer import ReadCoalescer
+from domain.repositories.local import clear_local_caches
+from domain.repositories.serializers import compress_value, decode_entry
+from domain.repositories.singleflight import SingleFlight
+from domain.repositories.stats import DataFetchingStats
+
+# the redis backend needs a server, so it's not tested here
+BACKENDS = ["memory", "django"]
+
+
+class RecordingBackend(RedisBackend):
+    """Redis backend that records its reads instead of sending them."""
+
+    def __init__(self, values=None, error=None):
+        super().__init__(redis=None)
+
+        self.values = values or {}
+        self.error = error
+        self.reads = []
+
+    async def get_many(self, keys):
+        self.reads.append(keys)
+
+        if self.error is not None:
+            raise self.error
+
+        return [self.values.get(key) for key in keys]
+
+
+class SingleFlightTestCase(SimpleTestCase):
+    async def test_coalesces_keys_in_flight(self):
+        single_flight = SingleFlight()
+        calls = []
+
+        async def load(keys):
+            calls.append(keys)
+
+            await asyncio.sleep(0.01)
+
+            return {key: f"value-{key}" for key in keys}
+
+        (first, _), (second, coalesced) = await asyncio.gather(
+            single_flight.do_many(["a"], load),
+            single_flight.do_many(["a", "b"], load),
+        )
+
+        self.assertEqual(calls, [["a"], ["b"]])
+        self.assertEqual(first, {"a": "value-a"})
+        self.assertEqual(second, {"a": "value-a", "b": "value-b"})
+        self.assertEqual(coalesced, 1)
+
+    async def test_forgets_own_call_while_awaiting_another_one(self):
+        single_flight = SingleFlight()
+        versions = {"a": 1, "b": 1}
+
+        async def load(keys):
+            # the first load is slower than the one started by the second
+            # caller, so that one is done while it's awaiting the first
+            await asyncio.sleep(0.05 if keys == ["a"] else 0)
+
+            return {key: f"v{versions[key]}-{key}" for key in keys}
+
+        await asyncio.gather(
+            single_flight.do_many(["a"], load),
+            single_flight.do_many(["a", "b"], load),
+        )
+
+        self.assertEqual(single_flight._calls, {})
+
+        versions["b"] = 2
+
+        results, coalesced = await single_flight.do_many(["b"], load)
+
+        self.assertEqual(results, {"b": "v2-b"})
+        self.assertEqual(coalesced, 0)
+
+
+class RemoteBrandRepository(BrandRepository):
+    LOCAL_CACHE_MAX_SIZE = 0
+
+
+@override_settings(CACHE_BACKEND="memory")
+class CoalescedMissesTestCase(TransactionTestCase):
+    async def test_fetches_concurrent_misses_once(self):
+        brand = await sync_to_async(Brand.objects.create)(name="brand")
+        backend = InMemoryBackend()
+        stats = DataFetchingStats()
+
+        first, second = await asyncio.gather(
+            RemoteBrandRepository(backend, stats).get_by_id(brand.id),
+            RemoteBrandRepository(backend, stats).get_by_id(brand.id),
+        )
+
+        self.assertEqual(first, second)
+        self.assertEqual(stats.number_of_sql_calls, 1)
+        self.assertEqual(stats.number_of_coalesced_misses, 1)
+
+
+class ReadCoalescerTestCase(SimpleTestCase):
+    async def test_merges_concurrent_reads(self):
+        backend = RecordingBackend({"a": b"1", "b": b"2", "c": b"3"})
+        coalescer = ReadCoalescer(window_in_ms=5, max_keys=100)
+
+        first, second = await asyncio.gather(
+            coalescer.read(backend, ["a", "b"]),
+            coalescer.read(backend, ["b", "c", "d"]),
+        )
+
+        self.assertEqual(backend.reads, [["a", "b", "c", "d"]])
+        self.assertEqual(first, ([b"1", b"2"], True, 0))
+        self.assertEqual(second, ([b"2", b"3", None], True, 1))
+
+    async def test_sends_full_batches_once(self):
+        backend = RecordingBackend()
+        coalescer = ReadCoalescer(window_in_ms=5, max_keys=3)
+
+        await asyncio.gather(
+            coalescer.read(backend, ["a", "b"]),
+            coalescer.read(backend, ["c", "d"]),
+        )
+
+        # waits for the end of the window of the first batch
+        await asyncio.sleep(0.01)
+
+        self.assertEqual(backend.reads, [["a", "b"], ["c", "d"]])
+
+    async def test_raises_errors_to_every_caller(self):
+        backend = RecordingBackend(error=CacheUnavailable("down"))
+        coalescer = ReadCoalescer(window_in_ms=1, max_keys=100)
+
+        results = await asyncio.gather(
+            coalescer.read(backend, ["a"]),
+            coalescer.read(backend, ["b"]),
+            return_exceptions=True,
+        )
+
+        self.assertEqual(len(backend.reads), 1)
+        self.assertTrue(all(isinstance(r, CacheUnavailable) for r in results))
+
+
+class GenerationsTestCase(SimpleTestCase):
+    async def test_reads_bumped_generations(self):
+        for backend in [InMemoryBackend(), DjangoCacheBackend()]:
+            with self.subTest(backend=type(backend).__name__):
+                await generations.bump_generation(backend, "Test")
+                await generations.bump_generation(backend, "Test")
+
+                # forgets the generations read by this process
+                generations._generations.clear()
+
+                self.assertEqual(await generations.get_generation(backend, "Test"), 2)
+
+                await backend.delete_many([generations._get_generation_key("Test")])
+
+
+class InvalidationTestCase(TransactionTestCase):
+    def tearDown(self):
+        clear_local_caches()
+        generations._generations.clear()
+
+    async def test_invalidates_saved_entities(self):
+        for name in BACKENDS:
+            with self.subTest(backend=name), override_settings(CACHE_BACKEND=name):
+                brand = await sync_to_async(Brand.objects.create)(name="old")
+                repository = BrandRepository(
+                    await get_cache_backend(), DataFetchingStats()
+                )
+
+                self.assertEqual((await repository.get_by_id(brand.id)).name, "old")
+
+                brand.name = "new"
+
+                with mock.patch.object(invalidation.logger, "exception") as log:
+                    await sync_to_async(brand.save)()
+
+                log.assert_not_called()
+                self.assertEqual((await repository.get_by_id(brand.id)).name, "new")
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class CircuitBreakerTestCase(SimpleTestCase):
+    def setUp(self):
+        self.clock = Clock()
+
+        patcher = mock.patch.object(breaker_module.time, "monotonic", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_opens_after_failures_in_a_row(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout_in_seconds=1)
+
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+
+        self.assertEqual(breaker.state, breaker_module.CLOSED)
+
+        breaker.record_failure()
+
+        self.assertEqual(breaker.state, breaker_module.OPEN)
+        self.assertFalse(breaker.allow_request())
+
+    def test_lets_one_trial_through_when_half_open(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout_in_seconds=1)
+
+        breaker.record_failure()
+        self.clock.now = 1
+
+        self.assertTrue(breaker.allow_request())
+        self.assertEqual(breaker.state, breaker_module.HALF_OPEN)
+        self.assertFalse(breaker.allow_request())
+
+        breaker.record_cancellation()
+
+        self.assertTrue(breaker.allow_request())
+
+        breaker.record_success()
+
+        self.assertEqual(breaker.state, breaker_module.CLOSED)
+        self.assertEqual(breaker.open_time_in_seconds, 1)
+
+    def test_counts_the_time_open_before_a_failed_trial(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout_in_seconds=0.25)
+
+        breaker.record_failure()
+        self.clock.now = 0.25
+
+        self.assertTrue(breaker.allow_request())
+
+        breaker.record_failure()
+
+        self.assertFalse(breaker.allow_request())
+
+        self.clock.now = 0.5
+
+        self.assertTrue(breaker.allow_request())
+
+        breaker.record_success()
+
+        self.assertEqual(breaker.open_time_in_seconds, 0.5)
+
+    async def test_releases_the_trial_after_unexpected_errors(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout_in_seconds=1)
+        backend = BrokenBackend(redis=mock.Mock(), breaker=breaker)
+
+        breaker.record_failure()
+        self.clock.now = 1
+
+        with self.assertRaises(ValueError):
+            await backend.get_many(["a"])
+
+        self.assertTrue(breaker.allow_request())
+
+
+class BrokenBackend(RedisBackend):
+    @_guarded
+    async def get_many(self, keys):
+        raise ValueError("not a redis error")
+
+
+class RedisBackendTestCase(SimpleTestCase):
+    async def test_only_reads_hashes_as_misses(self):
+        redis = mock.Mock()
+        backend = RedisBackend(redis)
+
+        redis.get = mock.AsyncMock(
+            side_effect=aioredis.ReplyError("WRONGTYPE Operation against a key")
+        )
+
+        self.assertEqual(await backend.get_many(["a"]), [None])
+
+        redis.get = mock.AsyncMock(
+            side_effect=aioredis.ReplyError("MOVED 3999 127.0.0.1:6381")
+        )
+
+        with self.assertRaises(CacheUnavailable):
+            await backend.get_many(["a"])
+
+
+class CacheBackendTestCase(SimpleTestCase):
+    @override_settings(CACHE_BACKEND="redis", CACHE_COMMAND_TIMEOUT_IN_SECONDS=0.5)
+    async def test_guards_the_backend_used_outside_of_requests(self):
+        @asynccontextmanager
+        async def redis_client():
+            yield mock.Mock()
+
+        with mock.patch.object(backends, "redis_client", redis_client):
+            async with cache_backend() as backend:
+                self.assertIs(backend.breaker, get_circuit_breaker())
+                self.assertEqual(backend.timeout_in_seconds, 0.5)
+
+
+async def refuse_connection():
+    raise ConnectionRefusedError("redis is down")
+
+
+# the invalidation signals use the cache backend setting, not the backend
+# of the repository
+@override_settings(CACHE_BACKEND="memory")
+class DegradedModeTestCase(TransactionTestCase):
+    def tearDown(self):
+        clear_local_caches()
+
+    @mock.patch("domain.repositories.backends.get_redis_pool", refuse_connection)
+    async def test_fetches_from_the_db_when_redis_is_down(self):
+        brand = await sync_to_async(Brand.objects.create)(name="brand")
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout_in_seconds=60)
+        stats = DataFetchingStats()
+        repository = BrandRepository(RedisBackend(breaker=breaker), stats)
+
+        for _ in range(2):
+            self.assertEqual((await repository.get_by_id(brand.id)).name, "brand")
+
+        self.assertEqual(breaker.state, breaker_module.OPEN)
+        self.assertEqual(stats.number_of_cache_failures, 2)
+        self.assertEqual(stats.number_of_degraded_fetches, 2)
+        self.assertEqual(stats.cache_breaker_state, breaker_module.OPEN)
+
+
+@override_settings(CACHE_BACKEND="memory")
+class HashStorageTestCase(TransactionTestCase):
+    def tearDown(self):
+        clear_local_caches()
+
+    async def test_compresses_big_fields(self):
+        brand = await sync_to_async(Brand.objects.create)(name="brand")
+        campaign = await sync_to_async(Campaign.objects.create)(
+            title="title", brand=brand, body="body " * 1000
+        )
+        backend = InMemoryBackend()
+        stats = DataFetchingStats()
+        repository = CampaignRepository(backend, stats)
+
+        await repository.get_by_id(campaign.id)
+
+        (key,) = await repository._get_caching_keys([str(campaign.id)])
+        ((title, body),) = await backend.get_hashes([key], ["title", "body"])
+
+        self.assertEqual(title, b'"title"')
+        self.assertTrue(body.startswith(b"\x02"))
+        self.assertGreater(stats.compression_ratio, 10)
+
+        stats = DataFetchingStats()
+        cached_campaign = await CampaignRepository(backend, stats).get_by_id(
+            campaign.id
+        )
+
+        self.assertEqual(cached_campaign.body, campaign.body)
+        self.assertEqual(stats.number_of_sql_calls, 0)
+
+
+@override_settings(CACHE_BACKEND="memory")
+class IdListTestCase(TransactionTestCase):
+    def tearDown(self):
+        clear_local_caches()
+        generations._generations.clear()
+
+    async def test_saved_rows_invalidate_the_cached_id_lists(self):
+        brand = await sync_to_async(Brand.objects.create)(name="brand")
+        create_campaign = sync_to_async(Campaign.objects.create)
+        # the invalidations use the backend of the CACHE_BACKEND setting
+        backend = await get_cache_backend()
+
+        async def get_campaign_ids():
+            stats = DataFetchingStats()
+            campaigns = await CampaignRepository(backend, stats).get_campaigns(10)
+
+            return [campaign.id for campaign in campaigns], stats
+
+        first = await create_campaign(title="first", brand=brand, body="body")
+
+        await get_campaign_ids()
+        ids, stats = await get_campaign_ids()
+
+        self.assertEqual(ids, [str(first.id)])
+        self.assertEqual(stats.number_of_id_list_hits, 1)
+
+        second = await create_campaign(title="second", brand=brand, body="body")
+
+        ids, stats = await get_campaign_ids()
+
+        self.assertEqual(ids, [str(first.id), str(second.id)])
+        self.assertEqual(stats.number_of_id_list_misses, 1)
+
+
+class TinyLfuBrandRepository(BrandRepository):
+    LOCAL_CACHE_MAX_SIZE = 0
+    LOCAL_CACHE_MAX_SIZE_IN_BYTES = 100_000
+
+
+@override_settings(CACHE_BACKEND="memory")
+class LocalCacheTestCase(TransactionTestCase):
+    def setUp(self):
+        # the brand local cache of the other tests is an LRU
+        patcher = mock.patch.dict("domain.repositories.local._local_caches", clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        clear_local_caches()
+
+    async def test_reports_the_stats_of_the_tinylfu_cache(self):
+        brand = await sync_to_async(Brand.objects.create)(name="brand")
+        backend = InMemoryBackend()
+
+        for _ in range(3):
+            stats = DataFetchingStats()
+
+            await TinyLfuBrandRepository(backend, stats).get_by_id(brand.id)
+
+        local_cache_stats = stats.local_caches["Brand"]
+
+        self.assertEqual(local_cache_stats["entries"], 1)
+        self.assertEqual(local_cache_stats["hits"], 2)
+        self.assertGreater(local_cache_stats["size_in_bytes"], 0)
+
+
+class HotKeyBrandRepository(BrandRepository):
+    LOCAL_CACHE_MAX_SIZE = 0
+    HOT_KEY_THRESHOLD = 2
+
+
+@override_settings(CACHE_BACKEND="memory")
+class HotKeysTestCase(TransactionTestCase):
+    def setUp(self):
+        patcher = mock.patch.dict("domain.repositories.hotkeys._hot_keys", clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        clear_local_caches()
+
+    async def test_reports_the_hot_keys_of_the_process(self):
+        brand = await sync_to_async(Brand.objects.create)(name="brand")
+        backend = InMemoryBackend()
+
+        for _ in range(3):
+            stats = DataFetchingStats()
+
+            await HotKeyBrandRepository(backend, stats).get_by_id(brand.id)
+
+        self.assertEqual(stats.hot_keys, {"Brand": [(str(brand.id), 3)]})
+        self.assertEqual(stats.hot_key_promotions, {"Brand": 1})
+        self.assertEqual(stats.number_of_hot_key_hits, 1)
+        self.assertEqual(stats.number_of_hot_key_promotions, 0)
+
+
+class BackendReplaceTestCase(SimpleTestCase):
+    async def test_replaces_only_the_expected_values(self):
+        for backend in [InMemoryBackend(), DjangoCacheBackend()]:
+            with self.subTest(backend=type(backend).__name__):
+                await backend.set_many([("value", b"old", 60)])
+                await backend.set_hashes([("hash", {"_entry": b"old", "a": b"1"}, 60)])
+
+                replaced = await backend.replace_many(
+                    [
+                        ("value", None, b"old", b"new", 60),
+                        ("hash", "_entry", b"old", b"new", 60),
+                        ("hash", "a", b"2", b"3", 60),
+                        ("missing", None, b"old", b"new", 60),
+                    ]
+                )
+
+                self.assertEqual(replaced, [True, True, False, False])
+                self.assertEqual(
+                    await backend.get_many(["value", "missing"]), [b"new", None]
+                )
+                self.assertEqual(
+                    await backend.get_hashes(["hash"], ["_entry", "a"]),
+                    [[b"new", b"1"]],
+                )
+
+                await backend.delete_many(["value", "hash"])
+
+
+class BackendDeleteAndIncrTestCase(SimpleTestCase):
+    async def test_deletes_the_keys_and_increments_the_counters(self):
+        for backend in [InMemoryBackend(), DjangoCacheBackend()]:
+            with self.subTest(backend=type(backend).__name__):
+                await backend.set_many([("value", b"value", 60)])
+                await backend.incr("counter")
+
+                counters = await backend.delete_and_incr_many(
+                    ["value"], ["counter", "new counter"]
+                )
+
+                self.assertEqual(counters, [2, 1])
+                self.assertEqual(await backend.get_many(["value"]), [None])
+
+                await backend.delete_many(["counter", "new counter"])
+
+
+class ThreadLoopTestCase(SimpleTestCase):
+    def test_reuses_the_connection_of_the_thread(self):
+        async def get_client():
+            async with redis_pool.redis_client() as redis:
+                return redis
+
+        client = mock.Mock(closed=False)
+
+        with mock.patch.object(
+            redis_pool, "_create_client", mock.AsyncMock(return_value=client)
+        ) as create_client:
+            self.addCleanup(setattr, redis_pool._thread_loop, "redis", None)
+
+            self.assertIs(redis_pool.run_in_thread_loop(get_client()), client)
+            self.assertIs(redis_pool.run_in_thread_loop(get_client()), client)
+
+        create_client.assert_called_once()
+
+
+class RedisPoolTestCase(SimpleTestCase):
+    async def test_is_only_used_on_the_loop_that_opened_it(self):
+        with mock.patch.object(redis_pool, "_pool_loop", asyncio.new_event_loop()):
+            self.assertFalse(redis_pool.has_redis_pool())
+
+            # the pool of a dead loop can't be replaced, as it can't be closed
+            with self.assertRaises(RuntimeError):
+                await redis_pool.get_redis_pool()
+
+            with self.assertRaises(RuntimeError):
+                await redis_pool.open_redis_pool()
+
+            redis_pool._pool_loop.close()
+
+
+class UnwritableBackend(InMemoryBackend):
+    async def set_many(self, items):
+        raise CacheUnavailable("redis is down")
+
+
+@override_settings(CACHE_BACKEND="memory")
+class WarmCacheTestCase(TransactionTestCase):
+    def tearDown(self):
+        clear_local_caches()
+
+    def warm_cache(self, backend):
+        @asynccontextmanager
+        async def cache_backend():
+            yield backend
+
+        with mock.patch.object(warm_cache, "cache_backend", cache_backend):
+            call_command("warm_cache", "--models", "Brand", stdout=StringIO())
+
+    def test_writes_the_entities_to_the_cache(self):
+        brand = Brand.objects.create(name="brand")
+        backend = InMemoryBackend()
+
+        with mock.patch.object(BrandRepository, "_publish_invalidation") as publish:
+            self.warm_cache(backend)
+
+        publish.assert_not_called()
+
+        repository = BrandRepository(backend, DataFetchingStats())
+        keys = async_to_sync(repository._get_caching_keys)([brand.id])
+
+        self.assertIsNotNone(async_to_sync(backend.get_many)(keys)[0])
+
+    def test_fails_when_the_cache_is_unavailable(self):
+        Brand.objects.create(name="brand")
+
+        with self.assertRaises(CommandError):
+            self.warm_cache(UnwritableBackend())
+
+
+class FakePipeline:
+    def __init__(self, node):
+        self.node = node
+        self.commands = []
+
+    def get(self, key):
+        future = asyncio.get_running_loop().create_future()
+        self.commands.append((key, future))
+
+        return future
+
+    async def execute(self, return_exceptions=False):
+        self.node.pipelines.append([key for key, _ in self.commands])
+
+        for key, future in self.commands:
+            future.set_result(self.node.values[key])
+
+
+class FakeNode:
+    def __init__(self, addr, values):
+        self.addr = addr
+        self.values = values
+        self.pipelines = []
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakeCluster:
+    """Splits the hash slots between two nodes, which return the keys as
+    values."""
+
+    def __init__(self, keys):
+        values = {key: key.encode() for key in keys}
+
+        self.nodes = [FakeNode("a", values), FakeNode("b", values)]
+
+    def _get_node(self, key):
+        return self.nodes[redis_cluster.get_hash_slot(key) * 2 // HASH_SLOTS]
+
+    async def get_master_node_by_keys(self, key):
+        return self._get_node(key)
+
+    async def keys_master(self, key):
+        return self._get_node(key)
+
+
+@override_settings(REDIS_CLUSTER=True)
+class RunBySlotTestCase(SimpleTestCase):
+    async def test_returns_the_results_in_the_order_of_the_keys(self):
+        # the ones with the same hash tag are in the same slot
+        keys = [f"key:{index}" for index in range(20)] + [
+            f"{{tag}}:{index}" for index in range(5)
+        ]
+        redis = FakeCluster(keys)
+
+        def get(pipeline, indexes):
+            return asyncio.gather(*(pipeline.get(keys[index]) for index in indexes))
+
+        results = await redis_cluster.run_by_slot(redis, keys, get)
+
+        self.assertEqual(results, [key.encode() for key in keys])
+
+        # one pipeline per node, with only the keys of the node
+        for node in redis.nodes:
+            self.assertEqual(len(node.pipelines), 1)
+            self.assertTrue(
+                all(redis._get_node(key) is node for key in node.pipelines[0])
+            )
+
+        self.assertEqual(
+            sorted(key for node in redis.nodes for key in node.pipelines[0]),
+            sorted(keys),
+        )
+
+
+class RunInChunksTestCase(SimpleTestCase):
+    async def test_returns_the_results_in_order(self):
+        async def double(chunk):
+            # the later chunks finish first
+            await asyncio.sleep(0.01 / chunk[0])
+
+            return [item * 2 for item in chunk]
+
+        results, number_of_chunks = await run_in_chunks(
+            list(range(1, 11)), 3, 4, double
+        )
+
+        self.assertEqual(results, [item * 2 for item in range(1, 11)])
+        self.assertEqual(number_of_chunks, 4)
+
+    async def test_limits_the_concurrency(self):
+        running = 0
+        max_running = 0
+
+        async def run(chunk):
+            nonlocal running, max_running
+
+            running += 1
+            max_running = max(max_running, running)
+
+            await asyncio.sleep(0)
+
+            running -= 1
+
+            return chunk
+
+        results, number_of_chunks = await run_in_chunks(list(range(10)), 1, 3, run)
+
+        self.assertEqual(results, list(range(10)))
+        self.assertEqual(number_of_chunks, 10)
+        self.assertEqual(max_running, 3)
+
+
+class BloomFilterTestCase(SimpleTestCase):
+    def test_uses_the_bit_order_of_redis_bitmaps(self):
+        bloom_filter = BloomFilter(16, 1)
+
+        # SETBIT key 0 1 and SETBIT key 9 1
+        with mock.patch.object(bloom, "get_positions", return_value=[0, 9]):
+            bloom_filter.add("id")
+
+        self.assertEqual(bloom_filter.to_bytes(), b"\x80\x40")
+
+        # redis doesn't return the trailing bytes that were never set
+        bloom_filter = BloomFilter(16, 1, b"\x80")
+
+        self.assertEqual(bloom_filter.to_bytes(), b"\x80\x00")
+
+        with mock.patch.object(bloom, "get_positions", return_value=[0]):
+            self.assertIn("id", bloom_filter)
+
+        with mock.patch.object(bloom, "get_positions", return_value=[9]):
+            self.assertNotIn("id", bloom_filter)
+
+    def test_saves_and_loads_the_filter(self):
+        bloom_filter = BloomFilter(*get_parameters(100, 0.01))
+        bloom_filter.update(range(50))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "filter")
+
+            bloom_filter.save(path, 49)
+            loaded_filter, max_pk = BloomFilter.load(path)
+
+        self.assertEqual(max_pk, 49)
+        self.assertEqual(loaded_filter.size_in_bits, bloom_filter.size_in_bits)
+        self.assertEqual(loaded_filter.number_of_hashes, bloom_filter.number_of_hashes)
+        self.assertEqual(loaded_filter.to_bytes(), bloom_filter.to_bytes())
+        self.assertTrue(all(id in loaded_filter for id in range(50)))
+
+
+class EntityDecodingTestCase(SimpleTestCase):
+    def test_rejects_malformed_payloads(self):
+        self.assertEqual(
+            convert_data_to_entity({"id": "1", "name": "brand"}, entities.Brand),
+            entities.Brand(id="1", name="brand"),
+        )
+
+        for data in [["1", "brand"], {"id": "1"}, {"id": "1", "name": 2}]:
+            with self.subTest(data=data), self.assertRaises(EntityDecodeError):
+                convert_data_to_entity(data, entities.Brand)
+
+        for value in [b"{", b"[1, 2]", compress_value(b"{}")[:-2]]:
+            with self.subTest(value=value), self.assertRaises(EntityDecodeError):
+                decode_entry(value, entities.Brand)
+
+
+@override_settings(CACHE_BACKEND="memory")
+class InvalidCachedValueTestCase(TransactionTestCase):
+    def tearDown(self):
+        clear_local_caches()
+
+    async def test_treats_malformed_values_as_misses(self):
+        brand = await sync_to_async(Brand.objects.create)(name="brand")
+        backend = InMemoryBackend()
+        stats = DataFetchingStats()
+        repository = BrandRepository(backend, stats)
+
+        keys = await repository._get_caching_keys([brand.id])
+        await backend.set_many([(keys[0], b'{"entity": {"id": 1}}', 60)])
+
+        with self.assertLogs("domain.repositories.cache", "WARNING"):
+            self.assertEqual((await repository.get_by_id(brand.id)).name, "brand")
+
+        self.assertEqual(stats.number_of_invalid_cache_values, 1)
+        self.assertEqual(stats.number_of_sql_calls, 1)
+
+
+class SlidingBrandRepository(BrandRepository):
+    LOCAL_CACHE_MAX_SIZE = 0
+    DEFAULT_EXPIRE_IN_SECONDS = 10
+    EXPIRE_JITTER_RATIO = 0
+    # every read slides the expiry
+    SLIDING_EXPIRE_RATIO = 1.0
+
+
+@override_settings(CACHE_BACKEND="memory")
+class SlidingExpiryTestCase(TransactionTestCase):
+    async def test_extends_the_expiry_of_the_cached_entry(self):
+        brand = await sync_to_async(Brand.objects.create)(name="brand")
+        backend = InMemoryBackend()
+        repository = SlidingBrandRepository(backend, DataFetchingStats())
+        (key,) = await repository._get_caching_keys([str(brand.id)])
+
+        await repository.get_by_id(brand.id)
+
+        (entry,) = [
+            repository._decode(value) for value in await backend.get_many([key])
+        ]
+
+        await repository.get_by_id(brand.id)
+        # lets the slide run
+        await asyncio.sleep(0)
+
+        (slid_entry,) = [
+            repository._decode(value) for value in await backend.get_many([key])
+        ]
+
+        self.assertEqual(repository.stats.number_of_sliding_expirations, 1)
+        self.assertEqual(slid_entry.filled_at, entry.filled_at)
+        self.assertGreater(slid_entry.expires_at, entry.expires_at)
+
+    async def test_doesnt_bring_back_invalidated_entities(self):
+        brand = await sync_to_async(Brand.objects.create)(name="old")
+        backend = InMemoryBackend()
+        stats = DataFetchingStats()
+        repository = SlidingBrandRepository(backend, stats)
+        (key,) = await repository._get_caching_keys([str(brand.id)])
+
+        await repository.get_by_id(brand.id)
+        await repository.get_by_id(brand.id)
+
+        # the row changes before the slide runs, without the memory backend
+        # yielding to it
+        await backend.delete_many([key])
+        await sync_to_async(Brand.objects.filter(id=brand.id).update)(name="new")
+        await asyncio.sleep(0)
+
+        self.assertEqual((await repository.get_by_id(brand.id)).name, "new")
+        self.assertEqual(stats.number_of_sql_calls, 2)
+
+    async def test_stops_sliding_after_the_max_expiry(self):
+        brand = await sync_to_async(Brand.objects.create)(name="brand")
+        stats = DataFetchingStats()
+        repository = SlidingBrandRepository(InMemoryBackend(), stats)
+
+        await repository.get_by_id(brand.id)
+
+        with mock.patch.object(SlidingBrandRepository, "MAX_EXPIRE_IN_SECONDS", 0):
+            await repository.get_by_id(brand.id)
+
+        self.assertEqual(stats.number_of_sliding_expirations, 0)
+
+
+class ExistenceFilterTestCase(SimpleTestCase):
+    def setUp(self):
+        for name in ["_filters", "_max_pks", "_repository_classes"]:
+            patcher = mock.patch.dict(getattr(existence, name), clear=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @override_settings(CACHE_BACKEND="redis", EXISTENCE_FILTERS_DIR=None)
+    async def test_adds_the_ids_created_while_loading(self):
+        async def read_pks(repository_class, after=None):
+            # another process creates a campaign during the scan
+            existence.update_existence_filter("Campaign", ["2"])
+
+            return [1]
+
+        with mock.patch.object(
+            existence, "_load_saved_filter", return_value=(None, None)
+        ), mock.patch.object(existence, "save_existence_filter"), mock.patch.object(
+            existence, "_read_pks", read_pks
+        ):
+            await existence.load_existence_filters([CampaignRepository])
+
+        bloom_filter = existence.get_existence_filter(CampaignRepository.entity_class)
+
+        self.assertIn("1", bloom_filter)
+        self.assertIn("2", bloom_filter)
+        self.assertEqual(existence._pending_ids, {})
+
+    @override_settings(CACHE_BACKEND="memory")
+    async def test_isnt_loaded_without_the_bus(self):
+        await existence.load_existence_filters([CampaignRepository])
+
+        self.assertIsNone(
+            existence.get_existence_filter(CampaignRepository.entity_class)
+        )
@@ -7,10 +7,70 @@ For more information on this file, see
 https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
 """
 
+import asyncio
+import logging
 import os
 
+import aioredis
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'demo.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from domain.redis_pool import close_redis_pool, open_redis_pool  # noqa: E402
+from domain.repositories.bus import (  # noqa: E402
+    start_invalidation_listener,
+    stop_invalidation_listener,
+)
+from domain.repositories.existence import load_existence_filters  # noqa: E402
+from domain.repositories.invalidation import (  # noqa: E402
+    get_registered_repositories,
+)
+from domain.repositories.tasks import run_in_background  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+
+async def lifespan(scope, receive, send):
+    while True:
+        message = await receive()
+
+        if message["type"] == "lifespan.startup":
+            # the other backends don't use redis at all
+            if settings.CACHE_BACKEND == "redis":
+                try:
+                    await open_redis_pool()
+                except (OSError, asyncio.TimeoutError, aioredis.RedisError):
+                    # we start in degraded mode, the pool is opened by the
+                    # first command once the breaker lets it through, see
+                    # RedisBackend
+                    logger.exception("Unable to open the redis pool")
+
+            start_invalidation_listener()
+
+            # lookups are not filtered until the filters are loaded, so we
+            # don't delay the startup, they are only loaded with the redis
+            # backend, see load_existence_filters
+            run_in_background(
+                load_existence_filters(get_registered_repositories().values())
+            )
+
+            await send({"type": "lifespan.startup.complete"})
+
+        elif message["type"] == "lifespan.shutdown":
+            await stop_invalidation_listener()
+            await close_redis_pool()
+            await send({"type": "lifespan.shutdown.complete"})
+
+            return
+
+
+async def application(scope, receive, send):
+    # Django doesn't handle lifespan events, so we do it here, this is
+    # where process wide resources (like the redis pool) are created
+    if scope["type"] == "lifespan":
+        await lifespan(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
@@ -30,7 +30,7 @@ INSTALLED_APPS = [
     "django_extensions",
     "corsheaders",
     "api",
-    "campaigns",
+    "campaigns.apps.CampaignsConfig",
 ]
 
 MIDDLEWARE = [
@@ -81,7 +81,10 @@ DATABASES = {
 
 AUTH_PASSWORD_VALIDATORS = [
     {
-        "NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator",
+        "NAME": (
+            "django.contrib.auth.password_validation."
+            "UserAttributeSimilarityValidator"
+        ),
     },
     {
         "NAME": "django.contrib.auth.password_validation.MinimumLengthValidator",
@@ -119,3 +122,51 @@ CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_HEADERS = list(default_headers) + [
     "apollo-federation-include-trace",
 ]
+
+# Redis
+
+REDIS_ADDRESS = "redis://localhost"
+
+REDIS_POOL_MINSIZE = 1
+
+REDIS_POOL_MAXSIZE = 10
+
+REDIS_CONNECT_TIMEOUT_IN_SECONDS = 1.0
+
+# set this to True when REDIS_ADDRESS points to a node of a Redis Cluster,
+# this needs aioredis_cluster to be installed
+REDIS_CLUSTER = False
+
+# when running on a cluster, keys of the same entity type are stored in the
+# same hash slot, so batches only go to one node (which also gets all the load)
+REDIS_CLUSTER_HASH_TAGS = False
+
+# Cache
+
+# where the repositories store the entities, "redis", "memory" (a dict per
+# process, useful for tests and benchmarks) or "django" (the default cache
+# configured in CACHES)
+CACHE_BACKEND = "redis"
+
+# max number of keys stored by the memory backend
+CACHE_BACKEND_MAX_SIZE = 100_000
+
+# every cache command fails after this long, and after
+# CACHE_BREAKER_FAILURE_THRESHOLD failures in a row the cache is not used for
+# CACHE_BREAKER_RESET_TIMEOUT_IN_SECONDS, entities are then fetched from the
+# database, with up to CACHE_DEGRADED_MAX_CONCURRENT_QUERIES queries at a time
+CACHE_COMMAND_TIMEOUT_IN_SECONDS = 0.1
+CACHE_BREAKER_FAILURE_THRESHOLD = 5
+CACHE_BREAKER_RESET_TIMEOUT_IN_SECONDS = 5.0
+CACHE_DEGRADED_MAX_CONCURRENT_QUERIES = 4
+
+# reads of the repositories with COALESCE_READS that arrive within this window
+# are sent as one command, batches are sent earlier when they reach
+# CACHE_READ_COALESCING_MAX_KEYS keys
+CACHE_READ_COALESCING_WINDOW_IN_MS = 2
+CACHE_READ_COALESCING_MAX_KEYS = 500
+
+# directory where the existence filters of the repositories are saved, so that
+# they don't need to be built from the tables, they are also saved in redis
+# when using the redis backend
+EXISTENCE_FILTERS_DIR = None
@@ -30,4 +30,4 @@ def _brand(instance: Brand) -> campaign_entities.Brand:
     return convert_brand(instance, convert_django_model)
 
 
-__all__ = ["convert_django_model"]
\ No newline at end of file
+__all__ = ["convert_django_model"]
@@ -1,19 +1,193 @@
+import dataclasses
+import hashlib
 import json
-from typing import Optional, Type, TypeVar
-
-from dacite.core import from_dict
-from dacite.exceptions import DaciteError
+from functools import lru_cache
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Optional,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+    get_args,
+    get_origin,
+    get_type_hints,
+)
 
 T = TypeVar("T")
 
+EntityDecoder = Callable[[Dict[str, Any]], T]
+
+
+class EntityDecodeError(ValueError):
+    pass
+
+
+_MISSING = object()
+
+
+def _get_allowed_types(field_type: Any) -> Tuple[Optional[Tuple[type, ...]], bool]:
+    """Returns the types that a value of the field must be an instance of
+    (or None when we can't check them, ie. for Any) and whether the field
+    accepts None."""
+
+    origin = get_origin(field_type)
+
+    if origin is Union:
+        args = get_args(field_type)
+        types = tuple(arg for arg in args if arg is not type(None))
+        allows_none = len(types) < len(args)
+
+        if all(isinstance(arg, type) for arg in types):
+            return types, allows_none
+
+        return None, allows_none
+
+    # we only check the container type for generics, ie. list for List[str]
+    if origin is not None:
+        return (origin,), False
+
+    if isinstance(field_type, type):
+        return (field_type,), False
+
+    return None, False
+
+
+def _raise_missing_field(entity_class: Any, name: str):
+    raise EntityDecodeError(f"{entity_class.__name__}: missing field {name!r}")
+
+
+def _raise_invalid_field(entity_class: Any, name: str, value: Any):
+    raise EntityDecodeError(
+        f"{entity_class.__name__}: wrong type for field {name!r}, "
+        f"got {type(value).__name__}"
+    )
+
+
+def _compile_entity_decoder(
+    entity_class: Type[T], fields: Optional[FrozenSet[str]] = None
+) -> EntityDecoder:
+    """Generates a function that validates a dict and creates an instance of
+    the entity class from it, this is done once per class, so decoding doesn't
+    need to inspect the type hints every time, like dacite does.
+
+    When fields is passed the decoder creates partial entities, that only have
+    those fields set, the other ones are set to None without being checked."""
+
+    type_hints = get_type_hints(entity_class)
+
+    namespace: Dict[str, Any] = {
+        "entity_class": entity_class,
+        "MISSING": _MISSING,
+        "EntityDecodeError": EntityDecodeError,
+        "raise_missing_field": _raise_missing_field,
+        "raise_invalid_field": _raise_invalid_field,
+    }
+
+    lines = [
+        "def decode(data):",
+        "    if not isinstance(data, dict):",
+        "        raise EntityDecodeError(",
+        "            f'{entity_class.__name__}: expected a dict, got {type(data)}'",
+        "        )",
+    ]
+    arguments = []
+
+    for index, field in enumerate(dataclasses.fields(entity_class)):
+        if not field.init:
+            continue
+
+        value = f"value_{index}"
+
+        if fields is not None and field.name not in fields:
+            arguments.append(f"{field.name}=None")
+
+            continue
+
+        types, allows_none = _get_allowed_types(type_hints[field.name])
+
+        lines.append(f"    {value} = data.get({field.name!r}, MISSING)")
+
+        if field.default is not dataclasses.MISSING:
+            namespace[f"default_{index}"] = field.default
+
+            lines.append(f"    if {value} is MISSING:")
+            lines.append(f"        {value} = default_{index}")
+        elif field.default_factory is not dataclasses.MISSING:  # type: ignore
+            default_factory = field.default_factory  # type: ignore
+
+            namespace[f"default_factory_{index}"] = default_factory
+
+            lines.append(f"    if {value} is MISSING:")
+            lines.append(f"        {value} = default_factory_{index}()")
+        else:
+            lines.append(f"    if {value} is MISSING:")
+            lines.append(f"        raise_missing_field(entity_class, {field.name!r})")
+
+        if types is not None:
+            namespace[f"types_{index}"] = types
+
+            condition = f"not isinstance({value}, types_{index})"
+
+            if allows_none:
+                condition = f"{value} is not None and {condition}"
+
+            lines.append(f"    elif {condition}:")
+            lines.append(
+                f"        raise_invalid_field(entity_class, {field.name!r}, {value})"
+            )
+
+        arguments.append(f"{field.name}={value}")
+
+    lines.append(f"    return entity_class({', '.join(arguments)})")
+
+    exec("\n".join(lines), namespace)
+
+    return namespace["decode"]
+
+
+_decoders: Dict[Tuple[Any, Optional[FrozenSet[str]]], EntityDecoder] = {}
+
+
+def get_entity_decoder(
+    entity_class: Type[T], fields: Optional[FrozenSet[str]] = None
+) -> EntityDecoder:
+    decoder = _decoders.get((entity_class, fields))
+
+    if decoder is None:
+        decoder = _decoders[(entity_class, fields)] = _compile_entity_decoder(
+            entity_class, fields
+        )
+
+    return decoder
+
+
+@lru_cache(maxsize=None)
+def get_entity_fingerprint(entity_class: Any) -> str:
+    """Returns a short hash of the fields of the entity class, which changes
+    every time a field is added, removed or changes type."""
+
+    type_hints = get_type_hints(entity_class)
+    schema = [
+        (field.name, repr(type_hints[field.name]))
+        for field in dataclasses.fields(entity_class)
+    ]
+
+    return hashlib.sha1(repr(schema).encode()).hexdigest()[:8]
+
+
+def convert_data_to_entity(data: Dict[str, Any], entity_class: Type[T]) -> T:
+    """Creates an entity from a dict, raises EntityDecodeError when the
+    data doesn't match the entity class."""
+
+    return get_entity_decoder(entity_class)(data)
+
 
 def convert_dict_to_entity(json_entity: str, entity_class: Type[T]) -> Optional[T]:
     if not json_entity:
         return None
 
-    try:
-        return from_dict(entity_class, json.loads(json_entity))
-    except DaciteError as e:
-        print(e)
-
-        return None
+    return convert_data_to_entity(json.loads(json_entity), entity_class)
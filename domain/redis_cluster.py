@@ -0,0 +1,144 @@
+import asyncio
+from binascii import crc_hqx
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Tuple
+
+import aioredis
+from aioredis.commands import Pipeline
+from django.conf import settings
+
+HASH_SLOTS = 16384
+
+
+def get_hash_slot(key: str) -> int:
+    """Returns the cluster hash slot of the key, only the part between the
+    first {} is hashed, if there's one (a hash tag)."""
+
+    data = key.encode()
+
+    start = data.find(b"{")
+
+    if start != -1:
+        end = data.find(b"}", start + 1)
+
+        if end > start + 1:
+            data = data[start + 1 : end]
+
+    return crc_hqx(data, 0) % HASH_SLOTS
+
+
+def add_hash_tag(prefix: str) -> str:
+    if not settings.REDIS_CLUSTER_HASH_TAGS:
+        return prefix
+
+    return f"{{{prefix}}}"
+
+
+# queues the commands of the keys with the given indexes, which are all in the
+# same hash slot, on the pipeline, and returns a future of one result per index
+QueueCommands = Callable[[Pipeline, List[int]], "asyncio.Future[List[Any]]"]
+
+
+def same_result(future: "asyncio.Future[Any]", number_of_keys: int):
+    """Returns a future of the result of future repeated for each key, for
+    commands (like scripts) that handle all the keys of a slot at once."""
+
+    return asyncio.gather(*[future] * number_of_keys)
+
+
+async def _group_by_node(
+    redis: Any, keys: List[str]
+) -> List[Tuple[str, List[List[int]]]]:
+    """Returns the indexes of the keys grouped by hash slot, the slots are
+    grouped by the node that owns them, each node comes with one of its
+    keys."""
+
+    indexes_by_slot: Dict[int, List[int]] = defaultdict(list)
+
+    for index, key in enumerate(keys):
+        indexes_by_slot[get_hash_slot(key)].append(index)
+
+    groups_by_address: Dict[Any, Tuple[str, List[List[int]]]] = {}
+
+    for indexes in indexes_by_slot.values():
+        key = keys[indexes[0]]
+
+        # this reads the slots map the client keeps, so there's no I/O
+        node = await redis.get_master_node_by_keys(key)
+
+        groups_by_address.setdefault(node.addr, (key, []))[1].append(indexes)
+
+    return list(groups_by_address.values())
+
+
+async def get_node(redis: aioredis.Redis, key: str) -> aioredis.Redis:
+    """Returns the client of the node that owns the key, which (unlike the
+    cluster client) supports pipelines and transactions, these can only use
+    keys in the same hash slot though. Without a cluster this returns
+    redis."""
+
+    if not settings.REDIS_CLUSTER:
+        return redis
+
+    return await redis.keys_master(key)
+
+
+def _ignore_result(future: asyncio.Future) -> None:
+    if not future.cancelled():
+        future.exception()
+
+
+async def _execute(
+    redis: aioredis.Redis, groups: List[List[int]], queue: QueueCommands
+) -> List[List[Any]]:
+    pipeline = redis.pipeline()
+    futures = [queue(pipeline, indexes) for indexes in groups]
+
+    try:
+        # the errors of each command are raised by its future
+        await pipeline.execute(return_exceptions=True)
+    except BaseException:
+        # the commands might still get a reply (ie. after a timeout) that
+        # nobody reads
+        for future in futures:
+            future.add_done_callback(_ignore_result)
+
+        raise
+
+    return await asyncio.gather(*futures)
+
+
+async def run_by_slot(
+    redis: aioredis.Redis, keys: List[str], queue: QueueCommands
+) -> List[Any]:
+    """Runs the commands queued by queue for the keys that are in the same
+    hash slot, and returns the results in the same order as the keys.
+
+    Without a cluster all the commands are sent in one pipeline. On a
+    cluster the slots are grouped by node, the commands of each node are
+    sent in one pipeline (the cluster client doesn't support them, but the
+    clients of its nodes do), and the nodes are called in parallel."""
+
+    if not settings.REDIS_CLUSTER:
+        (group_results,) = await _execute(redis, [list(range(len(keys)))], queue)
+
+        return group_results
+
+    async def run(key: str, groups: List[List[int]]) -> List[List[Any]]:
+        node = await redis.keys_master(key)
+
+        return await _execute(node, groups, queue)
+
+    groups_by_node = await _group_by_node(redis, keys)
+    results_by_node = await asyncio.gather(
+        *(run(key, groups) for key, groups in groups_by_node)
+    )
+
+    results: List[Any] = [None] * len(keys)
+
+    for (_, groups), results_by_group in zip(groups_by_node, results_by_node):
+        for indexes, group_results in zip(groups, results_by_group):
+            for index, result in zip(indexes, group_results):
+                results[index] = result
+
+    return results
@@ -0,0 +1,162 @@
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Optional, TypeVar
+
+import aioredis
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    from aioredis_cluster import create_redis_cluster
+except ImportError:  # pragma: no cover
+    create_redis_cluster = None  # type: ignore
+
+_pool: Optional[aioredis.Redis] = None
+_pool_loop: Optional[asyncio.AbstractEventLoop] = None
+
+T = TypeVar("T")
+
+
+class _ThreadLoop(threading.local):
+    def __init__(self) -> None:
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.redis: Optional[aioredis.Redis] = None
+
+
+# event loop (and redis connection) of the sync threads, see run_in_thread_loop
+_thread_loop = _ThreadLoop()
+
+
+async def _create_cluster(pool_minsize: int, pool_maxsize: int) -> aioredis.Redis:
+    if create_redis_cluster is None:
+        raise ImproperlyConfigured(
+            "aioredis_cluster needs to be installed to use REDIS_CLUSTER"
+        )
+
+    # the cluster client keeps a pool per node
+    return await create_redis_cluster(
+        [settings.REDIS_ADDRESS],
+        pool_minsize=pool_minsize,
+        pool_maxsize=pool_maxsize,
+        connect_timeout=settings.REDIS_CONNECT_TIMEOUT_IN_SECONDS,
+    )
+
+
+async def _create_pool() -> aioredis.Redis:
+    if settings.REDIS_CLUSTER:
+        return await _create_cluster(
+            settings.REDIS_POOL_MINSIZE, settings.REDIS_POOL_MAXSIZE
+        )
+
+    return await aioredis.create_redis_pool(
+        settings.REDIS_ADDRESS,
+        minsize=settings.REDIS_POOL_MINSIZE,
+        maxsize=settings.REDIS_POOL_MAXSIZE,
+        timeout=settings.REDIS_CONNECT_TIMEOUT_IN_SECONDS,
+    )
+
+
+async def open_redis_pool() -> aioredis.Redis:
+    """Opens the process-wide pool, this is called by the ASGI lifespan
+    startup hook, whose loop owns the pool from then on."""
+    global _pool, _pool_loop
+
+    loop = asyncio.get_running_loop()
+
+    # aioredis connections are bound to the loop that created them and they
+    # can't be closed once it is gone, so the other loops (ie. runserver,
+    # where each request gets a new loop) use short lived connections
+    # instead of a pool each, see redis_client
+    if _pool_loop is not None and _pool_loop is not loop:
+        raise RuntimeError("The redis pool belongs to another event loop")
+
+    _pool_loop = loop
+
+    if _pool is None or _pool.closed:
+        _pool = await _create_pool()
+
+    return _pool
+
+
+async def close_redis_pool() -> None:
+    global _pool, _pool_loop
+
+    _pool_loop = None
+
+    if _pool is None:
+        return
+
+    _pool.close()
+    await _pool.wait_closed()
+
+    _pool = None
+
+
+def has_redis_pool() -> bool:
+    """Whether we are running on the loop that owns the pool, even when it
+    failed to open (it is opened again by get_redis_pool)."""
+
+    return _pool_loop is not None and _pool_loop is asyncio.get_running_loop()
+
+
+async def get_redis_pool() -> aioredis.Redis:
+    if not has_redis_pool():
+        raise RuntimeError(
+            "There is no redis pool on this event loop, use redis_client"
+        )
+
+    return await open_redis_pool()
+
+
+def run_in_thread_loop(awaitable: Awaitable[T]) -> T:
+    """Runs the awaitable in the event loop of the current thread, which is
+    kept between calls (unlike the ones of async_to_sync), and so is its
+    redis connection, see redis_client. This is meant for sync code that
+    doesn't run under the loop of the pool (ie. management commands)."""
+
+    if _thread_loop.loop is None or _thread_loop.loop.is_closed():
+        _thread_loop.loop = asyncio.new_event_loop()
+        _thread_loop.redis = None
+
+    return _thread_loop.loop.run_until_complete(awaitable)
+
+
+async def _create_client() -> aioredis.Redis:
+    if settings.REDIS_CLUSTER:
+        return await _create_cluster(1, 1)
+
+    return await aioredis.create_redis(
+        settings.REDIS_ADDRESS, timeout=settings.REDIS_CONNECT_TIMEOUT_IN_SECONDS
+    )
+
+
+@asynccontextmanager
+async def redis_client() -> AsyncIterator[aioredis.Redis]:
+    """Yields the shared pool when we are running on the loop that owns it,
+    the connection of the thread in run_in_thread_loop, otherwise a short
+    lived connection, which is what happens in sync code wrapped with
+    async_to_sync."""
+
+    loop = asyncio.get_running_loop()
+
+    if _pool is not None and _pool_loop is loop:
+        yield _pool
+
+        return
+
+    if _thread_loop.loop is loop:
+        if _thread_loop.redis is None or _thread_loop.redis.closed:
+            _thread_loop.redis = await _create_client()
+
+        yield _thread_loop.redis
+
+        return
+
+    redis = await _create_client()
+
+    try:
+        yield redis
+    finally:
+        redis.close()
+        await redis.wait_closed()
@@ -0,0 +1,694 @@
+import asyncio
+import functools
+import time
+from collections import OrderedDict, defaultdict
+from contextlib import asynccontextmanager
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Protocol,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+    cast,
+)
+
+import aioredis
+from aioredis.commands import Pipeline
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from domain.redis_cluster import run_by_slot, same_result
+from domain.redis_pool import get_redis_pool, has_redis_pool, redis_client
+
+from .breaker import CircuitBreaker, get_circuit_breaker
+
+# key, value and expiry in seconds
+Item = Tuple[str, bytes, int]
+# key, fields of the hash and expiry in seconds
+HashItem = Tuple[str, Dict[str, bytes], int]
+# key, field of the hash (None for plain values), expected value, new value
+# and expiry in seconds
+ReplaceItem = Tuple[str, Optional[str], bytes, bytes, int]
+
+F = TypeVar("F", bound=Callable[..., Awaitable[Any]])
+T = TypeVar("T")
+
+
+class CacheUnavailable(Exception):
+    """Raised by the backends when the cache can't be reached, timed out or
+    when its circuit breaker is open."""
+
+
+class CacheBackend(Protocol):
+    """The storage used by the repositories, all the methods work on batches
+    of keys, so that backends can send them in one go."""
+
+    async def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        """Returns the values of the keys, None for missing keys (or for keys
+        that contain a hash)."""
+
+    async def set_many(self, items: List[Item]) -> None: ...
+
+    async def get_hashes(
+        self, keys: List[str], fields: Sequence[str]
+    ) -> List[Optional[List[Optional[bytes]]]]:
+        """Returns the values of the given fields of the hashes, None for
+        missing keys (or for keys that don't contain a hash)."""
+
+    async def set_hashes(self, items: List[HashItem]) -> None:
+        """Replaces the hashes at the given keys."""
+
+    async def add_many(
+        self, keys: List[str], value: bytes, expire_in_ms: int
+    ) -> List[bool]:
+        """Sets the keys that don't exist, returns which ones were set."""
+
+    async def replace_many(self, items: List[ReplaceItem]) -> List[bool]:
+        """Replaces the values (or the given fields of the hashes) that still
+        have the expected value and sets the expiry of their keys, returns
+        which ones were replaced."""
+
+    async def delete_many(self, keys: List[str]) -> None: ...
+
+    async def incr(self, key: str) -> int: ...
+
+    async def delete_and_incr_many(
+        self, delete_keys: List[str], incr_keys: List[str]
+    ) -> List[int]:
+        """Deletes the keys and increments the counters in one call, returns
+        the new values of the counters."""
+
+
+# sets all the keys with their own expiry in one atomic call, KEYS are the
+# caching keys and ARGV is a flat list of value, expiry pairs
+SET_MANY_WITH_EXPIRY_SCRIPT = """
+for i, key in ipairs(KEYS) do
+    redis.call("SET", key, ARGV[i * 2 - 1], "EX", ARGV[i * 2])
+end
+
+return #KEYS
+"""
+
+# replaces each key with a hash and sets its expiry, KEYS are the caching keys
+# and ARGV is a flat list of expiry, number of fields, field, value, ... so
+# that each hash can have a different number of fields
+SET_HASHES_WITH_EXPIRY_SCRIPT = """
+-- redis uses lua 5.1, where unpack is a global
+local unpack = unpack or table.unpack
+local i = 1
+
+for _, key in ipairs(KEYS) do
+    local expire = ARGV[i]
+    local count = tonumber(ARGV[i + 1])
+
+    redis.call("DEL", key)
+    redis.call("HSET", key, unpack(ARGV, i + 2, i + 1 + count * 2))
+    redis.call("EXPIRE", key, expire)
+
+    i = i + 2 + count * 2
+end
+
+return #KEYS
+"""
+
+
+# replaces the values (or the hash fields) that are still the expected ones
+# and sets the expiry of their keys, KEYS are the caching keys and ARGV is a
+# flat list of field ("" for plain values), expected value, value, expiry
+REPLACE_MANY_SCRIPT = """
+local replaced = {}
+
+for i, key in ipairs(KEYS) do
+    local field = ARGV[i * 4 - 3]
+    local value = ARGV[i * 4 - 1]
+    local expire = ARGV[i * 4]
+    local key_type = redis.call("TYPE", key)["ok"]
+    local current = false
+
+    if field == "" and key_type == "string" then
+        current = redis.call("GET", key)
+    elseif field ~= "" and key_type == "hash" then
+        current = redis.call("HGET", key, field)
+    end
+
+    replaced[i] = 0
+
+    if current == ARGV[i * 4 - 2] then
+        if field == "" then
+            redis.call("SET", key, value, "EX", expire)
+        else
+            redis.call("HSET", key, field, value)
+            redis.call("EXPIRE", key, expire)
+        end
+
+        replaced[i] = 1
+    end
+end
+
+return replaced
+"""
+
+
+async def wait_for_command(
+    awaitable: Awaitable[T], timeout_in_seconds: Optional[float] = None
+) -> T:
+    """Waits for a redis command, for up to timeout_in_seconds (by default
+    CACHE_COMMAND_TIMEOUT_IN_SECONDS, 0 means no timeout), this is used
+    for the commands that are not sent through a backend too."""
+
+    if timeout_in_seconds is None:
+        timeout_in_seconds = settings.CACHE_COMMAND_TIMEOUT_IN_SECONDS
+
+    if not timeout_in_seconds:
+        return await awaitable
+
+    return await asyncio.wait_for(awaitable, timeout_in_seconds)
+
+
+def _is_wrong_type(error: Exception) -> bool:
+    # the other reply errors (ie. MOVED, CLUSTERDOWN, OOM) are failures
+    return isinstance(error, aioredis.ReplyError) and str(error).startswith("WRONGTYPE")
+
+
+def _guarded(fn: F) -> F:
+    """Applies the timeout and the circuit breaker of the backend to the
+    method, errors are raised as CacheUnavailable."""
+
+    @functools.wraps(fn)
+    async def wrap(self: "RedisBackend", *args: Any, **kwargs: Any) -> Any:
+        breaker = self.breaker
+
+        if breaker is not None and not breaker.allow_request():
+            raise CacheUnavailable("the circuit breaker is open")
+
+        try:
+            if self._redis is None:
+                # this has its own timeout, REDIS_CONNECT_TIMEOUT_IN_SECONDS
+                self._redis = await get_redis_pool()
+
+            result = await wait_for_command(
+                fn(self, *args, **kwargs), self.timeout_in_seconds
+            )
+        except (asyncio.TimeoutError, OSError, aioredis.RedisError) as e:
+            if breaker is not None:
+                breaker.record_failure()
+
+            raise CacheUnavailable(str(e) or type(e).__name__) from e
+        finally:
+            # cancellations and unexpected errors don't tell us anything
+            # about the cache, but they must not keep the trial forever
+            if breaker is not None:
+                breaker.record_cancellation()
+
+        if breaker is not None:
+            breaker.record_success()
+
+        return result
+
+    return cast(F, wrap)
+
+
+class RedisBackend:
+    """Stores the values in Redis (or in a Redis Cluster), batches are sent
+    as one command (per hash slot) and writes are atomic.
+
+    When a breaker is passed, every method fails after timeout_in_seconds and
+    fails straight away while the breaker is open. Without redis, the first
+    command opens the process-wide pool, so that failing to open it (ie. when
+    redis is down) goes through the breaker too."""
+
+    def __init__(
+        self,
+        redis: Optional[aioredis.Redis] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        timeout_in_seconds: float = 0,
+    ) -> None:
+        self._redis = redis
+        self.breaker = breaker
+        self.timeout_in_seconds = timeout_in_seconds
+
+    @property
+    def redis(self) -> aioredis.Redis:
+        if self._redis is None:
+            raise CacheUnavailable("the redis pool is not open")
+
+        return self._redis
+
+    @_guarded
+    async def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        if len(keys) == 1:
+            try:
+                return [await self.redis.get(keys[0])]
+            except aioredis.ReplyError as e:
+                if not _is_wrong_type(e):
+                    raise
+
+                # the key contains a hash
+                return [None]
+
+        def mget(pipeline: Pipeline, indexes: List[int]) -> asyncio.Future:
+            return pipeline.mget(*(keys[index] for index in indexes))
+
+        return await run_by_slot(self.redis, keys, mget)
+
+    @_guarded
+    async def set_many(self, items: List[Item]) -> None:
+        if len(items) == 1:
+            ((key, value, expire_in_seconds),) = items
+
+            await self.redis.set(key, value, expire=expire_in_seconds)
+
+            return
+
+        keys = [key for key, _, _ in items]
+
+        def set_many(pipeline: Pipeline, indexes: List[int]) -> asyncio.Future:
+            args: List[Any] = []
+
+            for index in indexes:
+                _, value, expire_in_seconds = items[index]
+
+                args.extend((value, expire_in_seconds))
+
+            future = pipeline.eval(
+                SET_MANY_WITH_EXPIRY_SCRIPT,
+                keys=[keys[index] for index in indexes],
+                args=args,
+            )
+
+            return same_result(future, len(indexes))
+
+        await run_by_slot(self.redis, keys, set_many)
+
+    @_guarded
+    async def get_hashes(
+        self, keys: List[str], fields: Sequence[str]
+    ) -> List[Optional[List[Optional[bytes]]]]:
+        def get_hashes(pipeline: Pipeline, indexes: List[int]) -> asyncio.Future:
+            return asyncio.gather(
+                *(pipeline.hmget(keys[index], *fields) for index in indexes),
+                return_exceptions=True,
+            )
+
+        results = await run_by_slot(self.redis, keys, get_hashes)
+
+        for values in results:
+            if isinstance(values, Exception) and not _is_wrong_type(values):
+                raise values
+
+        # keys that were written before switching to hashes give us a
+        # WRONGTYPE error, we treat them as misses, so they get replaced
+        return [None if isinstance(values, Exception) else values for values in results]
+
+    @_guarded
+    async def set_hashes(self, items: List[HashItem]) -> None:
+        keys = [key for key, _, _ in items]
+
+        def set_hashes(pipeline: Pipeline, indexes: List[int]) -> asyncio.Future:
+            args: List[Any] = []
+
+            for index in indexes:
+                _, values, expire_in_seconds = items[index]
+
+                args.extend((expire_in_seconds, len(values)))
+
+                for name, value in values.items():
+                    args.extend((name, value))
+
+            future = pipeline.eval(
+                SET_HASHES_WITH_EXPIRY_SCRIPT,
+                keys=[keys[index] for index in indexes],
+                args=args,
+            )
+
+            return same_result(future, len(indexes))
+
+        await run_by_slot(self.redis, keys, set_hashes)
+
+    @_guarded
+    async def add_many(
+        self, keys: List[str], value: bytes, expire_in_ms: int
+    ) -> List[bool]:
+        def add(pipeline: Pipeline, indexes: List[int]) -> asyncio.Future:
+            return asyncio.gather(
+                *(
+                    pipeline.set(
+                        keys[index],
+                        value,
+                        pexpire=expire_in_ms,
+                        exist=aioredis.Redis.SET_IF_NOT_EXIST,
+                    )
+                    for index in indexes
+                )
+            )
+
+        return [bool(result) for result in await run_by_slot(self.redis, keys, add)]
+
+    @_guarded
+    async def replace_many(self, items: List[ReplaceItem]) -> List[bool]:
+        keys = [item[0] for item in items]
+
+        def replace(pipeline: Pipeline, indexes: List[int]) -> asyncio.Future:
+            args: List[Any] = []
+
+            for index in indexes:
+                _, field, expected, value, expire_in_seconds = items[index]
+
+                args.extend((field or "", expected, value, expire_in_seconds))
+
+            return pipeline.eval(
+                REPLACE_MANY_SCRIPT,
+                keys=[keys[index] for index in indexes],
+                args=args,
+            )
+
+        return [bool(result) for result in await run_by_slot(self.redis, keys, replace)]
+
+    @_guarded
+    async def delete_many(self, keys: List[str]) -> None:
+        def delete(pipeline: Pipeline, indexes: List[int]) -> asyncio.Future:
+            return asyncio.gather(*(pipeline.delete(keys[index]) for index in indexes))
+
+        await run_by_slot(self.redis, keys, delete)
+
+    @_guarded
+    async def incr(self, key: str) -> int:
+        return await self.redis.incr(key)
+
+    @_guarded
+    async def delete_and_incr_many(
+        self, delete_keys: List[str], incr_keys: List[str]
+    ) -> List[int]:
+        keys = delete_keys + incr_keys
+
+        def delete_and_incr(pipeline: Pipeline, indexes: List[int]) -> asyncio.Future:
+            return asyncio.gather(
+                *(
+                    (
+                        pipeline.delete(keys[index])
+                        if index < len(delete_keys)
+                        else pipeline.incr(keys[index])
+                    )
+                    for index in indexes
+                )
+            )
+
+        results = await run_by_slot(self.redis, keys, delete_and_incr)
+
+        return results[len(delete_keys) :]
+
+
+class InMemoryBackend:
+    """Stores the values in a dict, so it is only shared by the repositories
+    of the current process, this is useful for tests, benchmarks and
+    deployments with only one process. When there are more than max_size
+    keys the least recently used ones are dropped."""
+
+    def __init__(self, max_size: int = 100_000) -> None:
+        self.max_size = max_size
+
+        self._data: "OrderedDict[str, Tuple[float, Union[bytes, Dict[str, bytes]]]]" = (
+            OrderedDict()
+        )
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _get(self, key: str) -> Any:
+        item = self._data.get(key)
+
+        if item is None:
+            return None
+
+        expires_at, value = item
+
+        if expires_at <= time.monotonic():
+            del self._data[key]
+
+            return None
+
+        self._data.move_to_end(key)
+
+        return value
+
+    def _set(self, key: str, value: Any, expire_in_seconds: float) -> None:
+        self._data[key] = (time.monotonic() + expire_in_seconds, value)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    async def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        values = [self._get(key) for key in keys]
+
+        return [value if isinstance(value, bytes) else None for value in values]
+
+    async def set_many(self, items: List[Item]) -> None:
+        for key, value, expire_in_seconds in items:
+            self._set(key, value, expire_in_seconds)
+
+    async def get_hashes(
+        self, keys: List[str], fields: Sequence[str]
+    ) -> List[Optional[List[Optional[bytes]]]]:
+        results: List[Optional[List[Optional[bytes]]]] = []
+
+        for key in keys:
+            value = self._get(key)
+
+            if isinstance(value, dict):
+                results.append([value.get(field) for field in fields])
+            else:
+                results.append(None)
+
+        return results
+
+    async def set_hashes(self, items: List[HashItem]) -> None:
+        for key, values, expire_in_seconds in items:
+            self._set(key, dict(values), expire_in_seconds)
+
+    async def add_many(
+        self, keys: List[str], value: bytes, expire_in_ms: int
+    ) -> List[bool]:
+        added = []
+
+        for key in keys:
+            if self._get(key) is None:
+                self._set(key, value, expire_in_ms / 1000)
+
+                added.append(True)
+            else:
+                added.append(False)
+
+        return added
+
+    async def replace_many(self, items: List[ReplaceItem]) -> List[bool]:
+        replaced = []
+
+        for key, field, expected, value, expire_in_seconds in items:
+            current = self._get(key)
+
+            if field is None:
+                replaced.append(isinstance(current, bytes) and current == expected)
+            else:
+                replaced.append(
+                    isinstance(current, dict) and current.get(field) == expected
+                )
+
+            if replaced[-1]:
+                self._set(
+                    key,
+                    value if field is None else {**current, field: value},
+                    expire_in_seconds,
+                )
+
+        return replaced
+
+    async def delete_many(self, keys: List[str]) -> None:
+        for key in keys:
+            self._data.pop(key, None)
+
+    async def incr(self, key: str) -> int:
+        value = int(self._get(key) or 0) + 1
+
+        # counters don't expire
+        self._set(key, str(value).encode(), float("inf"))
+
+        return value
+
+    async def delete_and_incr_many(
+        self, delete_keys: List[str], incr_keys: List[str]
+    ) -> List[int]:
+        await self.delete_many(delete_keys)
+
+        return [await self.incr(key) for key in incr_keys]
+
+
+def _encode_value(value: Any) -> Optional[bytes]:
+    # counters (see DjangoCacheBackend.incr) are stored as ints, so that the
+    # cache can increment them, we read them as bytes like in redis
+    if isinstance(value, int):
+        return str(value).encode()
+
+    # hashes are stored as dicts
+    return value if isinstance(value, bytes) else None
+
+
+class DjangoCacheBackend:
+    """Stores the values using one of the caches configured in the CACHES
+    setting, hashes are stored as dicts, so fetching some of their fields
+    doesn't save any bandwidth, and writes are not atomic."""
+
+    def __init__(self, alias: str = "default") -> None:
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @sync_to_async
+    def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        values = self.cache.get_many(keys)
+
+        return [_encode_value(values.get(key)) for key in keys]
+
+    @sync_to_async
+    def set_many(self, items: List[Item]) -> None:
+        values_by_expiry: Dict[int, Dict[str, bytes]] = defaultdict(dict)
+
+        for key, value, expire_in_seconds in items:
+            values_by_expiry[expire_in_seconds][key] = value
+
+        for expire_in_seconds, values in values_by_expiry.items():
+            self.cache.set_many(values, timeout=expire_in_seconds)
+
+    @sync_to_async
+    def get_hashes(
+        self, keys: List[str], fields: Sequence[str]
+    ) -> List[Optional[List[Optional[bytes]]]]:
+        values = self.cache.get_many(keys)
+        results: List[Optional[List[Optional[bytes]]]] = []
+
+        for key in keys:
+            value = values.get(key)
+
+            if isinstance(value, dict):
+                results.append([value.get(field) for field in fields])
+            else:
+                results.append(None)
+
+        return results
+
+    @sync_to_async
+    def set_hashes(self, items: List[HashItem]) -> None:
+        for key, values, expire_in_seconds in items:
+            self.cache.set(key, dict(values), timeout=expire_in_seconds)
+
+    @sync_to_async
+    def add_many(self, keys: List[str], value: bytes, expire_in_ms: int) -> List[bool]:
+        return [self.cache.add(key, value, timeout=expire_in_ms / 1000) for key in keys]
+
+    @sync_to_async
+    def replace_many(self, items: List[ReplaceItem]) -> List[bool]:
+        values = self.cache.get_many([key for key, _, _, _, _ in items])
+        replaced = []
+
+        for key, field, expected, value, expire_in_seconds in items:
+            current = values.get(key)
+
+            if field is None:
+                replaced.append(isinstance(current, bytes) and current == expected)
+            else:
+                replaced.append(
+                    isinstance(current, dict) and current.get(field) == expected
+                )
+
+            # the value can still change between the get and the set, the
+            # django caches can't compare and set
+            if replaced[-1]:
+                self.cache.set(
+                    key,
+                    value if field is None else {**current, field: value},
+                    timeout=expire_in_seconds,
+                )
+
+        return replaced
+
+    @sync_to_async
+    def delete_many(self, keys: List[str]) -> None:
+        self.cache.delete_many(keys)
+
+    def _incr(self, key: str) -> int:
+        # counters don't expire
+        self.cache.add(key, 0, timeout=None)
+
+        return self.cache.incr(key)
+
+    @sync_to_async
+    def incr(self, key: str) -> int:
+        return self._incr(key)
+
+    @sync_to_async
+    def delete_and_incr_many(
+        self, delete_keys: List[str], incr_keys: List[str]
+    ) -> List[int]:
+        self.cache.delete_many(delete_keys)
+
+        return [self._incr(key) for key in incr_keys]
+
+
+_in_memory_backend: Optional[InMemoryBackend] = None
+
+
+def _get_in_memory_backend() -> InMemoryBackend:
+    global _in_memory_backend
+
+    if _in_memory_backend is None:
+        _in_memory_backend = InMemoryBackend(settings.CACHE_BACKEND_MAX_SIZE)
+
+    return _in_memory_backend
+
+
+async def get_cache_backend() -> CacheBackend:
+    """Returns the backend configured by the CACHE_BACKEND setting, the redis
+    one uses the process-wide pool, which it opens again when needed, so it
+    only works on the loop of the ASGI lifespan, see cache_backend."""
+
+    if settings.CACHE_BACKEND == "redis":
+        return RedisBackend(
+            breaker=get_circuit_breaker(),
+            timeout_in_seconds=settings.CACHE_COMMAND_TIMEOUT_IN_SECONDS,
+        )
+
+    if settings.CACHE_BACKEND == "memory":
+        return _get_in_memory_backend()
+
+    if settings.CACHE_BACKEND == "django":
+        return DjangoCacheBackend()
+
+    raise ImproperlyConfigured(f"Unknown CACHE_BACKEND {settings.CACHE_BACKEND!r}")
+
+
+@asynccontextmanager
+async def cache_backend() -> AsyncIterator[CacheBackend]:
+    """Like get_cache_backend, but it can be used outside of the event loop
+    that owns the redis pool, see redis_client."""
+
+    if settings.CACHE_BACKEND == "redis" and not has_redis_pool():
+        async with redis_client() as redis:
+            yield RedisBackend(
+                redis,
+                breaker=get_circuit_breaker(),
+                timeout_in_seconds=settings.CACHE_COMMAND_TIMEOUT_IN_SECONDS,
+            )
+
+        return
+
+    yield await get_cache_backend()
@@ -0,0 +1,90 @@
+import hashlib
+import json
+import math
+from typing import Any, Iterable, List, Optional, Tuple
+
+
+def get_parameters(capacity: int, error_rate: float) -> Tuple[int, int]:
+    """Returns the number of bits and of hashes of a filter that reports less
+    than error_rate of the missing ids as present, as long as it has at most
+    capacity ids."""
+
+    size_in_bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+    number_of_hashes = max(1, round(size_in_bits / capacity * math.log(2)))
+
+    return size_in_bits, number_of_hashes
+
+
+def get_positions(id: Any, size_in_bits: int, number_of_hashes: int) -> List[int]:
+    digest = hashlib.blake2b(str(id).encode(), digest_size=16).digest()
+    low = int.from_bytes(digest[:8], "big")
+    high = int.from_bytes(digest[8:], "big") | 1
+
+    return [(low + index * high) % size_in_bits for index in range(number_of_hashes)]
+
+
+class BloomFilter:
+    """Set of ids that can tell us if an id is definitely not in it, using
+    size_in_bits bits and number_of_hashes positions per id. Ids that were
+    never added are reported as present with a small probability.
+
+    Positions are computed with blake2b, so they are the same in every
+    process and the bits can be shared, see existence.py. The bits use the
+    same order as redis bitmaps (bit 0 is the most significant bit of the
+    first byte), so they can be updated with SETBIT."""
+
+    def __init__(
+        self, size_in_bits: int, number_of_hashes: int, bits: Optional[bytes] = None
+    ) -> None:
+        self.size_in_bits = size_in_bits
+        self.number_of_hashes = number_of_hashes
+
+        size_in_bytes = (size_in_bits + 7) // 8
+
+        # redis bitmaps don't store the trailing bytes that were never set
+        self._bits = bytearray(bits or b"")[:size_in_bytes]
+        self._bits.extend(bytes(size_in_bytes - len(self._bits)))
+
+    def add(self, id: Any) -> None:
+        for position in get_positions(id, self.size_in_bits, self.number_of_hashes):
+            self._bits[position >> 3] |= 0x80 >> (position & 7)
+
+    def update(self, ids: Iterable[Any]) -> None:
+        for id in ids:
+            self.add(id)
+
+    def __contains__(self, id: Any) -> bool:
+        return all(
+            self._bits[position >> 3] & (0x80 >> (position & 7))
+            for position in get_positions(id, self.size_in_bits, self.number_of_hashes)
+        )
+
+    def to_bytes(self) -> bytes:
+        return bytes(self._bits)
+
+    def save(self, path: str, max_pk: Any) -> None:
+        """Writes the filter to a file, max_pk is the biggest primary key that
+        was added, so that rows inserted after saving can be added when
+        loading it."""
+
+        header = json.dumps(
+            {
+                "size_in_bits": self.size_in_bits,
+                "number_of_hashes": self.number_of_hashes,
+                "max_pk": max_pk,
+            }
+        )
+
+        with open(path, "wb") as f:
+            f.write(header.encode() + b"\n" + self.to_bytes())
+
+    @classmethod
+    def load(cls, path: str) -> Tuple["BloomFilter", Any]:
+        """Reads a filter written by save, returns it with its max_pk."""
+
+        with open(path, "rb") as f:
+            header, bits = f.read().split(b"\n", 1)
+
+        data = json.loads(header)
+
+        return cls(data["size_in_bits"], data["number_of_hashes"], bits), data["max_pk"]
@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import time
+from typing import Optional, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitBreaker:
+    """Stops sending commands to the cache after failure_threshold failures in
+    a row, so that requests don't wait for timeouts while it's down. After
+    reset_timeout_in_seconds one command is let through (half open), if it
+    works the breaker closes again, otherwise it stays open for another
+    reset_timeout_in_seconds."""
+
+    def __init__(self, failure_threshold: int, reset_timeout_in_seconds: float) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_in_seconds = reset_timeout_in_seconds
+
+        self.state = CLOSED
+        self.number_of_state_changes = 0
+
+        self._failures = 0
+        self._opened_at = 0.0
+        self._open_time_in_seconds = 0.0
+        self._trial_in_flight = False
+
+    @property
+    def open_time_in_seconds(self) -> float:
+        """Total time spent open (or half open), since the process started."""
+
+        if self.state == CLOSED:
+            return self._open_time_in_seconds
+
+        return self._open_time_in_seconds + time.monotonic() - self._opened_at
+
+    def _set_state(self, state: str) -> None:
+        if state == self.state:
+            return
+
+        logger.warning("Cache circuit breaker is now %s", state)
+
+        if state == OPEN and self.state == CLOSED:
+            self._opened_at = time.monotonic()
+        elif state == CLOSED:
+            self._open_time_in_seconds += time.monotonic() - self._opened_at
+
+        self.state = state
+        self.number_of_state_changes += 1
+
+    def allow_request(self) -> bool:
+        if self.state == CLOSED:
+            return True
+
+        if self.state == OPEN:
+            if time.monotonic() - self._opened_at < self.reset_timeout_in_seconds:
+                return False
+
+            self._set_state(HALF_OPEN)
+
+        # only one command at a time is used to check if the cache is back
+        if self._trial_in_flight:
+            return False
+
+        self._trial_in_flight = True
+
+        return True
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._trial_in_flight = False
+
+        self._set_state(CLOSED)
+
+    def record_cancellation(self) -> None:
+        # the command didn't tell us anything, the next one can try again
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        self._trial_in_flight = False
+
+        if self.state == HALF_OPEN:
+            now = time.monotonic()
+
+            # waits for another reset timeout, the time spent open so far
+            # is counted before we restart it
+            self._open_time_in_seconds += now - self._opened_at
+            self._opened_at = now
+            self._set_state(OPEN)
+        elif self._failures >= self.failure_threshold:
+            self._set_state(OPEN)
+
+
+_circuit_breaker: Optional[CircuitBreaker] = None
+
+
+def get_circuit_breaker() -> CircuitBreaker:
+    """Returns the process wide breaker of the cache, see the CACHE_BREAKER_*
+    settings."""
+
+    global _circuit_breaker
+
+    if _circuit_breaker is None:
+        _circuit_breaker = CircuitBreaker(
+            settings.CACHE_BREAKER_FAILURE_THRESHOLD,
+            settings.CACHE_BREAKER_RESET_TIMEOUT_IN_SECONDS,
+        )
+
+    return _circuit_breaker
+
+
+_degraded_semaphore: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]] = (
+    None
+)
+
+
+def get_degraded_semaphore() -> asyncio.Semaphore:
+    """Returns the semaphore that limits the number of queries sent to the db
+    while the cache is unavailable, so that the db doesn't get all the
+    traffic the cache was absorbing at once."""
+
+    global _degraded_semaphore
+
+    loop = asyncio.get_running_loop()
+
+    # semaphores can't be shared across loops, see SingleFlight
+    if _degraded_semaphore is None or _degraded_semaphore[0] is not loop:
+        _degraded_semaphore = (
+            loop,
+            asyncio.Semaphore(settings.CACHE_DEGRADED_MAX_CONCURRENT_QUERIES),
+        )
+
+    return _degraded_semaphore[1]
@@ -0,0 +1,194 @@
+import asyncio
+import json
+import logging
+import uuid
+from collections import defaultdict
+from typing import Dict, Iterable, Mapping, Optional, Set
+
+import aioredis
+from django.conf import settings
+from domain.redis_pool import redis_client
+
+from .backends import wait_for_command
+from .existence import catch_up_existence_filters, update_existence_filter
+from .local import clear_local_caches, get_local_caches_by_name
+from .tasks import run_in_background
+from .ttl import get_access_rates_by_name
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "cache-invalidations"
+
+# used to ignore the messages sent by this process, its local caches are
+# already up to date
+NODE_ID = uuid.uuid4().hex
+
+# invalidations published within this interval are sent in one message
+BATCH_INTERVAL_IN_SECONDS = 0.01
+RECONNECT_INTERVAL_IN_SECONDS = 1.0
+
+
+def _evict(ids: Mapping[str, Iterable[str]], flush: Iterable[str]) -> None:
+    for name in flush:
+        for local_cache in get_local_caches_by_name(name):
+            local_cache.clear()
+
+    for name, entity_ids in ids.items():
+        for local_cache in get_local_caches_by_name(name):
+            for id in entity_ids:
+                local_cache.delete(id)
+
+
+class InvalidationBus:
+    """Tells the other processes to drop entities from their local caches,
+    messages are sent on a redis channel, which every process listens to
+    (see listen)."""
+
+    def __init__(self) -> None:
+        self._ids: Dict[str, Set[str]] = defaultdict(set)
+        self._flush: Set[str] = set()
+        self._publish_task: Optional[asyncio.Future] = None
+
+    async def publish_now(
+        self,
+        ids: Mapping[str, Iterable[str]],
+        flush: Iterable[str] = (),
+        changed: bool = False,
+    ) -> None:
+        """Sends the invalidations straight away, changed tells the other
+        processes that the entities changed in the db (rather than being
+        cached again), which is used to pick their expiry, see ttl.py."""
+
+        # only the redis backend is shared by the processes, with the other
+        # ones the local caches are the only copies
+        if settings.CACHE_BACKEND != "redis":
+            return
+
+        message = json.dumps(
+            {
+                "node": NODE_ID,
+                "ids": {name: list(entity_ids) for name, entity_ids in ids.items()},
+                "flush": list(flush),
+                "changed": changed,
+            }
+        )
+
+        async with redis_client() as redis:
+            await wait_for_command(redis.publish(CHANNEL, message))
+
+    def publish(self, name: str, ids: Iterable[str] = (), flush: bool = False) -> None:
+        """Queues the invalidation of the given ids (or of all the entities,
+        when flush is True), queued invalidations are sent together after
+        BATCH_INTERVAL_IN_SECONDS."""
+
+        self._ids[name].update(str(id) for id in ids)
+
+        if flush:
+            self._flush.add(name)
+
+        task = self._publish_task
+
+        # tasks can't be shared across loops, see SingleFlight
+        if (
+            task is None
+            or task.done()
+            or task.get_loop() is not asyncio.get_running_loop()
+        ):
+            self._publish_task = run_in_background(self._publish_later())
+
+    async def _publish_later(self) -> None:
+        await asyncio.sleep(BATCH_INTERVAL_IN_SECONDS)
+
+        ids = {name: entity_ids for name, entity_ids in self._ids.items() if entity_ids}
+        flush = set(self._flush)
+
+        self._ids.clear()
+        self._flush.clear()
+
+        if ids or flush:
+            await self.publish_now(ids, flush)
+
+    def _handle(self, message: bytes) -> None:
+        data = json.loads(message)
+
+        if data["node"] == NODE_ID:
+            return
+
+        _evict(data["ids"], data["flush"])
+
+        if data.get("changed"):
+            for name, entity_ids in data["ids"].items():
+                get_access_rates_by_name(name).record_invalidations(len(entity_ids))
+                # they might have been created
+                update_existence_filter(name, entity_ids)
+
+    async def listen(self) -> None:
+        """Evicts the entities invalidated by the other processes from the
+        local caches, forever. We might miss messages while we are not
+        subscribed, so the local caches are cleared (and the rows created in
+        the meantime are added to the existence filters) every time we
+        (re)subscribe."""
+
+        while True:
+            redis = None
+
+            try:
+                redis = await aioredis.create_redis(
+                    settings.REDIS_ADDRESS,
+                    timeout=settings.REDIS_CONNECT_TIMEOUT_IN_SECONDS,
+                )
+
+                (channel,) = await redis.subscribe(CHANNEL)
+
+                clear_local_caches()
+                run_in_background(catch_up_existence_filters())
+
+                # the iterator stops when the connection is lost
+                async for message in channel.iter():
+                    try:
+                        self._handle(message)
+                    except (ValueError, KeyError, TypeError):
+                        logger.warning("Invalid invalidation message: %r", message)
+            except (OSError, aioredis.RedisError):
+                logger.exception("Lost the cache invalidations subscription")
+            finally:
+                if redis is not None:
+                    redis.close()
+
+            await asyncio.sleep(RECONNECT_INTERVAL_IN_SECONDS)
+
+
+_invalidation_bus = InvalidationBus()
+
+
+def get_invalidation_bus() -> InvalidationBus:
+    return _invalidation_bus
+
+
+_listener: Optional[asyncio.Future] = None
+
+
+def start_invalidation_listener() -> None:
+    global _listener
+
+    if settings.CACHE_BACKEND != "redis":
+        return
+
+    if _listener is None or _listener.done():
+        _listener = run_in_background(_invalidation_bus.listen())
+
+
+async def stop_invalidation_listener() -> None:
+    global _listener
+
+    if _listener is None:
+        return
+
+    _listener.cancel()
+
+    try:
+        await _listener
+    except asyncio.CancelledError:
+        pass
+
+    _listener = None
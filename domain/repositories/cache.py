@@ -1,21 +1,73 @@
+import asyncio
 import dataclasses
 import json
-from typing import Any, Generic, List, Optional, Protocol, Type, TypeVar
+import logging
+import random
+import time
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    FrozenSet,
+    Generic,
+    Iterable,
+    List,
+    Optional,
+    Protocol,
+    Sequence,
+    Type,
+    TypeVar,
+    Union,
+)
 
-import aioredis
 from asgiref.sync import sync_to_async
 from django.db.models.base import Model
 from domain.converter import convert_django_model
-from domain.entities import convert_dict_to_entity
+from domain.entities import (
+    EntityDecodeError,
+    get_entity_decoder,
+    get_entity_fingerprint,
+)
+from domain.redis_cluster import add_hash_tag
 
+from .backends import CacheBackend, CacheUnavailable, RedisBackend, ReplaceItem
+from .breaker import get_degraded_semaphore
+from .bus import get_invalidation_bus
+from .chunks import run_in_chunks
+from .coalescer import get_read_coalescer
+from .entry import CacheEntry, create_entry
+from .existence import get_existence_filter
+from .generations import bump_generation, get_generation, get_table_version
+from .hashes import (
+    ENTRY_FIELD,
+    dump_entry_field,
+    dump_hash,
+    get_hash_fields,
+    load_hash,
+)
+from .hotkeys import HotKeys, get_hot_keys
+from .local import LocalCache, get_hot_replica, get_local_cache
+from .tinylfu import TinyLfuCache
+from .serializers import (
+    Serializer,
+    compress_value,
+    decode_entry,
+    decompress_value,
+    is_compressed,
+    json_serializer,
+)
+from .singleflight import get_single_flight
 from .stats import (
     DataFetchingStats,
     increase_redis_gets,
     increase_redis_sets,
     increase_sql_queries,
 )
+from .tasks import run_in_background
+from .ttl import get_access_rates, get_adaptive_expire_in_seconds
 
-T = TypeVar("T")
+logger = logging.getLogger(__name__)
 
 M = TypeVar("M", bound=Model)
 E = TypeVar("E")
@@ -25,118 +77,1044 @@ class WithId(Protocol):
     id: Any
 
 
-def _get_caching_key_for_class(entity_class: Any, id: str) -> str:
-    return f"{entity_class.__name__}-{id}"
+async def get_key_prefix(backend: CacheBackend, entity_class: Any) -> str:
+    """Keys are prefixed with the name of the entity, a fingerprint of its
+    fields and the current generation of the entity class. So changing the
+    entity or bumping the generation gives us a new set of keys, without
+    having to delete the old ones."""
+
+    generation = await get_generation(backend, entity_class.__name__)
+    fingerprint = get_entity_fingerprint(entity_class)
+
+    return add_hash_tag(f"{entity_class.__name__}:{fingerprint}:{generation}")
+
+
+def _get_caching_key(prefix: str, id: Any) -> str:
+    return f"{prefix}-{id}"
+
 
+def _get_lease_key(caching_key: str) -> str:
+    return f"lease:{caching_key}"
 
-def _get_caching_key(entity: WithId) -> str:
-    return _get_caching_key_for_class(type(entity), entity.id)
+
+def _get_id_list_key(
+    entity_class: Any, name: str, params: Sequence[Any], versions: Sequence[int]
+) -> str:
+    params_key = ":".join(str(param) for param in params)
+    versions_key = ".".join(str(version) for version in versions)
+
+    return f"ids:{entity_class.__name__}:{name}:{params_key}:{versions_key}"
+
+
+LEASE_TOKEN = b"1"
 
 
 class BaseCacheRepository(Generic[M, E]):
     model_class: M
-    entity_class: E
+    entity_class: Type[E]
+
+    # entities are invalidated when their rows change (see invalidation.py),
+    # so the expiry is only a safety net for changes that don't send signals
+    DEFAULT_EXPIRE_IN_SECONDS = 60 * 60
+    # each key gets a random expiry in the range of
+    # DEFAULT_EXPIRE_IN_SECONDS +/- EXPIRE_JITTER_RATIO, so that keys that
+    # are cached together don't expire at the same time
+    EXPIRE_JITTER_RATIO = 0.1
+
+    # set this to True to pick the expiry between MIN_EXPIRE_IN_SECONDS and
+    # MAX_EXPIRE_IN_SECONDS, depending on how often the entities are read
+    # compared to how often they change (see ttl.py), the default expiry is
+    # used until we have seen enough reads and changes
+    ADAPTIVE_EXPIRE = False
+    MIN_EXPIRE_IN_SECONDS = 60
+    MAX_EXPIRE_IN_SECONDS = 60 * 60 * 24
+
+    # set this to a number between 0 and 1 to extend the expiry of the
+    # entities that are read when less than this fraction of it is left, so
+    # that entities that are read often don't expire (they are still
+    # invalidated when they change) for up to MAX_EXPIRE_IN_SECONDS
+    SLIDING_EXPIRE_RATIO = 0.0
+
+    # serializer used when writing values, values written by any of the
+    # serializers can always be read, so this can be changed at any time
+    # (as long as all the workers know how to read the new format)
+    SERIALIZER: Serializer = json_serializer
 
-    DEFAULT_EXPIRE_IN_SECONDS = 60 * 5
+    # values bigger than this are compressed with zlib before being sent to
+    # redis, set it to 0 to disable compression
+    COMPRESSION_MIN_SIZE_IN_BYTES = 0
+    COMPRESSION_LEVEL = 6
+
+    # set this to True to store each entity as a redis hash, with one field
+    # per entity field, so that get_by_id and get_batch_by_ids can fetch only
+    # the fields that are needed, each field bigger than
+    # COMPRESSION_MIN_SIZE_IN_BYTES is compressed on its own. Going back to
+    # plain values needs an invalidate_cache
+    HASH_STORAGE = False
+
+    # set this to a positive number to allow only one worker (across
+    # processes) to fetch a missing entity from the db, the other workers
+    # will wait up to LEASE_TIMEOUT_IN_MS for it to be cached
+    LEASE_TIMEOUT_IN_MS = 0
+    LEASE_POLL_INTERVAL_IN_MS = 20
+
+    # set this to a positive number to refresh entities in the background
+    # before they expire (see CacheEntry.should_refresh_early), so that hot
+    # keys almost never miss, values greater than 1 favour earlier refreshes
+    REFRESH_AHEAD_BETA = 0.0
+
+    # set this to a positive number to keep entities in redis for this many
+    # seconds after they expire, during this time they are returned straight
+    # away, while a fresh copy is fetched from the db in the background
+    STALE_WHILE_REVALIDATE_IN_SECONDS = 0
+
+    # ids that are not in the db are cached as tombstones for this many
+    # seconds, set it to 0 to disable negative caching
+    MISSING_EXPIRE_IN_SECONDS = 30
+
+    # set this to True to keep a Bloom filter of the ids in the table (see
+    # existence.py), ids that are definitely not in it are then returned as
+    # None without going to the cache or to the db. Filters are loaded by the
+    # ASGI lifespan hook and kept up to date by the invalidation signals and
+    # bus, so other processes only see new ids once they get their message,
+    # without the bus (ie. with the other backends) they are not used
+    EXISTENCE_FILTER = False
+    EXISTENCE_FILTER_CAPACITY = 1_000_000
+    EXISTENCE_FILTER_ERROR_RATE = 0.01
+
+    # set this to a positive number to keep up to LOCAL_CACHE_MAX_SIZE
+    # entities in memory (per entity class) in front of redis, every write
+    # tells the other processes to drop their local copy (see bus.py)
+    LOCAL_CACHE_MAX_SIZE = 0
+    LOCAL_CACHE_EXPIRE_IN_SECONDS = 5
+    # set this to a positive number to bound the local cache by the memory
+    # used by its entities instead, it then uses W-TinyLFU (see tinylfu.py),
+    # so that scans of ids that are read only once don't evict the hot ones
+    LOCAL_CACHE_MAX_SIZE_IN_BYTES = 0
+
+    # set this to a positive number to count the reads of each id (see
+    # hotkeys.py) and keep the entities read at least this many times in a
+    # small in-process replica for HOT_KEY_EXPIRE_IN_SECONDS, so that a few
+    # very popular ids don't saturate the redis node that owns them
+    HOT_KEY_THRESHOLD = 0
+    HOT_KEY_REPLICA_MAX_SIZE = 100
+    HOT_KEY_EXPIRE_IN_SECONDS = 1
+
+    # big batches are split in chunks, so that we don't block redis for too
+    # long or go past the max number of parameters of a query (999 on older
+    # versions of SQLite), up to MAX_CONCURRENT_CHUNKS chunks of a batch are
+    # sent at the same time. Set the chunk sizes to 0 to disable chunking
+    CACHE_CHUNK_SIZE = 500
+    DB_CHUNK_SIZE = 500
+    MAX_CONCURRENT_CHUNKS = 4
+
+    # set this to True to merge the cache reads of concurrent requests into
+    # one command (see coalescer.py), the reads wait for up to
+    # CACHE_READ_COALESCING_WINDOW_IN_MS, so this only pays off for types
+    # that many requests read at the same time
+    COALESCE_READS = False
+
+    # set this to True to cache the ids returned by the list queries (see
+    # _get_cached_ids), the keys include the versions of the tables the query
+    # reads, which are bumped when their rows change, so cached lists are at
+    # most ID_LIST_EXPIRE_IN_SECONDS old when signals are not sent
+    CACHE_ID_LISTS = False
+    ID_LIST_EXPIRE_IN_SECONDS = 60
 
     def __init__(
-        self, redis: aioredis.Redis, data_fetching_stats: DataFetchingStats
+        self, backend: CacheBackend, data_fetching_stats: DataFetchingStats
     ) -> None:
-        self.redis = redis
+        self.backend = backend
         self.stats = data_fetching_stats
 
+        # compiles the decoder the first time the repository is used
+        get_entity_decoder(self.entity_class)
+
+    async def _get_caching_keys(self, ids: List[Any]) -> List[str]:
+        prefix = await get_key_prefix(self.backend, self.entity_class)
+
+        return [_get_caching_key(prefix, id) for id in ids]
+
+    def _has_local_cache(self) -> bool:
+        return self.LOCAL_CACHE_MAX_SIZE > 0 or self.LOCAL_CACHE_MAX_SIZE_IN_BYTES > 0
+
+    def _get_local_cache(self) -> Optional[Union[LocalCache, TinyLfuCache]]:
+        if not self._has_local_cache():
+            return None
+
+        return get_local_cache(
+            self.entity_class,
+            self.LOCAL_CACHE_MAX_SIZE,
+            self.LOCAL_CACHE_EXPIRE_IN_SECONDS,
+            self.LOCAL_CACHE_MAX_SIZE_IN_BYTES,
+        )
+
+    def _get_hot_keys(self) -> Optional[HotKeys]:
+        if self.HOT_KEY_THRESHOLD <= 0:
+            return None
+
+        return get_hot_keys(
+            self.entity_class,
+            self.HOT_KEY_THRESHOLD,
+            self.HOT_KEY_REPLICA_MAX_SIZE,
+            self.HOT_KEY_EXPIRE_IN_SECONDS,
+        )
+
+    def _store_locally(self, entities: List[WithId]) -> None:
+        local_cache = self._get_local_cache()
+        hot_keys = self._get_hot_keys()
+
+        for entity in entities:
+            if local_cache is not None:
+                local_cache.set(str(entity.id), entity)
+
+            if hot_keys is not None and hot_keys.is_hot(str(entity.id)):
+                hot_keys.replica.set(str(entity.id), entity)
+
+    def _promote_hot_entities(
+        self, hot_keys: HotKeys, hot_ids: List[str], entries: Dict[str, CacheEntry]
+    ) -> None:
+        for id in hot_ids:
+            entry = entries.get(id)
+
+            if (
+                entry
+                and entry.entity is not None
+                and hot_keys.promote(id, entry.entity)
+            ):
+                self.stats.number_of_hot_key_promotions += 1
+
+        self.stats.hot_key_promotions[self.entity_class.__name__] = (
+            hot_keys.number_of_promotions
+        )
+
+    def _publish_invalidation(self, ids: List[Any], flush: bool = False) -> None:
+        # all the processes use the same repositories, so when this one
+        # doesn't have a local cache none of the others do, the bus uses
+        # redis pub/sub, so it only works with the redis backend
+        if not self._has_local_cache() and self.HOT_KEY_THRESHOLD <= 0:
+            return
+
+        if not isinstance(self.backend, RedisBackend):
+            return
+
+        get_invalidation_bus().publish(self.entity_class.__name__, ids, flush)
+
+    async def _run_in_cache_chunks(
+        self, items: List[Any], fn: Callable[[List[Any]], Awaitable[List[Any]]]
+    ) -> List[Any]:
+        started_at = time.perf_counter()
+
+        results, number_of_chunks = await run_in_chunks(
+            items, self.CACHE_CHUNK_SIZE, self.MAX_CONCURRENT_CHUNKS, fn
+        )
+
+        self.stats.number_of_cache_chunks += number_of_chunks
+        self.stats.cache_chunks_time_in_ms += (time.perf_counter() - started_at) * 1000
+
+        return results
+
+    async def _run_in_db_chunks(
+        self, ids: List[str], fn: Callable[[List[str]], Awaitable[List[Any]]]
+    ) -> List[Any]:
+        started_at = time.perf_counter()
+
+        results, number_of_chunks = await run_in_chunks(
+            ids, self.DB_CHUNK_SIZE, self.MAX_CONCURRENT_CHUNKS, fn
+        )
+
+        self.stats.number_of_db_chunks += number_of_chunks
+        self.stats.db_chunks_time_in_ms += (time.perf_counter() - started_at) * 1000
+
+        return results
+
+    def _get_base_expire_in_seconds(self) -> int:
+        if not self.ADAPTIVE_EXPIRE:
+            return self.DEFAULT_EXPIRE_IN_SECONDS
+
+        expire_in_seconds = get_adaptive_expire_in_seconds(
+            get_access_rates(self.entity_class),
+            self.DEFAULT_EXPIRE_IN_SECONDS,
+            self.MIN_EXPIRE_IN_SECONDS,
+            self.MAX_EXPIRE_IN_SECONDS,
+        )
+
+        self.stats.expire_in_seconds[self.entity_class.__name__] = expire_in_seconds
+
+        return expire_in_seconds
+
+    def _get_expire_in_seconds(self) -> int:
+        expire_in_seconds = self._get_base_expire_in_seconds()
+        jitter = int(expire_in_seconds * self.EXPIRE_JITTER_RATIO)
+
+        return max(1, expire_in_seconds + random.randint(-jitter, jitter))
+
+    def _encode(
+        self, entity: Optional[WithId], expire_in_seconds: int, delta: float = 0
+    ) -> bytes:
+        value = self.SERIALIZER.dumps(create_entry(entity, expire_in_seconds, delta))
+
+        return self._compress(value)
+
+    def _compress(self, value: bytes) -> bytes:
+        if 0 < self.COMPRESSION_MIN_SIZE_IN_BYTES <= len(value):
+            started_at = time.perf_counter()
+            compressed_value = compress_value(value, self.COMPRESSION_LEVEL)
+
+            self.stats.compression_time_in_ms += (
+                time.perf_counter() - started_at
+            ) * 1000
+            self.stats.record_compression(len(value), len(compressed_value))
+
+            return compressed_value
+
+        return value
+
+    async def _set_many(
+        self,
+        keys: List[str],
+        entities: Sequence[Optional[WithId]],
+        expires_in_seconds: List[int],
+        delta: float = 0,
+    ) -> None:
+        """Sets all the keys in batches of CACHE_CHUNK_SIZE, each one with its
+        own expiry, entities that are None are stored as tombstones."""
+
+        items = []
+
+        for key, entity, expire_in_seconds in zip(keys, entities, expires_in_seconds):
+            # we don't serve stale tombstones
+            backend_expire_in_seconds = expire_in_seconds
+
+            if entity is not None:
+                backend_expire_in_seconds += self.STALE_WHILE_REVALIDATE_IN_SECONDS
+
+            if self.HASH_STORAGE:
+                value: Any = dump_hash(
+                    create_entry(entity, expire_in_seconds, delta), self._compress
+                )
+            else:
+                value = self._encode(entity, expire_in_seconds, delta)
+
+            items.append((key, value, backend_expire_in_seconds))
+
+        async def set_many(chunk: List[Any]) -> List[None]:
+            if self.HASH_STORAGE:
+                await self.backend.set_hashes(chunk)
+            else:
+                await self.backend.set_many(chunk)
+
+            return [None] * len(chunk)
+
+        # writes are best effort, the entities will be cached by the next
+        # read once the cache is back
+        try:
+            if len(items) == 1:
+                await set_many(items)
+            else:
+                await self._run_in_cache_chunks(items, set_many)
+        except CacheUnavailable as e:
+            self._record_cache_failure(e)
+
     @increase_redis_sets
-    async def _cache_entity(self, entity: WithId):
-        await self.redis.set(
-            _get_caching_key(entity),
-            json.dumps(dataclasses.asdict(entity)),
-            expire=self.DEFAULT_EXPIRE_IN_SECONDS,
+    async def _cache_entity(self, entity: WithId, delta: float = 0):
+        self._store_locally([entity])
+        self._publish_invalidation([entity.id])
+
+        keys = await self._get_caching_keys([entity.id])
+
+        await self._set_many(keys, [entity], [self._get_expire_in_seconds()], delta)
+
+    @increase_redis_sets
+    async def _cache_entities_batch(self, entities: List[WithId], delta: float = 0):
+        self._store_locally(entities)
+        self._publish_invalidation([entity.id for entity in entities])
+
+        if not entities:
+            return
+
+        keys = await self._get_caching_keys([entity.id for entity in entities])
+
+        await self._set_many(
+            keys,
+            entities,
+            [self._get_expire_in_seconds() for _ in entities],
+            delta,
         )
 
     @increase_redis_sets
-    async def _cache_entities_batch(self, entities: List[WithId]):
-        entities_dict = {
-            _get_caching_key(entity): json.dumps(dataclasses.asdict(entity))
-            for entity in entities
-        }
+    async def _cache_missing(self, ids: List[str]):
+        """Stores a tombstone for each of the given ids, so that we don't keep
+        hitting the db when looking up ids that don't exist."""
+
+        self._publish_invalidation(ids)
+
+        keys = await self._get_caching_keys(ids)
+
+        await self._set_many(
+            keys, [None] * len(ids), [self.MISSING_EXPIRE_IN_SECONDS] * len(ids)
+        )
+
+    def _decode(self, value: Any) -> Optional[CacheEntry[E]]:
+        """Decodes a cached value, values that can't be decoded (ie. because
+        the entity changed) are treated as misses, so they get replaced."""
+
+        try:
+            if value and is_compressed(value):
+                started_at = time.perf_counter()
+                value = decompress_value(value)
+
+                self.stats.decompression_time_in_ms += (
+                    time.perf_counter() - started_at
+                ) * 1000
+
+            return decode_entry(value, self.entity_class)
+        except EntityDecodeError as e:
+            logger.warning("Invalid cached value: %s", e)
 
-        # TODO: set expiry using a lua script or similar
+            self.stats.number_of_invalid_cache_values += 1
 
-        await self.redis.mset(
-            entities_dict,
-            # expire=self.DEFAULT_EXPIRE_IN_SECONDS,
+            return None
+
+    def _decode_hash(
+        self, values: Optional[List[Optional[bytes]]], fields: Optional[FrozenSet[str]]
+    ) -> Optional[CacheEntry[E]]:
+        self.stats.redis_bytes_read += sum(
+            len(value) for value in values or [] if value
         )
 
+        try:
+            return load_hash(values, self.entity_class, fields)
+        except EntityDecodeError as e:
+            logger.warning("Invalid cached value: %s", e)
+
+            self.stats.number_of_invalid_cache_values += 1
+
+            return None
+
+    def _record_coalesced_read(self, shared: bool, number_of_duplicates: int):
+        if shared:
+            self.stats.number_of_coalesced_cache_reads += 1
+
+        self.stats.number_of_coalesced_cache_keys += number_of_duplicates
+
+    async def _read_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        backend = self.backend
+
+        # the other backends don't do any network round trip
+        if not self.COALESCE_READS or not isinstance(backend, RedisBackend):
+            return await backend.get_many(keys)
+
+        values, shared, number_of_duplicates = await get_read_coalescer().read(
+            backend, keys
+        )
+
+        self._record_coalesced_read(shared, number_of_duplicates)
+
+        return values
+
+    async def _read_hashes(
+        self, keys: List[str], hash_fields: Sequence[str]
+    ) -> List[Optional[List[Optional[bytes]]]]:
+        backend = self.backend
+
+        if not self.COALESCE_READS or not isinstance(backend, RedisBackend):
+            return await backend.get_hashes(keys, hash_fields)
+
+        values, shared, number_of_duplicates = await get_read_coalescer().read(
+            backend, keys, hash_fields
+        )
+
+        self._record_coalesced_read(shared, number_of_duplicates)
+
+        return values
+
+    async def _get_hashes(
+        self, keys: List[str], fields: Optional[FrozenSet[str]]
+    ) -> List[Optional[CacheEntry[E]]]:
+        hash_fields = get_hash_fields(self.entity_class, fields)
+
+        if len(keys) == 1:
+            results = await self._read_hashes(keys, hash_fields)
+        else:
+            results = await self._run_in_cache_chunks(
+                keys, lambda chunk: self._read_hashes(chunk, hash_fields)
+            )
+
+        return [self._decode_hash(values, fields) for values in results]
+
     @increase_redis_gets
-    async def _get_cached_entity(self, id: str, entity_class: Type[T]) -> Optional[T]:
-        entity = await self.redis.get(_get_caching_key_for_class(entity_class, id))
+    async def _get_cached_entry(
+        self, id: str, fields: Optional[FrozenSet[str]] = None
+    ) -> Optional[CacheEntry[E]]:
+        keys = await self._get_caching_keys([id])
+
+        if self.HASH_STORAGE:
+            (entry,) = await self._get_hashes(keys, fields)
+
+            return entry
 
-        return convert_dict_to_entity(entity, entity_class)
+        (value,) = await self._read_many(keys)
+
+        self.stats.redis_bytes_read += len(value or b"")
+
+        return self._decode(value)
 
     @increase_redis_gets
-    async def _get_cached_entities_batch(
-        self, ids: List[str], entity_class: Type[T]
-    ) -> List[Optional[T]]:
-        keys = [_get_caching_key_for_class(entity_class, id) for id in ids]
+    async def _get_cached_entries_batch(
+        self, ids: List[str], fields: Optional[FrozenSet[str]] = None
+    ) -> List[Optional[CacheEntry[E]]]:
+        keys = await self._get_caching_keys(ids)
+
+        if self.HASH_STORAGE:
+            return await self._get_hashes(keys, fields)
+
+        values = await self._run_in_cache_chunks(keys, self._read_many)
+
+        self.stats.redis_bytes_read += sum(len(value) for value in values if value)
+
+        return [self._decode(value) for value in values]
+
+    def _revalidate(self, ids: List[str], entries: List[Optional[CacheEntry]]) -> None:
+        """Schedules a background refresh for the entries that are stale or
+        that should be refreshed ahead of their expiry, concurrent refreshes
+        of the same ids are deduplicated by _load_missing."""
+
+        ids_to_refresh = []
 
-        entities = await self.redis.mget(*keys)
+        for id, entry in zip(ids, entries):
+            # we don't revalidate ids that are known to be missing, their
+            # tombstones expire quickly anyway
+            if not entry or entry.entity is None:
+                continue
 
-        return [convert_dict_to_entity(entity, entity_class) for entity in entities]
+            if self.STALE_WHILE_REVALIDATE_IN_SECONDS > 0 and entry.is_stale():
+                self.stats.number_of_stale_hits += 1
+
+                ids_to_refresh.append(id)
+
+            elif self.REFRESH_AHEAD_BETA > 0 and entry.should_refresh_early(
+                self.REFRESH_AHEAD_BETA
+            ):
+                self.stats.number_of_refreshes_ahead += 1
+
+                ids_to_refresh.append(id)
+
+        if ids_to_refresh:
+            run_in_background(self._load_missing(ids_to_refresh))
+
+    def _slide_expiry(
+        self, ids: List[str], entries: List[Optional[CacheEntry]]
+    ) -> None:
+        """Extends, in the background, the expiry of the entities that are
+        close to it, see SLIDING_EXPIRE_RATIO.
+
+        Only the entries that are still the cached ones are extended (they
+        keep their filled_at), so entities invalidated since they were read
+        don't come back, and entities stop sliding MAX_EXPIRE_IN_SECONDS
+        after they were fetched from the db, so that changes that don't send
+        signals are eventually seen."""
+
+        now = time.time()
+        min_time_left = self._get_base_expire_in_seconds() * self.SLIDING_EXPIRE_RATIO
+
+        entries_by_id = {
+            id: entry
+            for id, entry in zip(ids, entries)
+            if entry
+            and entry.entity is not None
+            and entry.expires_at
+            and now < entry.expires_at < now + min_time_left
+            and now - entry.filled_at < self.MAX_EXPIRE_IN_SECONDS
+        }
+
+        if not entries_by_id:
+            return
+
+        self.stats.number_of_sliding_expirations += len(entries_by_id)
+
+        async def slide_expiry() -> None:
+            keys = await self._get_caching_keys(list(entries_by_id))
+            items: List[ReplaceItem] = []
+
+            for key, entry in zip(keys, entries_by_id.values()):
+                expire_in_seconds = self._get_expire_in_seconds()
+                slid_entry = dataclasses.replace(
+                    entry, expires_at=now + expire_in_seconds
+                )
+                backend_expire_in_seconds = (
+                    expire_in_seconds + self.STALE_WHILE_REVALIDATE_IN_SECONDS
+                )
+
+                # we compare the entry we read, encoded again, with the
+                # cached one, entries written in another format (ie. by
+                # another serializer) just don't slide
+                if self.HASH_STORAGE:
+                    items.append(
+                        (
+                            key,
+                            ENTRY_FIELD,
+                            dump_entry_field(entry),
+                            dump_entry_field(slid_entry),
+                            backend_expire_in_seconds,
+                        )
+                    )
+                else:
+                    expected_value = self.SERIALIZER.dumps(entry)
+
+                    if 0 < self.COMPRESSION_MIN_SIZE_IN_BYTES <= len(expected_value):
+                        expected_value = compress_value(
+                            expected_value, self.COMPRESSION_LEVEL
+                        )
+
+                    items.append(
+                        (
+                            key,
+                            None,
+                            expected_value,
+                            self._compress(self.SERIALIZER.dumps(slid_entry)),
+                            backend_expire_in_seconds,
+                        )
+                    )
+
+            try:
+                await self.backend.replace_many(items)
+            except CacheUnavailable as e:
+                self._record_cache_failure(e)
+
+        run_in_background(slide_expiry())
+
+    def _get_projection(
+        self, fields: Optional[Iterable[str]]
+    ) -> Optional[FrozenSet[str]]:
+        """Returns the fields to fetch from redis, or None when we need to
+        fetch the whole entity. We can only fetch some fields of entities
+        stored as hashes, and we always fetch the id."""
+
+        if fields is None or not self.HASH_STORAGE:
+            return None
+
+        projection = frozenset(fields) | {"id"}
+
+        if projection.issuperset(get_hash_fields(self.entity_class)[1:]):
+            return None
+
+        return projection
+
+    async def _get_entry(
+        self, id: str, fields: Optional[FrozenSet[str]] = None
+    ) -> Optional[CacheEntry[E]]:
+        """Returns the cache entry for the given id, first looking in the local
+        cache and then in redis. Entries for ids that are known to be missing
+        from the db have their entity set to None."""
+
+        entries = await self._get_entries_batch([id], fields)
+
+        return entries[0]
+
+    async def _get_entries_batch(
+        self, ids: List[str], fields: Optional[FrozenSet[str]] = None
+    ) -> List[Optional[CacheEntry[E]]]:
+        local_cache = self._get_local_cache()
+        hot_keys = self._get_hot_keys()
+
+        entries: List[Optional[CacheEntry[E]]] = [None] * len(ids)
+
+        if local_cache is not None:
+            for index, id in enumerate(ids):
+                entity = local_cache.get(str(id))
+
+                if entity is not None:
+                    entries[index] = CacheEntry(entity)
+
+            self.stats.number_of_local_cache_hits += sum(
+                1 for entry in entries if entry
+            )
+
+            if isinstance(local_cache, TinyLfuCache):
+                self.stats.local_caches[self.entity_class.__name__] = (
+                    local_cache.get_stats()
+                )
+
+        if self.ADAPTIVE_EXPIRE:
+            get_access_rates(self.entity_class).record_reads(len(ids))
+
+        hot_ids: List[str] = []
+
+        if hot_keys is not None:
+            hot_ids = hot_keys.record(str(id) for id in ids)
+
+            name = self.entity_class.__name__
+
+            self.stats.hot_keys[name] = hot_keys.get_hot_keys()
+            self.stats.hot_key_promotions[name] = hot_keys.number_of_promotions
+
+            for index, id in enumerate(ids):
+                if entries[index]:
+                    continue
+
+                entity = hot_keys.replica.get(str(id))
+
+                if entity is not None:
+                    entries[index] = CacheEntry(entity)
+
+                    self.stats.number_of_hot_key_hits += 1
+
+        missing_indexes = [index for index, entry in enumerate(entries) if not entry]
+
+        if not missing_indexes:
+            return entries
+
+        missing_ids = [ids[index] for index in missing_indexes]
+
+        if len(missing_ids) == 1:
+            cached_entries = [await self._get_cached_entry(missing_ids[0], fields)]
+        else:
+            cached_entries = await self._get_cached_entries_batch(missing_ids, fields)
+
+        self._revalidate(missing_ids, cached_entries)
+
+        if self.SLIDING_EXPIRE_RATIO > 0:
+            self._slide_expiry(missing_ids, cached_entries)
+
+        for index, entry in zip(missing_indexes, cached_entries):
+            entries[index] = entry
+
+            # partial entities can't be stored locally
+            if (
+                entry
+                and entry.entity is not None
+                and local_cache is not None
+                and fields is None
+            ):
+                local_cache.set(str(ids[index]), entry.entity)
+
+        # partial entities can't be promoted either
+        if hot_keys is not None and hot_ids and fields is None:
+            self._promote_hot_entities(
+                hot_keys,
+                hot_ids,
+                {
+                    str(ids[index]): entry
+                    for index, entry in zip(missing_indexes, cached_entries)
+                    if entry
+                },
+            )
+
+        return entries
 
     @increase_sql_queries
     @sync_to_async
     def _get_by_from_db(self, id: str) -> Optional[M]:
         return self.model_class.objects.filter(id=id).first()
 
-    async def get_by_id(self, id: str) -> Optional[E]:
-        entity = await self._get_cached_entity(id, self.entity_class)
+    @increase_sql_queries
+    @sync_to_async
+    def _get_batch_by_ids_from_db(self, ids: List[str]) -> List[M]:
+        return list(self.model_class.objects.filter(id__in=ids))
+
+    async def _fetch_from_db(self, ids: List[str]) -> List[E]:
+        if len(ids) == 1:
+            db_value = await self._get_by_from_db(ids[0])
+            db_values = [db_value] if db_value else []
+        else:
+            db_values = await self._get_batch_by_ids_from_db(ids)
+
+        return [convert_django_model(db_value) for db_value in db_values]
+
+    async def _acquire_leases(self, ids: List[str]) -> List[bool]:
+        keys = await self._get_caching_keys(ids)
+
+        return await self.backend.add_many(
+            [_get_lease_key(key) for key in keys], LEASE_TOKEN, self.LEASE_TIMEOUT_IN_MS
+        )
+
+    async def _release_leases(self, ids: List[str]) -> None:
+        # leases expire on their own, if ours expired and someone else got
+        # one in the meantime, we only allow one more worker to go to the db
+        try:
+            keys = await self._get_caching_keys(ids)
+
+            await self.backend.delete_many([_get_lease_key(key) for key in keys])
+        except CacheUnavailable as e:
+            self._record_cache_failure(e)
+
+    async def _wait_for_other_workers(self, ids: List[str]) -> Dict[str, Optional[E]]:
+        """Polls the cache until the workers holding the leases for the given
+        ids have cached them, or until we have waited for
+        LEASE_TIMEOUT_IN_MS, in which case we'll fetch them ourselves."""
+
+        self.stats.number_of_lease_waits += len(ids)
 
-        if entity:
-            return entity
+        entities: Dict[str, Optional[E]] = {}
+        deadline = time.monotonic() + self.LEASE_TIMEOUT_IN_MS / 1000
 
-        db_value = await self._get_by_from_db(id)
+        while ids and time.monotonic() < deadline:
+            await asyncio.sleep(self.LEASE_POLL_INTERVAL_IN_MS / 1000)
 
-        if not db_value:
+            entries = await self._get_cached_entries_batch(ids)
+
+            for id, entry in zip(ids, entries):
+                if entry:
+                    entities[str(id)] = entry.entity
+
+            ids = [id for id in ids if str(id) not in entities]
+
+        return entities
+
+    async def _fetch_and_cache_chunk(self, ids: List[str]) -> List[E]:
+        # queries are run one at a time on django's sync thread, so running
+        # chunks concurrently overlaps the queries with the cache writes
+        started_at = time.perf_counter()
+        entities = await self._fetch_from_db(ids)
+        delta = time.perf_counter() - started_at
+
+        if len(entities) == 1:
+            await self._cache_entity(entities[0], delta)
+        elif entities:
+            await self._cache_entities_batch(entities, delta)
+
+        return entities
+
+    async def _fetch_and_cache(self, ids: List[str]) -> Dict[str, Optional[E]]:
+        entities: Dict[str, Optional[E]] = {}
+        leased_ids: List[str] = []
+
+        if self.LEASE_TIMEOUT_IN_MS > 0:
+            acquired = await self._acquire_leases(ids)
+
+            leased_ids = [id for id, ok in zip(ids, acquired) if ok]
+            other_ids = [id for id, ok in zip(ids, acquired) if not ok]
+
+            if other_ids:
+                entities.update(await self._wait_for_other_workers(other_ids))
+
+            ids = [id for id in ids if str(id) not in entities]
+
+        fetched_entities = (
+            await self._run_in_db_chunks(ids, self._fetch_and_cache_chunk)
+            if ids
+            else []
+        )
+
+        for entity in fetched_entities:
+            entities[str(entity.id)] = entity
+
+        missing_ids = [id for id in ids if str(id) not in entities]
+
+        if missing_ids and self.MISSING_EXPIRE_IN_SECONDS > 0:
+            await self._cache_missing(missing_ids)
+
+        if leased_ids:
+            await self._release_leases(leased_ids)
+
+        return entities
+
+    async def _load_missing(self, ids: List[str]) -> Dict[str, Optional[E]]:
+        """Loads the given ids from the database, concurrent loads of the same
+        ids in this process are coalesced into one."""
+
+        keys = await self._get_caching_keys(ids)
+        ids_by_key = {key: str(id) for key, id in zip(keys, ids)}
+
+        async def load(keys: List[str]) -> Dict[str, Optional[E]]:
+            entities = await self._fetch_and_cache([ids_by_key[key] for key in keys])
+
+            return {key: entities.get(ids_by_key[key]) for key in keys}
+
+        entities, coalesced = await get_single_flight().do_many(list(ids_by_key), load)
+
+        self.stats.number_of_coalesced_misses += coalesced
+
+        return {ids_by_key[key]: entity for key, entity in entities.items()}
+
+    async def _get_cached_ids(
+        self,
+        name: str,
+        params: Sequence[Any],
+        model_classes: List[Type[Model]],
+        fetch: Callable[[], Awaitable[List[Any]]],
+    ) -> List[Any]:
+        """Returns the ids returned by fetch, caching them under a key made of
+        the name and the params of the query and of the versions of the
+        tables it reads (model_classes), ids must be JSON serializable."""
+
+        if not self.CACHE_ID_LISTS:
+            return await fetch()
+
+        try:
+            versions = [
+                await get_table_version(self.backend, model_class)
+                for model_class in model_classes
+            ]
+            key = add_hash_tag(
+                _get_id_list_key(self.entity_class, name, params, versions)
+            )
+
+            (value,) = await self.backend.get_many([key])
+        except CacheUnavailable as e:
+            self._record_cache_failure(e)
+
+            async with get_degraded_semaphore():
+                return await fetch()
+
+        self.stats.number_of_redis_gets += 1
+
+        if value is not None:
+            try:
+                ids = json.loads(value)
+            except ValueError:
+                logger.warning("Invalid cached id list: %r", key)
+            else:
+                self.stats.number_of_id_list_hits += 1
+
+                return ids
+
+        self.stats.number_of_id_list_misses += 1
+
+        ids = list(await fetch())
+
+        try:
+            await self.backend.set_many(
+                [(key, json.dumps(ids).encode(), self.ID_LIST_EXPIRE_IN_SECONDS)]
+            )
+        except CacheUnavailable as e:
+            self._record_cache_failure(e)
+
+        self.stats.number_of_redis_sets += 1
+
+        return ids
+
+    def _record_cache_failure(self, error: CacheUnavailable) -> None:
+        logger.debug("Cache unavailable: %s", error)
+
+        self.stats.number_of_cache_failures += 1
+
+        breaker = getattr(self.backend, "breaker", None)
+
+        if breaker is not None:
+            self.stats.cache_breaker_state = breaker.state
+            self.stats.number_of_cache_breaker_state_changes = (
+                breaker.number_of_state_changes
+            )
+            self.stats.cache_breaker_open_time_in_ms = (
+                breaker.open_time_in_seconds * 1000
+            )
+
+    async def _fetch_degraded(
+        self, ids: List[str], error: CacheUnavailable
+    ) -> Dict[str, Optional[E]]:
+        """Fetches the entities straight from the db, without caching them,
+        this is used while the cache is unavailable. Only a few queries are
+        sent at the same time (see get_degraded_semaphore), so that the db
+        doesn't get all the traffic the cache was absorbing."""
+
+        self._record_cache_failure(error)
+
+        started_at = time.perf_counter()
+
+        async with get_degraded_semaphore():
+            entities = await self._run_in_db_chunks(ids, self._fetch_from_db)
+
+        self.stats.number_of_degraded_fetches += len(ids)
+        self.stats.degraded_time_in_ms += (time.perf_counter() - started_at) * 1000
+
+        return {str(entity.id): entity for entity in entities}
+
+    def _may_exist(self, id: str) -> bool:
+        if not self.EXISTENCE_FILTER:
+            return True
+
+        existence_filter = get_existence_filter(self.entity_class)
+
+        if existence_filter is None or str(id) in existence_filter:
+            return True
+
+        self.stats.number_of_existence_filter_skips += 1
+
+        return False
+
+    async def get_by_id(
+        self, id: str, fields: Optional[Iterable[str]] = None
+    ) -> Optional[E]:
+        """Returns the entity with the given id, when fields is passed and the
+        entities are stored as hashes, the entities found in the cache only
+        have those fields set (the other ones are None)."""
+
+        if not self._may_exist(id):
             return None
 
-        entity = convert_django_model(db_value)
+        try:
+            entry = await self._get_entry(id, self._get_projection(fields))
 
-        await self._cache_entity(entity)
+            if entry:
+                return entry.entity
 
-        return entity
+            entities = await self._load_missing([id])
+        except CacheUnavailable as e:
+            entities = await self._fetch_degraded([id], e)
 
-    @increase_sql_queries
-    @sync_to_async
-    def _get_batch_by_ids_from_db(self, ids: str) -> List[M]:
-        # TODO: this should return {'id': instance, 'id': None}.values()
-        # to prevent issues with missing values
-        return list(self.model_class.objects.filter(id__in=ids))
+        return entities.get(str(id))
 
-    async def get_batch_by_ids(self, ids: List[str]) -> List[Optional[E]]:
-        entities = await self._get_cached_entities_batch(ids, self.entity_class)
+    async def get_batch_by_ids(
+        self, ids: List[str], fields: Optional[Iterable[str]] = None
+    ) -> List[Optional[E]]:
+        """Returns the entities with the given ids, in the same order, see
+        get_by_id for fields."""
 
-        if all(entities):
-            return entities
+        existing_ids = [id for id in ids if self._may_exist(id)]
 
-        entities_dict = {}
-        missing_ids = []
+        try:
+            entries = await self._get_entries_batch(
+                existing_ids, self._get_projection(fields)
+            )
 
-        for id_, entity in zip(ids, entities):
-            entities_dict[str(id_)] = entity
+            missing_ids = [id for id, entry in zip(existing_ids, entries) if not entry]
+            missing_entities = (
+                await self._load_missing(missing_ids) if missing_ids else {}
+            )
+
+            entities = {
+                str(id): entry.entity if entry else missing_entities.get(str(id))
+                for id, entry in zip(existing_ids, entries)
+            }
+        except CacheUnavailable as e:
+            entities = await self._fetch_degraded(existing_ids, e)
+
+        return [entities.get(str(id)) for id in ids]
+
+    @increase_redis_sets
+    async def write_to_cache(self, entities: List[WithId]) -> None:
+        """Writes the entities (as read from the db) to the cache, which is
+        what the warm_cache command does. Unlike the reads, this doesn't fill
+        the local cache nor tell the other processes, writes that fail are
+        counted in stats.number_of_cache_failures."""
+
+        if not entities:
+            return
+
+        keys = await self._get_caching_keys([entity.id for entity in entities])
+
+        await self._set_many(
+            keys, entities, [self._get_expire_in_seconds() for _ in entities]
+        )
 
-            if not entity:
-                missing_ids.append(id_)
+    async def invalidate_all(self) -> None:
+        """Invalidates all the cached entities of this repository, in one
+        operation, by bumping the generation of the entity class."""
 
-        missing_entities_db = await self._get_batch_by_ids_from_db(missing_ids)
-        missing_entities = []
+        await bump_generation(self.backend, self.entity_class.__name__)
 
-        for db_entity in missing_entities_db:
-            entity = convert_django_model(db_entity)
-            print(entity, db_entity, type(entity))
+        local_cache = self._get_local_cache()
 
-            missing_entities.append(entity)
-            entities_dict[str(db_entity.id)] = entity
+        if local_cache is not None:
+            local_cache.clear()
 
-        await self._cache_entities_batch(missing_entities)
+        if self.HOT_KEY_THRESHOLD > 0:
+            get_hot_replica(
+                self.entity_class,
+                self.HOT_KEY_REPLICA_MAX_SIZE,
+                self.HOT_KEY_EXPIRE_IN_SECONDS,
+            ).clear()
 
-        return list(entities_dict.values())
+        self._publish_invalidation([], flush=True)
@@ -0,0 +1,40 @@
+import asyncio
+from typing import Awaitable, Callable, List, Tuple, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def split_in_chunks(items: List[T], chunk_size: int) -> List[List[T]]:
+    if chunk_size <= 0 or len(items) <= chunk_size:
+        return [items]
+
+    return [items[i : i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+
+async def run_in_chunks(
+    items: List[T],
+    chunk_size: int,
+    max_concurrency: int,
+    fn: Callable[[List[T]], Awaitable[List[R]]],
+) -> Tuple[List[R], int]:
+    """Calls fn with chunks of up to chunk_size items, running up to
+    max_concurrency chunks at the same time. Returns the results of all the
+    chunks, in the same order as the chunks, and the number of chunks."""
+
+    chunks = split_in_chunks(items, chunk_size)
+
+    if len(chunks) == 1:
+        return await fn(chunks[0]), 1
+
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def run(chunk: List[T]) -> List[R]:
+        async with semaphore:
+            return await fn(chunk)
+
+    results = await asyncio.gather(*(run(chunk) for chunk in chunks))
+
+    return [result for chunk_results in results for result in chunk_results], len(
+        chunks
+    )
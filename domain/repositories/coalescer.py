@@ -0,0 +1,140 @@
+import asyncio
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+
+from .backends import RedisBackend
+from .tasks import run_in_background
+
+
+class _Batch:
+    def __init__(self, backend: RedisBackend, fields: Optional[Tuple[str, ...]]):
+        self.backend = backend
+        self.fields = fields
+        # the keys of all the callers, without duplicates, in order
+        self.keys: Dict[str, None] = {}
+        self.number_of_callers = 0
+        self.future: "asyncio.Future[Dict[str, Any]]" = (
+            asyncio.get_running_loop().create_future()
+        )
+        # sends the batch at the end of the window, it's cancelled when the
+        # batch is sent earlier
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.sent = False
+
+    async def read(self) -> None:
+        keys = list(self.keys)
+
+        try:
+            if self.fields is None:
+                values = await self.backend.get_many(keys)
+            else:
+                values = await self.backend.get_hashes(keys, self.fields)
+        except Exception as e:
+            # the callers handle the errors (ie. CacheUnavailable) themselves
+            self.future.set_exception(e)
+        else:
+            self.future.set_result(dict(zip(keys, values)))
+
+
+class ReadCoalescer:
+    """Merges the cache reads of concurrent callers (ie. of different
+    requests) that arrive within window_in_ms into one command, every caller
+    gets back the values of its own keys.
+
+    Batches are sent once the window is over, or straight away when they
+    would go past max_keys. They are read in their own task, so cancelling
+    one of the callers doesn't cancel the read for the other ones."""
+
+    def __init__(self, window_in_ms: float, max_keys: int) -> None:
+        self.window_in_ms = window_in_ms
+        self.max_keys = max_keys
+
+        self._batches: Dict[Any, _Batch] = {}
+
+    def _send(self, batch_key: Any, batch: _Batch) -> None:
+        if batch.sent:
+            return
+
+        batch.sent = True
+
+        if batch.timer is not None:
+            batch.timer.cancel()
+
+        if self._batches.get(batch_key) is batch:
+            del self._batches[batch_key]
+
+        run_in_background(batch.read())
+
+    def _get_batch(
+        self,
+        backend: RedisBackend,
+        fields: Optional[Tuple[str, ...]],
+        number_of_keys: int,
+    ) -> _Batch:
+        loop = asyncio.get_running_loop()
+
+        # the backends of the requests are different objects, but they all
+        # use the pool of their loop (see redis_client), futures can't be
+        # shared across loops though (ie. when running under runserver)
+        batch_key = (loop, fields)
+        batch = self._batches.get(batch_key)
+
+        if batch is not None and len(batch.keys) + number_of_keys > self.max_keys:
+            self._send(batch_key, batch)
+
+            batch = None
+
+        if batch is None:
+            batch = self._batches[batch_key] = _Batch(backend, fields)
+
+            batch.timer = loop.call_later(
+                self.window_in_ms / 1000, self._send, batch_key, batch
+            )
+
+        return batch
+
+    async def read(
+        self,
+        backend: RedisBackend,
+        keys: List[str],
+        fields: Optional[Sequence[str]] = None,
+    ) -> Tuple[List[Any], bool, int]:
+        """Reads the values of the given keys (or the given fields of their
+        hashes), returns them with whether the command was shared with other
+        callers and the number of keys that they requested too."""
+
+        batch = self._get_batch(
+            backend, None if fields is None else tuple(fields), len(keys)
+        )
+
+        number_of_duplicates = sum(1 for key in set(keys) if key in batch.keys)
+
+        batch.keys.update(dict.fromkeys(keys))
+        batch.number_of_callers += 1
+
+        values = await asyncio.shield(batch.future)
+
+        return (
+            [values[key] for key in keys],
+            batch.number_of_callers > 1,
+            number_of_duplicates,
+        )
+
+
+_read_coalescer: Optional[ReadCoalescer] = None
+
+
+def get_read_coalescer() -> ReadCoalescer:
+    """Returns the process wide coalescer, see the CACHE_READ_COALESCING_*
+    settings."""
+
+    global _read_coalescer
+
+    if _read_coalescer is None:
+        _read_coalescer = ReadCoalescer(
+            settings.CACHE_READ_COALESCING_WINDOW_IN_MS,
+            settings.CACHE_READ_COALESCING_MAX_KEYS,
+        )
+
+    return _read_coalescer
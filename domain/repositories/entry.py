@@ -0,0 +1,51 @@
+import math
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+@dataclass
+class CacheEntry(Generic[T]):
+    # the entity is None for ids that we know are missing from the db
+    entity: Optional[T]
+    # wall clock times of when the entry was cached and when it expires, plus
+    # how long it took to fetch it from the database, entries cached before
+    # we started storing this information have them set to 0
+    filled_at: float = 0
+    expires_at: float = 0
+    delta: float = 0
+
+    def is_stale(self) -> bool:
+        return bool(self.expires_at) and time.time() >= self.expires_at
+
+    def should_refresh_early(self, beta: float) -> bool:
+        """Probabilistic early expiration (XFetch), the closer we are to the
+        expiry and the more expensive the entity is to fetch, the more likely
+        it is that we return True. A beta greater than 1 favours earlier
+        refreshes."""
+
+        if not self.expires_at:
+            return False
+
+        # 1 - random() is in (0, 1], so the log is always defined
+        gap = -self.delta * beta * math.log(1.0 - random.random())
+
+        return time.time() + gap >= self.expires_at
+
+
+def create_entry(entity: Any, expire_in_seconds: int, delta: float = 0) -> CacheEntry:
+    """Creates an entry for the entity, note that the expiry here is the
+    logical one, the key might be kept in redis for longer in order to serve
+    stale values."""
+
+    filled_at = time.time()
+
+    return CacheEntry(
+        entity=entity,
+        filled_at=filled_at,
+        expires_at=filled_at + expire_in_seconds,
+        delta=delta,
+    )
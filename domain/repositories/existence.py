@@ -0,0 +1,274 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import aioredis
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from aioredis.commands import Pipeline
+from domain.redis_cluster import get_node, run_by_slot
+from domain.redis_pool import redis_client
+
+from .backends import wait_for_command
+from .bloom import BloomFilter, get_parameters, get_positions
+
+logger = logging.getLogger(__name__)
+
+# sets the bits at the positions in ARGV of the bitmap in KEYS[1], when it
+# exists, the bitmaps that don't exist yet will be built from the table,
+# setting bits would create one that is missing most of the ids
+SET_BITS_IF_EXISTS_SCRIPT = """
+if redis.call("EXISTS", KEYS[1]) == 0 then
+    return 0
+end
+
+for _, position in ipairs(ARGV) do
+    redis.call("SETBIT", KEYS[1], position, 1)
+end
+
+return 1
+"""
+
+# filters of the ids in the tables of the repositories with EXISTENCE_FILTER,
+# they are only used once they are loaded, see load_existence_filters
+_filters: Dict[str, BloomFilter] = {}
+# biggest primary key read from the table of each filter, and the repository
+# of each filter, see catch_up_existence_filters
+_max_pks: Dict[str, Any] = {}
+_repository_classes: Dict[str, Any] = {}
+# ids created by the other processes while the filters are being loaded,
+# they are added to the filters once they are loaded
+_pending_ids: Dict[str, List[str]] = {}
+
+
+def get_existence_filter(entity_class: Any) -> Optional[BloomFilter]:
+    return _filters.get(entity_class.__name__)
+
+
+def _get_parameters(repository_class: Any) -> Tuple[int, int]:
+    return get_parameters(
+        repository_class.EXISTENCE_FILTER_CAPACITY,
+        repository_class.EXISTENCE_FILTER_ERROR_RATE,
+    )
+
+
+def _get_redis_key(repository_class: Any) -> str:
+    size_in_bits, number_of_hashes = _get_parameters(repository_class)
+
+    # the parameters are part of the key, so changing them gives us a new
+    # bitmap instead of reading one with a different layout, the hash tag
+    # keeps it in the same slot as its max pk
+    return (
+        f"existence:{{{repository_class.entity_class.__name__}:"
+        f"{size_in_bits}:{number_of_hashes}}}"
+    )
+
+
+def _get_max_pk_key(key: str) -> str:
+    return f"{key}:max-pk"
+
+
+def _get_path(repository_class: Any) -> Optional[str]:
+    if not settings.EXISTENCE_FILTERS_DIR:
+        return None
+
+    return os.path.join(
+        settings.EXISTENCE_FILTERS_DIR,
+        f"{repository_class.entity_class.__name__}.bloom",
+    )
+
+
+@sync_to_async
+def _read_pks(repository_class: Any, after: Any = None) -> List[Any]:
+    queryset = repository_class.model_class.objects.all()
+
+    if after is not None:
+        queryset = queryset.filter(pk__gt=after)
+
+    return list(queryset.values_list("pk", flat=True).iterator())
+
+
+async def build_existence_filter(repository_class: Any) -> Tuple[BloomFilter, Any]:
+    """Builds the filter from a scan of the table, returns it with the biggest
+    primary key that was added."""
+
+    bloom_filter = BloomFilter(*_get_parameters(repository_class))
+    pks = await _read_pks(repository_class)
+
+    bloom_filter.update(pks)
+
+    return bloom_filter, max(pks, default=None)
+
+
+async def save_existence_filter(
+    repository_class: Any, bloom_filter: BloomFilter, max_pk: Any
+) -> None:
+    """Stores the filter in redis (as a bitmap, that is kept up to date by
+    add_to_existence_filters) and in EXISTENCE_FILTERS_DIR, when set."""
+
+    path = _get_path(repository_class)
+
+    if path is not None:
+        bloom_filter.save(path, max_pk)
+
+    if settings.CACHE_BACKEND == "redis":
+        key = _get_redis_key(repository_class)
+
+        async with redis_client() as redis:
+            # both keys have the same hash tag
+            node = await get_node(redis, key)
+            pipeline = node.multi_exec()
+            pipeline.set(key, bloom_filter.to_bytes())
+            pipeline.set(_get_max_pk_key(key), json.dumps(max_pk))
+
+            await pipeline.execute()
+
+
+async def _load_saved_filter(
+    repository_class: Any,
+) -> Tuple[Optional[BloomFilter], Any]:
+    if settings.CACHE_BACKEND == "redis":
+        key = _get_redis_key(repository_class)
+
+        async with redis_client() as redis:
+            bits, max_pk = await redis.mget(key, _get_max_pk_key(key))
+
+        if bits is not None and max_pk is not None:
+            return (
+                BloomFilter(*_get_parameters(repository_class), bits),
+                json.loads(max_pk),
+            )
+
+    path = _get_path(repository_class)
+
+    if path is not None and os.path.exists(path):
+        return BloomFilter.load(path)
+
+    return None, None
+
+
+async def load_existence_filter(repository_class: Any) -> BloomFilter:
+    """Loads the filter saved by another worker (or by the
+    build_existence_filters command), falling back to a scan of the table.
+    Rows inserted after it was saved are added to it."""
+
+    name = repository_class.entity_class.__name__
+
+    _pending_ids[name] = []
+
+    try:
+        bloom_filter, max_pk = await _load_saved_filter(repository_class)
+
+        if bloom_filter is None:
+            bloom_filter, max_pk = await build_existence_filter(repository_class)
+
+            await save_existence_filter(repository_class, bloom_filter, max_pk)
+        else:
+            # the primary keys only grow, so this only reads the new rows
+            pks = await _read_pks(repository_class, after=max_pk)
+
+            bloom_filter.update(pks)
+            max_pk = max(pks, default=max_pk)
+    finally:
+        pending_ids = _pending_ids.pop(name)
+
+    bloom_filter.update(pending_ids)
+
+    _filters[name] = bloom_filter
+    _max_pks[name] = max_pk
+    _repository_classes[name] = repository_class
+
+    return bloom_filter
+
+
+async def load_existence_filters(repository_classes: Iterable[Any]) -> None:
+    """Loads the filters of the given repositories, only with the redis
+    backend, since the other processes can only tell us about the rows they
+    create through the invalidation bus."""
+
+    if settings.CACHE_BACKEND != "redis":
+        return
+
+    for repository_class in repository_classes:
+        if not repository_class.EXISTENCE_FILTER:
+            continue
+
+        try:
+            await load_existence_filter(repository_class)
+        except (OSError, ValueError, aioredis.RedisError):
+            # lookups are not filtered until the filter is loaded
+            logger.exception(
+                "Unable to load the existence filter of %s",
+                repository_class.entity_class.__name__,
+            )
+
+
+async def catch_up_existence_filters() -> None:
+    """Adds the rows inserted since the filters were loaded (or since the last
+    call), this is used when we might have missed the messages telling us
+    about them."""
+
+    for name, repository_class in list(_repository_classes.items()):
+        pks = await _read_pks(repository_class, after=_max_pks[name])
+
+        _filters[name].update(pks)
+        _max_pks[name] = max(pks, default=_max_pks[name])
+
+
+def update_existence_filter(name: str, ids: Iterable[str]) -> None:
+    """Adds ids to the local filter of the given entity class, if it has one,
+    this is used for the ids created by the other processes."""
+
+    ids = list(ids)
+    bloom_filter = _filters.get(name)
+
+    if bloom_filter is not None:
+        bloom_filter.update(ids)
+
+    # the filter that is being loaded might not have them
+    if name in _pending_ids:
+        _pending_ids[name].extend(ids)
+
+
+async def add_to_existence_filters(ids_by_repository_class: Dict[Any, Iterable[str]]):
+    """Adds the ids of rows that were (possibly) created to the local filters
+    and to the redis bitmaps, so that workers that load the filters later
+    see them too."""
+
+    positions_by_key = {}
+
+    for repository_class, ids in ids_by_repository_class.items():
+        if not repository_class.EXISTENCE_FILTER:
+            continue
+
+        ids = list(ids)
+
+        update_existence_filter(repository_class.entity_class.__name__, ids)
+
+        parameters = _get_parameters(repository_class)
+
+        positions_by_key[_get_redis_key(repository_class)] = [
+            position for id in ids for position in get_positions(id, *parameters)
+        ]
+
+    if not positions_by_key or settings.CACHE_BACKEND != "redis":
+        return
+
+    keys = list(positions_by_key)
+
+    def set_bits(pipeline: Pipeline, indexes: List[int]) -> asyncio.Future:
+        return asyncio.gather(
+            *(
+                pipeline.eval(
+                    SET_BITS_IF_EXISTS_SCRIPT,
+                    keys=[keys[index]],
+                    args=positions_by_key[keys[index]],
+                )
+                for index in indexes
+            )
+        )
+
+    async with redis_client() as redis:
+        await wait_for_command(run_by_slot(redis, keys, set_bits))
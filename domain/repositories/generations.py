@@ -0,0 +1,77 @@
+import time
+from typing import Dict, Iterable, List, Tuple, Type
+
+from django.db.models.base import Model
+
+from .backends import CacheBackend
+
+# how long we trust the generations we have read, bumping a generation
+# takes up to this long to be seen by the other processes
+GENERATION_MAX_AGE_IN_SECONDS = 1.0
+
+_generations: Dict[str, Tuple[float, int]] = {}
+
+
+def _get_generation_key(name: str) -> str:
+    return f"generation:{name}"
+
+
+async def get_generation(backend: CacheBackend, name: str) -> int:
+    cached = _generations.get(name)
+
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+
+    (value,) = await backend.get_many([_get_generation_key(name)])
+    generation = int(value or 0)
+
+    _generations[name] = (time.monotonic() + GENERATION_MAX_AGE_IN_SECONDS, generation)
+
+    return generation
+
+
+async def bump_generation(backend: CacheBackend, name: str) -> int:
+    """Bumps the generation of the given entity class name, which means that
+    all of its cached values are ignored from now on (and they'll expire
+    on their own)."""
+
+    generation = await backend.incr(_get_generation_key(name))
+
+    _generations[name] = (time.monotonic() + GENERATION_MAX_AGE_IN_SECONDS, generation)
+
+    return generation
+
+
+# tables have their own generations, which are bumped every time one of their
+# rows changes, so that we can cache lists of ids (see
+# BaseCacheRepository._get_cached_ids)
+def _get_table_generation_name(table: str) -> str:
+    return f"table:{table}"
+
+
+async def get_table_version(backend: CacheBackend, model_class: Type[Model]) -> int:
+    return await get_generation(
+        backend, _get_table_generation_name(model_class._meta.db_table)
+    )
+
+
+async def delete_and_bump_table_versions(
+    backend: CacheBackend, keys: List[str], tables: Iterable[str]
+) -> None:
+    """Deletes the keys and bumps the versions of the tables in one call,
+    which is what the invalidations of a transaction do."""
+
+    names = [_get_table_generation_name(table) for table in tables]
+
+    if not keys and not names:
+        return
+
+    generations = await backend.delete_and_incr_many(
+        keys, [_get_generation_key(name) for name in names]
+    )
+
+    for name, generation in zip(names, generations):
+        _generations[name] = (
+            time.monotonic() + GENERATION_MAX_AGE_IN_SECONDS,
+            generation,
+        )
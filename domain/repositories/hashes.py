@@ -0,0 +1,120 @@
+import json
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    TypeVar,
+)
+
+from domain.entities import EntityDecodeError, get_entity_decoder
+
+from .entry import CacheEntry
+from .serializers import (
+    _get_entity_data,
+    _get_field_names,
+    decompress_value,
+    is_compressed,
+)
+
+T = TypeVar("T")
+
+# name of the hash field that contains the entry metadata, entity fields
+# don't start with an underscore, so they can't clash with it
+ENTRY_FIELD = "_entry"
+
+
+def dump_hash(
+    entry: CacheEntry, compress: Optional[Callable[[bytes], bytes]] = None
+) -> Dict[str, bytes]:
+    """Returns the fields of the hash for the given entry, each field of the
+    entity is stored as its own JSON value, so that they can be fetched
+    separately. Tombstones only have the entry field.
+
+    compress is called with each value of the entity, it can return them
+    compressed with compress_value (ie. for big text fields)."""
+
+    entity_data = _get_entity_data(entry.entity)
+
+    values = {ENTRY_FIELD: dump_entry_field(entry)}
+
+    for name, value in (entity_data or {}).items():
+        values[name] = json.dumps(value).encode()
+
+        if compress is not None:
+            values[name] = compress(values[name])
+
+    return values
+
+
+def dump_entry_field(entry: CacheEntry) -> bytes:
+    """Returns the value of the entry field, which has the metadata of the
+    entry (and whether it is a tombstone) but not the entity."""
+
+    return json.dumps(
+        [entry.filled_at, entry.expires_at, entry.delta, entry.entity is None]
+    ).encode()
+
+
+def get_hash_fields(
+    entity_class: Any, fields: Optional[FrozenSet[str]] = None
+) -> Tuple[str, ...]:
+    """Returns the hash fields to fetch for the given projection, fields is
+    None when we need the whole entity."""
+
+    return (ENTRY_FIELD,) + tuple(
+        name
+        for name in _get_field_names(entity_class)
+        if fields is None or name in fields
+    )
+
+
+def load_hash(
+    values: Optional[List[Optional[bytes]]],
+    entity_class: Type[T],
+    fields: Optional[FrozenSet[str]] = None,
+) -> Optional[CacheEntry[T]]:
+    """Decodes the values returned by HMGET for the fields returned by
+    get_hash_fields, raises EntityDecodeError when they can't be decoded."""
+
+    if values is None:
+        return None
+
+    entry_value, *field_values = values
+
+    if entry_value is None:
+        return None
+
+    hash_fields = get_hash_fields(entity_class, fields)[1:]
+
+    try:
+        filled_at, expires_at, delta, is_missing = json.loads(entry_value)
+
+        if is_missing:
+            return CacheEntry(None, filled_at, expires_at, delta)
+
+        data = {}
+
+        for name, value in zip(hash_fields, field_values):
+            if value is None:
+                raise EntityDecodeError(
+                    f"{entity_class.__name__}: missing field {name!r}"
+                )
+
+            # JSON values can't start with the marker
+            if is_compressed(value):
+                data[name] = json.loads(decompress_value(value))
+            else:
+                data[name] = json.loads(value)
+    except EntityDecodeError:
+        raise
+    except (ValueError, TypeError) as e:
+        raise EntityDecodeError(f"{entity_class.__name__}: {e}") from e
+
+    entity = get_entity_decoder(entity_class, fields)(data)
+
+    return CacheEntry(entity, filled_at, expires_at, delta)
@@ -0,0 +1,84 @@
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Tuple
+
+from .local import LocalCache, get_hot_replica
+from .sketch import CountMinSketch
+
+
+class HotKeys:
+    """Counts the reads of the ids of an entity class, ids read at least
+    threshold times (see CountMinSketch for how old reads fade away) are hot,
+    hot entities are promoted to a small in-process replica, so that their
+    reads don't all end up on the redis node that owns their keys."""
+
+    def __init__(self, threshold: int, replica: LocalCache) -> None:
+        self.threshold = threshold
+        self.replica = replica
+        self.number_of_promotions = 0
+
+        self._sketch = CountMinSketch()
+        # last estimate of the ids that are (or were recently) hot, it has
+        # at most as many ids as the replica
+        self._hot: "OrderedDict[str, int]" = OrderedDict()
+
+    def record(self, ids: Iterable[str]) -> List[str]:
+        """Counts one read of each of the ids, returns the ones that are hot."""
+
+        hot_ids = []
+
+        for id in ids:
+            count = self._sketch.add(id)
+
+            if count >= self.threshold:
+                self._hot[id] = count
+                self._hot.move_to_end(id)
+
+                hot_ids.append(id)
+            elif id in self._hot:
+                # the sketch has been aged since it was hot
+                del self._hot[id]
+
+        while len(self._hot) > self.replica.max_size:
+            self._hot.popitem(last=False)
+
+        return hot_ids
+
+    def is_hot(self, id: str) -> bool:
+        return id in self._hot
+
+    def promote(self, id: str, entity: Any) -> bool:
+        """Stores the entity in the replica, returns whether it was not there
+        already."""
+
+        promoted = self.replica.get(id) is None
+
+        self.replica.set(id, entity)
+
+        if promoted:
+            self.number_of_promotions += 1
+
+        return promoted
+
+    def get_hot_keys(self, limit: int = 10) -> List[Tuple[str, int]]:
+        """Returns the hottest ids with their (last) estimated number of reads."""
+
+        return sorted(self._hot.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+
+_hot_keys: Dict[str, HotKeys] = {}
+
+
+def get_hot_keys(
+    entity_class: Any, threshold: int, max_size: int, expire_in_seconds: float
+) -> HotKeys:
+    """Returns the process wide hot keys tracker for the given entity class,
+    creating it the first time it is requested."""
+
+    name = entity_class.__name__
+
+    if name not in _hot_keys:
+        _hot_keys[name] = HotKeys(
+            threshold, get_hot_replica(entity_class, max_size, expire_in_seconds)
+        )
+
+    return _hot_keys[name]
@@ -0,0 +1,196 @@
+import logging
+import threading
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Set, Type
+
+from asgiref.sync import async_to_sync
+from django.db import transaction
+from django.db.models.base import Model
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from domain.redis_pool import run_in_thread_loop
+
+from .backends import cache_backend
+from .bus import get_invalidation_bus
+from .cache import BaseCacheRepository, _get_caching_key, get_key_prefix
+from .existence import add_to_existence_filters
+from .generations import delete_and_bump_table_versions
+from .local import get_local_caches_by_name
+from .ttl import get_access_rates
+
+logger = logging.getLogger(__name__)
+
+_repositories: Dict[str, Type[BaseCacheRepository]] = {}
+_repositories_by_model: Dict[Type[Model], Type[BaseCacheRepository]] = {}
+
+
+def get_registered_repositories() -> Dict[str, Type[BaseCacheRepository]]:
+    """Returns the registered repositories, by entity class name."""
+
+    return dict(_repositories)
+
+
+class _PendingInvalidations(threading.local):
+    def __init__(self) -> None:
+        self.ids: Dict[Any, Set[str]] = defaultdict(set)
+        # tables whose version needs to be bumped, see get_table_version
+        self.tables: Set[str] = set()
+
+
+# invalidations are collected per thread (and so per db connection) and sent
+# to redis once the transaction is committed
+_pending = _PendingInvalidations()
+
+
+async def _send_invalidations(
+    ids_by_entity_class: Dict[Any, Set[str]], tables: Set[str]
+) -> None:
+    # we do this here, so that it runs on the event loop thread, which is
+    # the one that uses the local caches
+    for entity_class, ids in ids_by_entity_class.items():
+        get_access_rates(entity_class).record_invalidations(len(ids))
+
+        for local_cache in get_local_caches_by_name(entity_class.__name__):
+            for id in ids:
+                local_cache.delete(id)
+
+    async with cache_backend() as backend:
+        keys: List[str] = []
+
+        for entity_class, ids in ids_by_entity_class.items():
+            prefix = await get_key_prefix(backend, entity_class)
+
+            keys.extend(_get_caching_key(prefix, id) for id in ids)
+
+        await delete_and_bump_table_versions(backend, keys, tables)
+
+    # saved rows might have been created
+    await add_to_existence_filters(
+        {
+            _repositories[entity_class.__name__]: ids
+            for entity_class, ids in ids_by_entity_class.items()
+        }
+    )
+
+    # this is already batched per transaction, so we send it straight away,
+    # once the entities are deleted, so that the other processes don't cache
+    # them again locally
+    if ids_by_entity_class:
+        await get_invalidation_bus().publish_now(
+            {
+                entity_class.__name__: ids
+                for entity_class, ids in ids_by_entity_class.items()
+            },
+            changed=True,
+        )
+
+
+def _flush() -> None:
+    # all the callbacks of a transaction call this, the first one sends
+    # everything, ids that were pending when a transaction was rolled back
+    # are sent with the next commit, which is harmless
+    if not _pending.ids and not _pending.tables:
+        return
+
+    ids_by_entity_class = dict(_pending.ids)
+    tables = set(_pending.tables)
+
+    _pending.ids.clear()
+    _pending.tables.clear()
+
+    send_invalidations = async_to_sync(_send_invalidations)
+
+    try:
+        main_event_loop = send_invalidations.main_event_loop
+
+        if main_event_loop is not None and main_event_loop.is_running():
+            # we are in a thread of the ASGI app
+            send_invalidations(ids_by_entity_class, tables)
+        else:
+            # async_to_sync would create a new loop, and so a new redis
+            # connection, for each transaction
+            run_in_thread_loop(_send_invalidations(ids_by_entity_class, tables))
+    except Exception:
+        # the write already happened, so we don't want to fail it, the
+        # entities will be refreshed when they expire
+        logger.exception("Unable to invalidate cached entities")
+
+
+def invalidate(model_class: Type[Model], ids: Iterable[Any]) -> None:
+    """Invalidates the cached entities of the given model once the current
+    transaction is committed (or straight away when not in a transaction)."""
+
+    repository_class = _repositories_by_model.get(model_class)
+
+    if repository_class is None:
+        return
+
+    _pending.ids[repository_class.entity_class].update(str(id) for id in ids)
+
+    transaction.on_commit(_flush)
+
+
+def invalidate_table(model_class: Type[Model]) -> None:
+    """Bumps the version of the table of the given model once the current
+    transaction is committed, which invalidates the cached id lists that
+    depend on it."""
+
+    _pending.tables.add(model_class._meta.db_table)
+
+    transaction.on_commit(_flush)
+
+
+def _on_save_or_delete(sender: Type[Model], instance: Model, **kwargs: Any) -> None:
+    invalidate(sender, [instance.pk])
+    invalidate_table(sender)
+
+
+def _on_m2m_changed(
+    sender: Any,
+    instance: Model,
+    action: str,
+    reverse: bool,
+    model: Type[Model],
+    pk_set: Set[Any],
+    **kwargs: Any,
+) -> None:
+    if not action.startswith("post_"):
+        return
+
+    invalidate(type(instance), [instance.pk])
+    invalidate_table(sender)
+
+    # pk_set is None when clearing the relation
+    if pk_set:
+        invalidate(model, pk_set)
+
+
+def register_repository(repository_class: Type[BaseCacheRepository]) -> None:
+    """Connects the signals of the repository model (and of its many to many
+    fields), so that the cached entities are invalidated every time a row
+    is created, updated or deleted. Note that queryset.update() and bulk
+    operations don't send signals."""
+
+    model_class = repository_class.model_class
+
+    _repositories[repository_class.entity_class.__name__] = repository_class
+    _repositories_by_model[model_class] = repository_class
+
+    post_save.connect(
+        _on_save_or_delete,
+        sender=model_class,
+        dispatch_uid=f"invalidate_on_save_{model_class.__name__}",
+    )
+    post_delete.connect(
+        _on_save_or_delete,
+        sender=model_class,
+        dispatch_uid=f"invalidate_on_delete_{model_class.__name__}",
+    )
+
+    for field in model_class._meta.many_to_many:
+        through = field.remote_field.through
+
+        m2m_changed.connect(
+            _on_m2m_changed,
+            sender=through,
+            dispatch_uid=f"invalidate_on_m2m_changed_{through.__name__}",
+        )
@@ -0,0 +1,106 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Generic, List, Optional, Tuple, TypeVar, Union
+
+from .tinylfu import TinyLfuCache
+
+T = TypeVar("T")
+
+
+class LocalCache(Generic[T]):
+    """In process LRU cache with a max size and a TTL, this is used as a
+    first tier in front of Redis, so it should only contain entities that
+    can be a bit stale."""
+
+    def __init__(self, max_size: int, expire_in_seconds: float) -> None:
+        self.max_size = max_size
+        self.expire_in_seconds = expire_in_seconds
+
+        self._data: "OrderedDict[str, Tuple[float, T]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str) -> Optional[T]:
+        item = self._data.get(key)
+
+        if item is None:
+            return None
+
+        expires_at, value = item
+
+        if expires_at < time.monotonic():
+            del self._data[key]
+
+            return None
+
+        self._data.move_to_end(key)
+
+        return value
+
+    def set(self, key: str, value: T) -> None:
+        self._data[key] = (time.monotonic() + self.expire_in_seconds, value)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+
+_local_caches: Dict[str, Union[LocalCache, TinyLfuCache]] = {}
+# replicas of the hot entities, see hotkeys.py
+_hot_replicas: Dict[str, LocalCache] = {}
+
+
+def get_local_cache(
+    entity_class: Any,
+    max_size: int,
+    expire_in_seconds: float,
+    max_size_in_bytes: int = 0,
+) -> Union[LocalCache, TinyLfuCache]:
+    """Returns the process wide local cache for the given entity class,
+    creating it the first time it is requested. The cache is bounded by
+    memory (using TinyLfuCache) when max_size_in_bytes is set, and by number
+    of entities otherwise."""
+
+    name = entity_class.__name__
+
+    if name not in _local_caches:
+        if max_size_in_bytes > 0:
+            _local_caches[name] = TinyLfuCache(max_size_in_bytes, expire_in_seconds)
+        else:
+            _local_caches[name] = LocalCache(max_size, expire_in_seconds)
+
+    return _local_caches[name]
+
+
+def get_hot_replica(
+    entity_class: Any, max_size: int, expire_in_seconds: float
+) -> LocalCache:
+    name = entity_class.__name__
+
+    if name not in _hot_replicas:
+        _hot_replicas[name] = LocalCache(max_size, expire_in_seconds)
+
+    return _hot_replicas[name]
+
+
+def get_local_caches_by_name(name: str) -> List[Union[LocalCache, TinyLfuCache]]:
+    """Returns the local cache and the hot replica of the given entity class,
+    if they exist, entities must be evicted from both when they change."""
+
+    return [
+        local_cache
+        for local_cache in (_local_caches.get(name), _hot_replicas.get(name))
+        if local_cache is not None
+    ]
+
+
+def clear_local_caches() -> None:
+    for local_cache in [*_local_caches.values(), *_hot_replicas.values()]:
+        local_cache.clear()
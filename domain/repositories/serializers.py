@@ -0,0 +1,196 @@
+import dataclasses
+import json
+import zlib
+from typing import Any, Dict, List, Optional, Protocol, Tuple, Type, TypeVar
+
+from django.core.exceptions import ImproperlyConfigured
+from domain.entities import EntityDecodeError, convert_data_to_entity
+
+from .entry import CacheEntry
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+T = TypeVar("T")
+
+
+class Serializer(Protocol):
+    # prefix that identifies the values written by this serializer, so that
+    # values written with different serializers can be read side by side
+    marker: bytes
+
+    def dumps(self, entry: CacheEntry) -> bytes: ...
+
+    def loads(self, value: bytes, entity_class: Type[T]) -> CacheEntry[T]: ...
+
+
+_field_names: Dict[Any, Tuple[str, ...]] = {}
+
+
+def _get_field_names(entity_class: Any) -> Tuple[str, ...]:
+    field_names = _field_names.get(entity_class)
+
+    if field_names is None:
+        field_names = _field_names[entity_class] = tuple(
+            field.name for field in dataclasses.fields(entity_class)
+        )
+
+    return field_names
+
+
+def _get_entity_data(entity: Any) -> Optional[Dict[str, Any]]:
+    # entities are flat (related entities are stored by id), so we don't
+    # need the deep copy done by dataclasses.asdict
+    if entity is None:
+        return None
+
+    return {name: getattr(entity, name) for name in _get_field_names(type(entity))}
+
+
+def _create_entry(
+    entity_data: Optional[Dict[str, Any]],
+    entity_class: Type[T],
+    filled_at: float = 0,
+    expires_at: float = 0,
+    delta: float = 0,
+) -> CacheEntry[T]:
+    entity = None
+
+    if entity_data is not None:
+        entity = convert_data_to_entity(entity_data, entity_class)
+
+    return CacheEntry(entity, filled_at, expires_at, delta)
+
+
+class JSONSerializer:
+    """Stores entries as JSON objects, this is the format we have always
+    used, so it is what the old values in redis are in."""
+
+    marker = b""
+
+    def dumps(self, entry: CacheEntry) -> bytes:
+        return json.dumps(
+            {
+                "entity": _get_entity_data(entry.entity),
+                "filled_at": entry.filled_at,
+                "expires_at": entry.expires_at,
+                "delta": entry.delta,
+            }
+        ).encode()
+
+    def loads(self, value: bytes, entity_class: Type[T]) -> CacheEntry[T]:
+        data = json.loads(value)
+
+        # values cached before we started storing entries are just the entity
+        if "entity" not in data:
+            return _create_entry(data, entity_class)
+
+        return _create_entry(
+            data["entity"],
+            entity_class,
+            data.get("filled_at", 0),
+            data.get("expires_at", 0),
+            data.get("delta", 0),
+        )
+
+
+class MsgPackSerializer:
+    """Stores entries as msgpack arrays, the entity is stored as a list of
+    values in the same order of the dataclass fields, so that field names
+    are not repeated in every value."""
+
+    marker = b"\x01"
+
+    def __init__(self) -> None:
+        if msgpack is None:
+            raise ImproperlyConfigured(
+                "msgpack needs to be installed to use the MsgPackSerializer"
+            )
+
+    def dumps(self, entry: CacheEntry) -> bytes:
+        values: Optional[List[Any]] = None
+
+        if entry.entity is not None:
+            values = [
+                getattr(entry.entity, name)
+                for name in _get_field_names(type(entry.entity))
+            ]
+
+        return self.marker + msgpack.packb(
+            [values, entry.filled_at, entry.expires_at, entry.delta]
+        )
+
+    def loads(self, value: bytes, entity_class: Type[T]) -> CacheEntry[T]:
+        values, filled_at, expires_at, delta = msgpack.unpackb(
+            value[len(self.marker) :]
+        )
+
+        entity_data = None
+
+        if values is not None:
+            field_names = _get_field_names(entity_class)
+
+            if len(values) != len(field_names):
+                raise EntityDecodeError(
+                    f"{entity_class.__name__}: expected {len(field_names)} "
+                    f"values, got {len(values)}"
+                )
+
+            entity_data = dict(zip(field_names, values))
+
+        return _create_entry(entity_data, entity_class, filled_at, expires_at, delta)
+
+
+json_serializer = JSONSerializer()
+
+# markers are one byte long, JSON values don't have a marker
+_serializers_by_marker: Dict[bytes, Serializer] = {}
+
+if msgpack is not None:
+    _serializers_by_marker[MsgPackSerializer.marker] = MsgPackSerializer()
+
+
+# values compressed by compress_value start with this marker, followed by
+# the compressed value written by one of the serializers
+COMPRESSED_MARKER = b"\x02"
+
+
+def compress_value(value: bytes, level: int = -1) -> bytes:
+    return COMPRESSED_MARKER + zlib.compress(value, level)
+
+
+def is_compressed(value: bytes) -> bool:
+    return value[:1] == COMPRESSED_MARKER
+
+
+def decompress_value(value: bytes) -> bytes:
+    try:
+        return zlib.decompress(value[len(COMPRESSED_MARKER) :])
+    except zlib.error as e:
+        raise EntityDecodeError(f"Unable to decompress value: {e}") from e
+
+
+def decode_entry(value: Any, entity_class: Type[T]) -> Optional[CacheEntry[T]]:
+    """Decodes a value written by any of the serializers, values are
+    recognised using their marker. Raises EntityDecodeError for values
+    that can't be decoded."""
+
+    if not value:
+        return None
+
+    if isinstance(value, str):
+        value = value.encode()
+
+    if is_compressed(value):
+        value = decompress_value(value)
+
+    serializer = _serializers_by_marker.get(value[:1], json_serializer)
+
+    try:
+        return serializer.loads(value, entity_class)
+    except EntityDecodeError:
+        raise
+    except (ValueError, TypeError) as e:
+        raise EntityDecodeError(f"{entity_class.__name__}: {e}") from e
@@ -0,0 +1,80 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Generic, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+Loader = Callable[[List[str]], Awaitable[Dict[str, Optional[T]]]]
+
+
+class SingleFlight(Generic[T]):
+    """Coalesces concurrent loads of the same keys, so that only one of the
+    callers does the work and the other ones await its result.
+
+    The loads are run in their own task, so cancelling one of the callers
+    doesn't cancel the load for the other ones."""
+
+    def __init__(self) -> None:
+        self._calls: Dict[str, "asyncio.Future[Dict[str, Optional[T]]]"] = {}
+
+    def _get_call(self, key: str, loop: asyncio.AbstractEventLoop):
+        call = self._calls.get(key)
+
+        # futures can't be shared across loops, so we ignore calls
+        # started on a different one (ie. when running under runserver),
+        # calls that are done have already been (or are about to be)
+        # forgotten, their results might be stale
+        if call is None or call.get_loop() is not loop or call.done():
+            return None
+
+        return call
+
+    def _forget(self, keys: List[str], call: asyncio.Future) -> None:
+        for key in keys:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+
+    async def do_many(
+        self, keys: List[str], loader: Loader
+    ) -> Tuple[Dict[str, Optional[T]], int]:
+        """Loads the given keys, returns the results and the number of keys
+        that were already being loaded by another caller. The loader is
+        only called with the keys that are not in flight."""
+
+        loop = asyncio.get_running_loop()
+
+        calls = {}
+        missing_keys = []
+
+        for key in keys:
+            call = self._get_call(key, loop)
+
+            if call is None:
+                missing_keys.append(key)
+            else:
+                calls[key] = call
+
+        coalesced = len(calls)
+
+        if missing_keys:
+            own_call = asyncio.ensure_future(loader(missing_keys))
+            own_call.add_done_callback(lambda _: self._forget(missing_keys, own_call))
+
+            for key in missing_keys:
+                self._calls[key] = own_call
+                calls[key] = own_call
+
+        results = {}
+
+        for key, call in calls.items():
+            call_results = await asyncio.shield(call)
+
+            results[key] = call_results.get(key)
+
+        return results, coalesced
+
+
+_single_flight: SingleFlight = SingleFlight()
+
+
+def get_single_flight() -> SingleFlight:
+    return _single_flight
@@ -0,0 +1,65 @@
+from array import array
+from typing import Hashable, List, Optional
+
+
+class CountMinSketch:
+    """Estimates how many times each key was added, using depth rows of width
+    counters, so it takes a fixed amount of memory however many keys there
+    are. Estimates are never lower than the real counts.
+
+    Every sample_size additions all the counters are halved, so keys that
+    were popular a while ago slowly fade away."""
+
+    def __init__(
+        self, width: int = 4096, depth: int = 4, sample_size: Optional[int] = None
+    ) -> None:
+        self.width = width
+        self.depth = depth
+        self.sample_size = sample_size or width * 10
+
+        self._rows: List[array] = [array("l", [0] * width) for _ in range(depth)]
+        self._additions = 0
+
+    def _get_indexes(self, key: Hashable) -> List[int]:
+        # each row uses a different combination of two halves of the hash
+        # (double hashing), so that keys that collide in one row are unlikely
+        # to collide in the other ones, without hashing the key more than once
+        value = hash(key)
+        low, high = value & 0xFFFFFFFF, (value >> 32) | 1
+
+        return [(low + row * high) % self.width for row in range(self.depth)]
+
+    def add(self, key: Hashable) -> int:
+        """Counts one more occurrence of the key, returns its new estimate."""
+
+        estimate = None
+
+        for row, index in zip(self._rows, self._get_indexes(key)):
+            row[index] += 1
+
+            if estimate is None or row[index] < estimate:
+                estimate = row[index]
+
+        self._additions += 1
+
+        if self._additions >= self.sample_size:
+            self._age()
+
+        return estimate or 0
+
+    def estimate(self, key: Hashable) -> int:
+        return min(row[index] for row, index in zip(self._rows, self._get_indexes(key)))
+
+    def _age(self) -> None:
+        for row in self._rows:
+            for index in range(self.width):
+                row[index] >>= 1
+
+        self._additions = 0
+
+    def clear(self) -> None:
+        for row in self._rows:
+            for index in range(self.width):
+                row[index] = 0
+
+        self._additions = 0
@@ -1,5 +1,5 @@
-from dataclasses import dataclass
-from typing import Protocol
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Protocol, Tuple
 
 
 @dataclass
@@ -7,6 +7,57 @@ class DataFetchingStats:
     number_of_sql_calls: int = 0
     number_of_redis_gets: int = 0
     number_of_redis_sets: int = 0
+    number_of_local_cache_hits: int = 0
+    # size, hit ratio and admissions of the W-TinyLFU local caches read while
+    # fetching the data, these are the ones of the process, see tinylfu.py
+    local_caches: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    number_of_existence_filter_skips: int = 0
+    number_of_hot_key_hits: int = 0
+    number_of_hot_key_promotions: int = 0
+    # hottest ids of each entity type read while fetching the data, with
+    # their estimated number of reads, and the number of promotions to the
+    # replica, these are the ones of the process, see hotkeys.py
+    hot_keys: Dict[str, List[Tuple[str, int]]] = field(default_factory=dict)
+    hot_key_promotions: Dict[str, int] = field(default_factory=dict)
+    number_of_coalesced_misses: int = 0
+    # reads sent in the same command as the reads of other requests, and
+    # keys that the other requests read too, see coalescer.py
+    number_of_coalesced_cache_reads: int = 0
+    number_of_coalesced_cache_keys: int = 0
+    number_of_lease_waits: int = 0
+    number_of_refreshes_ahead: int = 0
+    number_of_stale_hits: int = 0
+    number_of_invalid_cache_values: int = 0
+    # see breaker.py, the state, the number of state changes and the time
+    # spent open are the ones of the process
+    number_of_cache_failures: int = 0
+    number_of_degraded_fetches: int = 0
+    degraded_time_in_ms: float = 0.0
+    cache_breaker_state: str = "closed"
+    number_of_cache_breaker_state_changes: int = 0
+    cache_breaker_open_time_in_ms: float = 0.0
+    number_of_sliding_expirations: int = 0
+    # expiry picked for each entity type, see ttl.py
+    expire_in_seconds: Dict[str, int] = field(default_factory=dict)
+    redis_bytes_read: int = 0
+    number_of_id_list_hits: int = 0
+    number_of_id_list_misses: int = 0
+    number_of_cache_chunks: int = 0
+    number_of_db_chunks: int = 0
+    cache_chunks_time_in_ms: float = 0.0
+    db_chunks_time_in_ms: float = 0.0
+    compression_input_bytes: int = 0
+    compression_output_bytes: int = 0
+    compression_ratio: float = 0.0
+    compression_time_in_ms: float = 0.0
+    decompression_time_in_ms: float = 0.0
+
+    def record_compression(self, input_bytes: int, output_bytes: int) -> None:
+        self.compression_input_bytes += input_bytes
+        self.compression_output_bytes += output_bytes
+        self.compression_ratio = (
+            self.compression_input_bytes / self.compression_output_bytes
+        )
 
 
 class WithStats(Protocol):
@@ -0,0 +1,25 @@
+import asyncio
+import logging
+from typing import Awaitable, Set
+
+logger = logging.getLogger(__name__)
+
+# the event loop only keeps weak references to tasks, so we keep the
+# background ones here until they are done
+_background_tasks: Set[asyncio.Future] = set()
+
+
+def _on_done(task: asyncio.Future) -> None:
+    _background_tasks.discard(task)
+
+    if not task.cancelled() and task.exception():
+        logger.error("Background task failed", exc_info=task.exception())
+
+
+def run_in_background(awaitable: Awaitable) -> asyncio.Future:
+    task = asyncio.ensure_future(awaitable)
+
+    _background_tasks.add(task)
+    task.add_done_callback(_on_done)
+
+    return task
@@ -0,0 +1,261 @@
+import sys
+import time
+from collections import OrderedDict
+from itertools import chain
+from typing import Any, Dict, Generic, Optional, Set, Tuple, TypeVar
+
+from .sketch import CountMinSketch
+
+T = TypeVar("T")
+
+# share of the memory used by the window, which gives new entities a chance
+# to build up some frequency before competing with the main segment
+WINDOW_RATIO = 0.01
+# share of the main segment used by the entities that were hit at least once
+# since they got in
+PROTECTED_RATIO = 0.8
+
+# values that don't reference other objects
+_SCALAR_TYPES = (str, bytes, int, float, bool, type(None))
+
+
+def get_size_in_bytes(value: Any, seen: Optional[Set[int]] = None) -> int:
+    """Returns the memory used by the value and by everything it references
+    (ie. the values of the fields of an entity), objects referenced more than
+    once are only counted once."""
+
+    if isinstance(value, _SCALAR_TYPES):
+        return sys.getsizeof(value)
+
+    if seen is None:
+        seen = set()
+
+    if id(value) in seen:
+        return 0
+
+    seen.add(id(value))
+
+    size = sys.getsizeof(value)
+
+    if isinstance(value, dict):
+        size += sum(
+            get_size_in_bytes(key, seen) + get_size_in_bytes(item, seen)
+            for key, item in value.items()
+        )
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(get_size_in_bytes(item, seen) for item in value)
+    elif hasattr(value, "__dict__"):
+        # attribute names are shared by all the instances of the class
+        attributes = vars(value)
+
+        size += sys.getsizeof(attributes) + sum(
+            get_size_in_bytes(item, seen) for item in attributes.values()
+        )
+
+    return size
+
+
+# expiry, value and size in bytes (of the key and the value)
+Item = Tuple[float, Any, int]
+
+
+class TinyLfuCache(Generic[T]):
+    """In process cache bounded by the memory used by its entities, using the
+    W-TinyLFU policy: new entities go to a small LRU window, when they leave
+    it they are only admitted to the main segment (a segmented LRU) if they
+    have been accessed more often than the entity they would evict. So a scan
+    of ids that are only read once can't evict the hot entities, which is
+    what happens with a plain LRU.
+
+    It has the same interface as LocalCache, so it can be used in its place."""
+
+    def __init__(
+        self,
+        max_size_in_bytes: int,
+        expire_in_seconds: float,
+        sketch_width: int = 16384,
+    ) -> None:
+        self.max_size_in_bytes = max_size_in_bytes
+        self.expire_in_seconds = expire_in_seconds
+
+        self.window_max_size_in_bytes = max(1, int(max_size_in_bytes * WINDOW_RATIO))
+        self.main_max_size_in_bytes = max_size_in_bytes - self.window_max_size_in_bytes
+        self.protected_max_size_in_bytes = int(
+            self.main_max_size_in_bytes * PROTECTED_RATIO
+        )
+
+        self._sketch = CountMinSketch(width=sketch_width)
+
+        self._window: "OrderedDict[str, Item]" = OrderedDict()
+        self._probation: "OrderedDict[str, Item]" = OrderedDict()
+        self._protected: "OrderedDict[str, Item]" = OrderedDict()
+
+        self._window_size_in_bytes = 0
+        self._probation_size_in_bytes = 0
+        self._protected_size_in_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.admissions = 0
+        self.rejections = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._window) + len(self._probation) + len(self._protected)
+
+    @property
+    def size_in_bytes(self) -> int:
+        return (
+            self._window_size_in_bytes
+            + self._probation_size_in_bytes
+            + self._protected_size_in_bytes
+        )
+
+    @property
+    def hit_ratio(self) -> float:
+        requests = self.hits + self.misses
+
+        return self.hits / requests if requests else 0.0
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self),
+            "size_in_bytes": self.size_in_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hit_ratio,
+            "admissions": self.admissions,
+            "rejections": self.rejections,
+            "evictions": self.evictions,
+        }
+
+    def _pop(self, key: str) -> Optional[Item]:
+        if key in self._window:
+            item = self._window.pop(key)
+            self._window_size_in_bytes -= item[2]
+        elif key in self._probation:
+            item = self._probation.pop(key)
+            self._probation_size_in_bytes -= item[2]
+        elif key in self._protected:
+            item = self._protected.pop(key)
+            self._protected_size_in_bytes -= item[2]
+        else:
+            return None
+
+        return item
+
+    def get(self, key: str) -> Optional[T]:
+        self._sketch.add(key)
+
+        if key in self._window:
+            item = self._window[key]
+            self._window.move_to_end(key)
+        elif key in self._probation:
+            item = self._probation[key]
+        elif key in self._protected:
+            item = self._protected[key]
+            self._protected.move_to_end(key)
+        else:
+            self.misses += 1
+
+            return None
+
+        expires_at, value, size_in_bytes = item
+
+        if expires_at < time.monotonic():
+            self._pop(key)
+            self.misses += 1
+
+            return None
+
+        if key in self._probation:
+            # it was hit after getting in, so it's worth protecting
+            del self._probation[key]
+            self._probation_size_in_bytes -= size_in_bytes
+
+            self._protected[key] = item
+            self._protected_size_in_bytes += size_in_bytes
+
+            self._demote_protected()
+
+        self.hits += 1
+
+        return value
+
+    def set(self, key: str, value: T) -> None:
+        size_in_bytes = get_size_in_bytes(key) + get_size_in_bytes(value)
+        item = (time.monotonic() + self.expire_in_seconds, value, size_in_bytes)
+
+        # the access was already counted by the get that missed it
+        self._pop(key)
+
+        if size_in_bytes > self.main_max_size_in_bytes:
+            self.rejections += 1
+
+            return
+
+        self._window[key] = item
+        self._window_size_in_bytes += size_in_bytes
+
+        while self._window_size_in_bytes > self.window_max_size_in_bytes:
+            candidate_key, candidate = self._window.popitem(last=False)
+            self._window_size_in_bytes -= candidate[2]
+
+            self._admit(candidate_key, candidate)
+
+    def _demote_protected(self) -> None:
+        while self._protected_size_in_bytes > self.protected_max_size_in_bytes:
+            key, item = self._protected.popitem(last=False)
+            self._protected_size_in_bytes -= item[2]
+
+            self._probation[key] = item
+            self._probation_size_in_bytes += item[2]
+
+    def _admit(self, key: str, item: Item) -> None:
+        """Moves an entity that left the window to the main segment, if it is
+        accessed more often than the entities it would evict."""
+
+        size_in_bytes = item[2]
+        frequency = self._sketch.estimate(key)
+        victims = []
+        freed_in_bytes = 0
+
+        main_size_in_bytes = (
+            self._probation_size_in_bytes + self._protected_size_in_bytes
+        )
+        available_in_bytes = self.main_max_size_in_bytes - main_size_in_bytes
+
+        # probation is evicted first, in LRU order
+        candidates = chain(self._probation.items(), self._protected.items())
+
+        while available_in_bytes + freed_in_bytes < size_in_bytes:
+            victim_key, victim = next(candidates)
+
+            if self._sketch.estimate(victim_key) >= frequency:
+                self.rejections += 1
+
+                return
+
+            victims.append(victim_key)
+            freed_in_bytes += victim[2]
+
+        for victim_key in victims:
+            self._pop(victim_key)
+
+        self.evictions += len(victims)
+        self.admissions += 1
+
+        self._probation[key] = item
+        self._probation_size_in_bytes += size_in_bytes
+
+    def delete(self, key: str) -> None:
+        self._pop(key)
+
+    def clear(self) -> None:
+        self._window.clear()
+        self._probation.clear()
+        self._protected.clear()
+
+        self._window_size_in_bytes = 0
+        self._probation_size_in_bytes = 0
+        self._protected_size_in_bytes = 0
@@ -0,0 +1,83 @@
+import time
+from typing import Any, Dict, Tuple
+
+# how long it takes for old reads and invalidations to count half as much
+HALF_LIFE_IN_SECONDS = 10 * 60
+# until we have seen this many reads and invalidations, the default expiry
+# is used
+MIN_SAMPLES = 100
+# an invalidation counts as many reads, so that entities that are read ten
+# times between changes are considered volatile
+INVALIDATION_WEIGHT = 10
+
+
+class AccessRates:
+    """Exponentially decayed counts of the reads and invalidations of the
+    entities of an entity class."""
+
+    def __init__(self, half_life_in_seconds: float = HALF_LIFE_IN_SECONDS) -> None:
+        self.half_life_in_seconds = half_life_in_seconds
+
+        self._reads = 0.0
+        self._invalidations = 0.0
+        self._updated_at = time.monotonic()
+
+    def _decay(self) -> None:
+        now = time.monotonic()
+        factor = 0.5 ** ((now - self._updated_at) / self.half_life_in_seconds)
+
+        self._reads *= factor
+        self._invalidations *= factor
+        self._updated_at = now
+
+    def record_reads(self, count: int = 1) -> None:
+        self._decay()
+        self._reads += count
+
+    def record_invalidations(self, count: int = 1) -> None:
+        self._decay()
+        self._invalidations += count
+
+    def get_counts(self) -> Tuple[float, float]:
+        self._decay()
+
+        return self._reads, self._invalidations
+
+    def get_stability(self) -> float:
+        """Returns a number between 0 (every read is followed by a change)
+        and 1 (entities are never changed)."""
+
+        reads, invalidations = self.get_counts()
+
+        if not reads:
+            return 0.0
+
+        return reads / (reads + invalidations * INVALIDATION_WEIGHT)
+
+
+def get_adaptive_expire_in_seconds(
+    rates: AccessRates, default: int, minimum: int, maximum: int
+) -> int:
+    """Picks an expiry between minimum and maximum, the more stable the
+    entities are, the longer they are kept."""
+
+    reads, invalidations = rates.get_counts()
+
+    if reads + invalidations < MIN_SAMPLES:
+        return default
+
+    return round(minimum + (maximum - minimum) * rates.get_stability())
+
+
+_access_rates: Dict[str, AccessRates] = {}
+
+
+def get_access_rates(entity_class: Any) -> AccessRates:
+    return get_access_rates_by_name(entity_class.__name__)
+
+
+def get_access_rates_by_name(name: str) -> AccessRates:
+    if name not in _access_rates:
+        _access_rates[name] = AccessRates()
+
+    return _access_rates[name]